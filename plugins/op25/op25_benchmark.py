@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# Run from the repository root: python2 -B plugins/op25/op25_benchmark.py -r 1000000 capture.cu8
+
+# Copyright 2020 Scott Maday
+
+# Headless demod/decode throughput benchmark
+# An IQ recording is pushed through the same p25_demod_cb and p25_decoder_sink_b the receiver uses, as fast as the
+# flowgraph can take it, and the throughput is reported as samples per second and as a real-time factor
+
+import os, sys, json, time
+from optparse import OptionParser
+
+from gnuradio import gr, blocks
+
+from op25_iq_source import *
+
+BENCHMARK_APPS_DIR		= "~/op25/op25/gr-op25_repeater/apps"
+BENCHMARK_DEMOD_TYPES	= ["cqpsk", "fsk4"]
+BENCHMARK_IF_RATE		= 24000
+BENCHMARK_SYMBOL_RATE	= 4800
+BENCHMARK_RX_QUEUE_LIMIT	= 100
+BENCHMARK_UDP_PORT		= 23456
+
+
+# Makes the op25 apps modules importable, the same way plugin_op25 does
+def add_apps_dir(apps_dir):
+	apps_dir = os.path.expanduser(apps_dir)
+	if not os.path.isdir(apps_dir):
+		raise IOError("'%s' was not found or not a directory, but is needed for op25/gr-op25_repeater/apps modules" % apps_dir)
+	for apps_subdir_name in next(os.walk(apps_dir))[1]:
+		sys.path.append(os.path.join(apps_dir, apps_subdir_name))
+	sys.path.append(apps_dir)
+
+
+# Each device stand-in is its own unthrottled replay of the recording, and channels are spread over them round robin
+# With channelize the channels of a device share one p25_channelizer instead of each translating the whole capture
+class benchmark_rx_block(gr.top_block):
+	def __init__(self, iq_file, sample_rate, file_format = None, demod_type = "cqpsk", offset = 0, seconds = None, channels = 1, devices = 1, channelize = False):
+		gr.top_block.__init__(self)
+		from op25_channel import p25_rx_chain
+		from op25_channelizer import p25_channelizer
+
+		self.sources = []
+		self.chains = []
+		for i in range(max(1, min(devices, channels))):
+			source = iq_file_source(iq_file, sample_rate, file_format, throttle = False)
+			samples = source.get_samples()
+			if seconds:
+				samples = min(samples, int(seconds * sample_rate))
+			head = blocks.head(gr.sizeof_gr_complex, samples)
+			self.connect(source, head)
+			if channelize:
+				num_outputs = len(range(i, channels, max(1, min(devices, channels))))
+				head_channelizer = p25_channelizer(sample_rate, num_outputs)
+				self.connect(head, head_channelizer)
+				head = head_channelizer
+			self.sources.append((source, head))
+		self.samples = samples
+		for i in range(channels):
+			source, head = self.sources[i % len(self.sources)]
+			input_rate = sample_rate
+			relative_freq = -offset		# the demod's relative frequency is the center minus the channel
+			if channelize:
+				output = i // len(self.sources)
+				input_rate = head.output_rate
+				relative_freq = -head.tune(output, offset)
+				head = (head, output)
+			chain = p25_rx_chain(	input_rate = input_rate,
+									rx_q = gr.msg_queue(BENCHMARK_RX_QUEUE_LIMIT),
+									demod_type = demod_type,
+									relative_freq = relative_freq,
+									offset = 0,
+									if_rate = BENCHMARK_IF_RATE,
+									symbol_rate = BENCHMARK_SYMBOL_RATE,
+									udp_port = BENCHMARK_UDP_PORT + 2 * i
+								)
+			self.connect(head, chain)
+			self.chains.append(chain)
+###
+
+
+# Runs the flowgraph to the end of the recording and returns the measurements
+def run_benchmark(iq_file, sample_rate, file_format = None, demod_type = "cqpsk", offset = 0, seconds = None, channels = 1, devices = 1, channelize = False):
+	tb = benchmark_rx_block(iq_file, sample_rate, file_format, demod_type, offset, seconds, channels, devices, channelize)
+	start_times = os.times()
+	start_time = time.time()
+	tb.run()
+	wall_time = time.time() - start_time
+	end_times = os.times()
+	cpu_time = (end_times[0] - start_times[0]) + (end_times[1] - start_times[1])
+	duration = float(tb.samples) / sample_rate
+	return {
+		"file":				iq_file,
+		"format":			tb.sources[0][0].file_format,
+		"sample_rate":		sample_rate,
+		"channels":			len(tb.chains),
+		"devices":			len(tb.sources),
+		"channelizer":		channelize,
+		"samples":			tb.samples,
+		"duration":			duration,
+		"wall_time":		wall_time,
+		"cpu_time":			cpu_time,
+		"samples_per_sec":	tb.samples / wall_time if wall_time > 0 else 0,
+		"realtime_factor":	duration / wall_time if wall_time > 0 else 0,
+		"cpu_per_sec":		cpu_time / duration if duration > 0 else 0,		# cpu seconds needed for each second of signal
+		"cpu_per_channel":	cpu_time / duration / len(tb.chains) if duration > 0 else 0
+	}
+
+
+def main():
+	parser = OptionParser(usage="%prog [options] IQ_FILE")
+	parser.add_option("-r", "--sample-rate", type="int", default=None, help="Sample rate the recording was made at")
+	parser.add_option("-f", "--format", type="choice", choices=IQ_FILE_FORMATS, default=None, help="IQ sample format (%s). Guessed from the file extension if not given" % ", ".join(IQ_FILE_FORMATS))
+	parser.add_option("-d", "--demod-type", type="choice", choices=BENCHMARK_DEMOD_TYPES, default=BENCHMARK_DEMOD_TYPES[0], help="Demodulation type")
+	parser.add_option("-o", "--offset", type="float", default=0, help="Frequency of the channel relative to the center of the recording (hz)")
+	parser.add_option("-s", "--seconds", type="float", default=None, help="Only process this many seconds of the recording")
+	parser.add_option("-c", "--channels", type="int", default=1, help="Measure every channel count from 1 up to this many")
+	parser.add_option("-n", "--devices", type="int", default=1, help="Number of device stand-ins the channels are spread over")
+	parser.add_option("-x", "--channelizer", action="store_true", default=False, help="Also measure the channels sharing a channelizer, against each translating the capture itself")
+	parser.add_option("-a", "--apps-dir", type="string", default=BENCHMARK_APPS_DIR, help="Location of `op25/gr-op25_repeater/apps` directory")
+	parser.add_option("-j", "--json", action="store_true", default=False, help="Print the results as JSON")
+	options, args = parser.parse_args()
+	if len(args) != 1 or not options.sample_rate:
+		parser.print_help()
+		sys.exit(1)
+	add_apps_dir(options.apps_dir)
+
+	results = []
+	for channelize in ([False, True] if options.channelizer else [False]):
+		for channels in range(1, max(1, options.channels) + 1):
+			results.append(run_benchmark(args[0], options.sample_rate, options.format, options.demod_type, options.offset, options.seconds, channels, options.devices, channelize))
+	if options.json:
+		print(json.dumps(results if len(results) > 1 else results[0], indent=4))
+		return None
+	result = results[0]
+	print("%s (%s, %d hz): %d samples, %.1fs of signal" % (result["file"], result["format"], result["sample_rate"], result["samples"], result["duration"]))
+	for result in results:
+		print("%2d channels on %d devices%s: %.0f samples/s, %.2fx real time, %.3f cpu s per signal s, %.3f per channel" % (result["channels"], result["devices"], " (channelized)" if result["channelizer"] else "", result["samples_per_sec"], result["realtime_factor"], result["cpu_per_sec"], result["cpu_per_channel"]))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,54 @@
+# Copyright 2020 Scott Maday
+# Copyright 2011, 2012, 2013, 2014, 2015, 2016, 2017 Max H. Parke KA1RBI
+
+# One channel's demod/decode chain. Any number of these can hang off a single source
+
+from gnuradio import gr
+
+import p25_demodulator				# apps
+import p25_decoder					# apps
+
+CHANNEL_IF_RATE				= 24000
+CHANNEL_SYMBOL_RATE			= 4800
+CHANNEL_DEFAULT_EXCESS_BW	= 0.2
+CHANNEL_DEFAULT_GAIN_MU		= 0.025
+CHANNEL_DEFAULT_COSTAS_ALPHA	= 0.04
+CHANNEL_WIRESHARK_HOST		= "127.0.0.1"
+
+
+# Takes complex samples at input_rate and puts decoded data units on rx_q
+class p25_rx_chain(gr.hier_block2):
+	def __init__(self, input_rate, rx_q, demod_type = "cqpsk", relative_freq = 0, offset = 0, if_rate = CHANNEL_IF_RATE,
+				 symbol_rate = CHANNEL_SYMBOL_RATE, excess_bw = CHANNEL_DEFAULT_EXCESS_BW, gain_mu = CHANNEL_DEFAULT_GAIN_MU,
+				 costas_alpha = CHANNEL_DEFAULT_COSTAS_ALPHA, do_imbe = True, num_ambe = 0, udp_port = 23456,
+				 audio_output = "default", nocrypt = True, debug = 0):
+		gr.hier_block2.__init__(self, "p25_rx_chain", gr.io_signature(1, 1, gr.sizeof_gr_complex), gr.io_signature(0, 0, 0))
+		self.input_rate = input_rate
+		self.rx_q = rx_q
+		self.demod = p25_demodulator.p25_demod_cb(	input_rate = input_rate,
+													demod_type = demod_type,
+													relative_freq = relative_freq,
+													offset = offset,
+													if_rate = if_rate,
+													gain_mu = gain_mu,
+													costas_alpha = costas_alpha,
+													excess_bw = excess_bw,
+													symbol_rate = symbol_rate
+												 )
+		self.decoder = p25_decoder.p25_decoder_sink_b(	dest = "audio",
+														do_imbe = do_imbe,
+														num_ambe = num_ambe,
+														wireshark_host = CHANNEL_WIRESHARK_HOST,
+														udp_port = udp_port,
+														do_msgq = True,
+														msgq = rx_q,
+														audio_output = audio_output,
+														debug = debug,
+														nocrypt = nocrypt
+													 )
+		self.connect(self, self.demod, self.decoder)
+
+	# Returns whether the relative tune was possible
+	def set_relative_frequency(self, freq):
+		return self.demod.set_relative_frequency(freq)
+###
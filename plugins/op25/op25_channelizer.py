@@ -0,0 +1,52 @@
+# Copyright 2020 Scott Maday
+
+# Splits one wideband capture into narrow bins with a polyphase filterbank so several channel chains can share it
+# Every chain then only filters and demodulates a bin at a few tens of khz instead of translating the whole capture itself
+
+from gnuradio import gr, blocks, filter
+
+CHANNELIZER_BIN_WIDTH		= 25000		# spacing of the bins (hz). A P25 channel plus the worst case offset from a bin center fits
+CHANNELIZER_OVERSAMPLE		= 2			# each bin is output at this many times the bin width
+CHANNELIZER_CUTOFF			= 0.75		# cutoff of the prototype filter as a fraction of the bin width, so a channel half a bin off center passes
+CHANNELIZER_TRANSITION		= 0.2		# transition band of the prototype filter as a fraction of the bin width
+CHANNELIZER_ATTENUATION		= 60		# stopband attenuation of the prototype filter (db)
+
+
+# Takes complex samples at input_rate and outputs num_outputs bins at output_rate
+# Which bin each output carries is set with tune, so outputs follow their channel without touching the flowgraph
+class p25_channelizer(gr.hier_block2):
+	def __init__(self, input_rate, num_outputs, bin_width = CHANNELIZER_BIN_WIDTH):
+		gr.hier_block2.__init__(self, "p25_channelizer", gr.io_signature(1, 1, gr.sizeof_gr_complex), gr.io_signature(num_outputs, num_outputs, gr.sizeof_gr_complex))
+		num_bins = int(input_rate // bin_width)
+		num_bins -= num_bins % CHANNELIZER_OVERSAMPLE	# the filterbank needs the bins to divide evenly by the oversample rate
+		if num_bins < num_outputs or num_bins < CHANNELIZER_OVERSAMPLE:
+			raise ValueError("%d hz is too narrow to be split into %d bins of %d hz" % (input_rate, num_outputs, bin_width))
+		self.input_rate = input_rate
+		self.num_bins = num_bins
+		self.bin_width = float(input_rate) / num_bins
+		self.output_rate = self.bin_width * CHANNELIZER_OVERSAMPLE
+		self.channel_map = list(range(num_outputs))
+
+		taps = filter.firdes.low_pass_2(1, input_rate, self.bin_width * CHANNELIZER_CUTOFF, self.bin_width * CHANNELIZER_TRANSITION, CHANNELIZER_ATTENUATION)
+		self.deinterleave = blocks.stream_to_streams(gr.sizeof_gr_complex, num_bins)
+		self.pfb = filter.pfb_channelizer_ccf(num_bins, taps, CHANNELIZER_OVERSAMPLE)
+		self.pfb.set_channel_map(self.channel_map)
+		self.connect(self, self.deinterleave)
+		for i in range(num_bins):
+			self.connect((self.deinterleave, i), (self.pfb, i))
+		for i in range(num_outputs):
+			self.connect((self.pfb, i), (self, i))
+
+	# Whether a frequency relative to the center of the capture is inside it
+	def covers(self, relative_freq):
+		return abs(relative_freq) < (self.input_rate - self.bin_width) / 2
+
+	# Points an output at the bin nearest to relative_freq (hz from the center of the capture)
+	# Returns what is left over for the chain to tune out inside the bin
+	def tune(self, output, relative_freq):
+		bin_index = int(round(relative_freq / self.bin_width))
+		if self.channel_map[output] != bin_index % self.num_bins:
+			self.channel_map[output] = bin_index % self.num_bins
+			self.pfb.set_channel_map(self.channel_map)
+		return relative_freq - bin_index * self.bin_width
+###
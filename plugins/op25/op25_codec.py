@@ -0,0 +1,179 @@
+# Copyright 2020 Scott Maday
+
+# Codecs for the messages passed between the receiver and the gui over gr.msg_queue
+# The codec id travels in arg1 of the gr.message, so json messages (codec 0) look exactly like the ones op25 sends
+
+import sys, json, marshal, threading
+
+CODEC_MSG_TYPE				= -4		# same message type as op25 json messages
+CODEC_DEFAULT				= "json"
+CODEC_DELTA_JSON_TYPE		= "trunk_update_delta"
+CODEC_DELTA_KEYFRAME_INTERVAL	= 30	# a full trunk_update snapshot is sent every this many updates
+
+
+# gr.message strings are std::string, which python 3 gives and takes as utf-8 text
+# Binary payloads are carried as latin-1 text so every byte survives the trip
+def to_wire(payload):
+	if sys.version_info[0] >= 3:
+		return payload.decode("latin-1")
+	return payload
+
+def from_wire(payload):
+	if sys.version_info[0] >= 3:
+		if isinstance(payload, bytes):
+			payload = payload.decode("utf-8")
+		return payload.encode("latin-1")
+	return payload
+
+
+class Message_Codec(object):
+	codec_id = None
+	name = None
+
+	def encode(self, obj):
+		raise NotImplementedError()
+
+	def decode(self, payload):
+		raise NotImplementedError()
+
+class JSON_Message_Codec(Message_Codec):
+	codec_id = 0
+	name = "json"
+
+	def encode(self, obj):
+		return json.dumps(obj)
+
+	def decode(self, payload):
+		if isinstance(payload, bytes) and sys.version_info[0] >= 3:
+			payload = payload.decode("utf-8")
+		return json.loads(payload)
+
+# Both ends of the queue live in the same interpreter, so marshal's format is always understood by the reader
+class Marshal_Message_Codec(Message_Codec):
+	codec_id = 1
+	name = "marshal"
+
+	def encode(self, obj):
+		return to_wire(marshal.dumps(obj))
+
+	def decode(self, payload):
+		return marshal.loads(from_wire(payload))
+
+MESSAGE_CODECS = [JSON_Message_Codec(), Marshal_Message_Codec()]
+MESSAGE_CODECS_BY_ID = dict((codec.codec_id, codec) for codec in MESSAGE_CODECS)
+MESSAGE_CODECS_BY_NAME = dict((codec.name, codec) for codec in MESSAGE_CODECS)
+
+
+def get_codec(name):
+	if name is None or name == "":
+		name = CODEC_DEFAULT
+	if name not in MESSAGE_CODECS_BY_NAME:
+		raise ValueError("Unknown message codec '%s'" % name)
+	return MESSAGE_CODECS_BY_NAME[name]
+
+def get_codec_by_id(codec_id):
+	return MESSAGE_CODECS_BY_ID.get(int(codec_id))
+
+# Whether a trunk_update key is a NAC. json gives unicode keys, but marshal keeps the byte str keys the receiver built,
+# and on python2 those have no isnumeric()
+def is_nac_key(key):
+	return hasattr(key, "isdigit") and key.isdigit()
+
+def encode_message(codec, obj):
+	from gnuradio import gr
+	return gr.message().make_from_string(codec.encode(obj), CODEC_MSG_TYPE, codec.codec_id, 0)
+
+def decode_message(msg):
+	codec = get_codec_by_id(msg.arg1())
+	if codec is None:
+		return None
+	return codec.decode(msg.to_string())
+
+
+# Returns the delta that turns old into new
+# Nested dictionaries are diffed recursively, anything else that changed is replaced whole
+def dict_delta(old, new):
+	delta = {"set": {}, "sub": {}, "del": [key for key in old if key not in new]}
+	for key, value in new.items():
+		if key not in old:
+			delta["set"][key] = value
+			continue
+		old_value = old[key]
+		if old_value == value:
+			continue
+		if isinstance(value, dict) and isinstance(old_value, dict):
+			delta["sub"][key] = dict_delta(old_value, value)
+		else:
+			delta["set"][key] = value
+	return delta
+
+# Returns a new dictionary with delta applied to base. Only the changed paths are copied
+def dict_apply_delta(base, delta):
+	result = dict(base)
+	for key in delta["del"]:
+		result.pop(key, None)
+	for key, value in delta["set"].items():
+		result[key] = value
+	for key, sub_delta in delta["sub"].items():
+		result[key] = dict_apply_delta(base.get(key, {}), sub_delta)
+	return result
+
+
+# Turns trunk_update snapshots into deltas against the last snapshot
+# Every delta names the sequence number it applies to, and a keyframe is sent periodically so a reader that
+# missed a message resynchronizes
+class Trunk_Update_Delta_Encoder(object):
+	def __init__(self, keyframe_interval = CODEC_DELTA_KEYFRAME_INTERVAL):
+		self.keyframe_interval = keyframe_interval
+		self._last = None
+		self._seq = 0
+		self._since_keyframe = 0
+
+	def reset(self):
+		self._last = None
+
+	def encode(self, snapshot):
+		self._seq += 1
+		if self._last is None or self._since_keyframe >= self.keyframe_interval:
+			self._last = snapshot
+			self._since_keyframe = 0
+			msg = dict(snapshot)
+			msg["seq"] = self._seq
+			return msg
+		delta = dict_delta(self._last, snapshot)
+		self._last = snapshot
+		self._since_keyframe += 1
+		return {"json_type": CODEC_DELTA_JSON_TYPE, "seq": self._seq, "base": self._seq - 1, "delta": delta}
+
+# Rebuilds full trunk_update snapshots from what Trunk_Update_Delta_Encoder sends
+class Trunk_Update_Delta_Decoder(object):
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._last = None
+		self._seq = None
+		self._metrics = {
+			"keyframes":	0,
+			"deltas":		0,
+			"skipped":		0		# deltas that did not apply to the last snapshot seen
+		}
+
+	# Returns a copy of the full trunk_update, since the reader may modify it, or None if the message can't be applied until the next keyframe
+	def decode(self, msg):
+		with self._lock:
+			if msg["json_type"] != CODEC_DELTA_JSON_TYPE:
+				seq = msg.pop("seq", None)
+				self._last = msg
+				self._seq = seq
+				self._metrics["keyframes"] += 1
+				return dict(msg)
+			if self._last is None or msg["base"] != self._seq:
+				self._metrics["skipped"] += 1
+				return None
+			self._last = dict_apply_delta(self._last, msg["delta"])
+			self._seq = msg["seq"]
+			self._metrics["deltas"] += 1
+			return dict(self._last)
+
+	def get_metrics(self):
+		with self._lock:
+			return dict(self._metrics)
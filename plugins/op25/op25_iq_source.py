@@ -0,0 +1,71 @@
+# Copyright 2020 Scott Maday
+
+# Replays IQ recordings in place of an osmosdr source so the receiver can run without radio hardware
+
+import os
+
+from gnuradio import gr, blocks
+
+IQ_FILE_FORMATS		= ["cf32", "cu8"]	# complex float (gnuradio file sink) and unsigned 8-bit interleaved (rtl_sdr)
+IQ_FILE_EXTENSIONS	= {
+	".cf32":	"cf32",
+	".cfile":	"cf32",
+	".fc32":	"cf32",
+	".cu8":		"cu8",
+	".bin":		"cu8"
+}
+IQ_FILE_SAMPLE_SIZES	= {
+	"cf32":	gr.sizeof_gr_complex,
+	"cu8":	2 * gr.sizeof_char
+}
+IQ_CU8_ZERO			= 127.5
+
+
+# Returns the format named by the file extension, or None if it isn't one we know
+def get_iq_file_format(file_name):
+	return IQ_FILE_EXTENSIONS.get(os.path.splitext(file_name)[1].lower())
+
+# Returns the number of complex samples in the file
+def get_iq_file_samples(file_name, file_format):
+	return os.path.getsize(file_name) // IQ_FILE_SAMPLE_SIZES[file_format]
+
+
+# Outputs complex samples read from an IQ recording
+# throttle paces the output at sample_rate like a device would. Without it the file is read as fast as the flowgraph can take it
+class iq_file_source(gr.hier_block2):
+	def __init__(self, file_name, sample_rate, file_format = None, repeat = False, throttle = True):
+		gr.hier_block2.__init__(self, "iq_file_source", gr.io_signature(0, 0, 0), gr.io_signature(1, 1, gr.sizeof_gr_complex))
+		if not file_format:
+			file_format = get_iq_file_format(file_name)
+		if file_format not in IQ_FILE_FORMATS:
+			raise ValueError("Unknown IQ file format '%s' for '%s'. Use one of: %s" % (file_format, file_name, ", ".join(IQ_FILE_FORMATS)))
+		self.file_name = file_name
+		self.file_format = file_format
+		self.sample_rate = sample_rate
+
+		if file_format == "cf32":
+			self.file = blocks.file_source(gr.sizeof_gr_complex, file_name, repeat)
+			last = self.file
+		elif file_format == "cu8":
+			self.file = blocks.file_source(gr.sizeof_char, file_name, repeat)
+			self.to_float = blocks.uchar_to_float()
+			self.center = blocks.add_const_ff(-IQ_CU8_ZERO)
+			self.scale = blocks.multiply_const_ff(1.0 / IQ_CU8_ZERO)
+			self.deinterleave = blocks.deinterleave(gr.sizeof_float)
+			self.to_complex = blocks.float_to_complex()
+			self.connect(self.file, self.to_float, self.center, self.scale, self.deinterleave)
+			self.connect((self.deinterleave, 0), (self.to_complex, 0))
+			self.connect((self.deinterleave, 1), (self.to_complex, 1))
+			last = self.to_complex
+		if throttle:
+			self.throttle = blocks.throttle(gr.sizeof_gr_complex, sample_rate)
+			self.connect(last, self.throttle)
+			last = self.throttle
+		self.connect(last, self)
+
+	def get_samples(self):
+		return get_iq_file_samples(self.file_name, self.file_format)
+
+	def get_duration(self):
+		return float(self.get_samples()) / self.sample_rate
+###
@@ -11,34 +11,71 @@ from gnuradio import gr
 
 from plugin_op25 import *
 from configuration import *
+from op25_codec import *
+from op25_iq_source import *
+from op25_channel import *
+from op25_channelizer import *
+from op25_retune import *
+from op25_xor_cache import *
 
-import osmosdr
 import op25							# Python dist-packages
 import op25_repeater				# Python dist-packages
 import trunking						# apps
-import p25_demodulator				# apps
-import p25_decoder					# apps
-import lfsr							# apps/tdma
 from sockaudio import audio_thread	# apps
 
 GR_IO_QUEUE_LIMIT	= 10
 GR_RX_QUEUE_LIMIT	= 100
 
 AUDIO_HOST	= "127.0.0.1"
-AUDIO_PORT	= 23456
+AUDIO_PORT	= 23456		# each channel gets its own pair of ports counting up from here
+
+OP25_DEFAULT_NAC		= 0
+OP25_PHASE1_RATE		= 4800
+OP25_PHASE2_RATE		= 6000
+
+
+# Control channel lists are given in MHz like op25's trunk.tsv, but plain hz are accepted too
+def get_frequency(s):
+	freq = float(s)
+	if freq < 1e6:
+		freq *= 1e6
+	return int(round(freq))
 
 
 class Device_Configuration(Configuration):
 	def __init__(self, log, *args):
 		self.log_proxy = log
 		super(Device_Configuration, self).__init__(*args)
+		self.src = None
+		self.assigned = False
+		self.channels = []
+		self.sample_rate = int(self["sample_rate"]) if self["sample_rate"] else 0
+		self.frequency = self["frequency"] if self["frequency"] else 0
+		self.offset = self["offset"] if self["offset"] else 0
+		self.tunable = bool(self["tunable"]) and not self["iq_file"]	# a recording's center frequency can't move
+		self.use_channelizer = self["channelizer"] != False
+		self.channelizer = None
 		if not self.struct:
 			self._log(logging.WARNING, "No structure for device configuration; cannot validate input")
 			return None
-		
-		self.assigned = False
-		
+
+		if self["iq_file"]:
+			self.__open_iq_file()
+		else:
+			self.__open_osmosdr()
+
+	def __open_iq_file(self):
+		file_name = os.path.expanduser(str(self["iq_file"]))
+		try:
+			self.src = iq_file_source(file_name, self.sample_rate, self["iq_format"], throttle = self["iq_throttle"] != False)
+		except:
+			self._log(logging.ERROR, "Could not open IQ recording '%s'", file_name)
+			return None
+		self._log(logging.INFO, "Replaying %s IQ recording '%s' (%.1fs)", self.src.file_format, file_name, self.src.get_duration())
+
+	def __open_osmosdr(self):
 		try:
+			import osmosdr
 			self.src = osmosdr.source(self["osmosdr"])
 		except:
 			self._log(logging.ERROR, "Could not load device")
@@ -47,120 +84,354 @@ class Device_Configuration(Configuration):
 		sample_rates = self.struct["sample_rate"].get_options()
 		if not self["sample_rate"] in sample_rates:
 			self._log(logging.WARNING, "Sample rate is not in the list of recommended rates. Use one of the following: %s", str(sample_rates))
+		self.sample_rate = int(self.src.set_sample_rate(self.sample_rate))
+		self.src.set_bandwidth(self.sample_rate)
+		self._log(logging.DEBUG, "Capture rate: %d", self.sample_rate)
 		# Gain
 		for gain_name in self.src.get_gain_names():
 			gain_range = self.src.get_gain_range(gain_name)
 			self._log(logging.DEBUG, "Device supports gain: %s (%d-%d,%d)", gain_name, gain_range.start(), gain_range.stop(), gain_range.step())
 			for key,value in self["gains"].items():
-				if key.lower() == gain_name.lower():
+				if key.lower() == gain_name.lower() and value != None:
 					gain = int(value)
 					self.src.set_gain(gain, gain_name)
 					self._log(logging.DEBUG, "Set %s gain to %d", gain_name, gain)
 					break
+		if self["gain_mode"] != None:
+			self.src.set_gain_mode(bool(self["gain_mode"]), 0)
+			self._log(logging.DEBUG, "Automatic gain control is set to: %s", self.src.get_gain_mode())
 		# Frequency correction
 		self.src.set_freq_corr(self["ppm"])
 		self.log_proxy(logging.DEBUG, "Set frequency correction to: %d ppm", self.src.get_freq_corr())
 		# Frequency
-		adj_freq = self.get_adjusted_freq()
-		if adj_freq > 0:
-			self.src.set_center_freq(adj_freq)
-	
+		if self.frequency > 0:
+			self.set_center_freq(self.frequency)
+
 	def _log(self, lvl, msg = None, *args, **kwargs):
 		if msg:
-			msg = ("[Device %s(%s)]: " % (str(self), self["osmosdr"])) + msg
+			msg = ("[Device %s(%s)]: " % (str(self), self["iq_file"] if self["iq_file"] else self["osmosdr"])) + msg
 		self.log_proxy(lvl, msg, *args, **kwargs)
-	
-	def get_adjusted_freq(self):
-		freq = self["frequency"]
-		ppm = self["ppm"]
-		offset = self["offset"] if self["offset"] else 0
+
+	def get_adjusted_freq(self, freq = None):
+		if freq == None:
+			freq = self.frequency
+		ppm = self["ppm"] if self["ppm"] else 0
 		if not freq:
 			return 0
-		return freq + offset + (int(round(ppm)) - ppm) * (frequency/1e6)
+		return freq + self.offset + (int(round(ppm)) - ppm) * (freq / 1e6)
+
+	# Returns whether the source was retuned
+	def set_center_freq(self, freq):
+		if not self.tunable or not self.src:
+			return False
+		if self.src.set_center_freq(self.get_adjusted_freq(freq)) == 0:
+			return False
+		self.frequency = freq
+		return True
+
+	# Whether freq can be reached by a relative tune without moving the center frequency
+	def covers(self, freq):
+		return self.frequency > 0 and abs(freq - self.frequency) < self.sample_rate / 2
+
+	# Where freq sits in the baseband of the capture (hz from its center)
+	def get_relative_freq(self, freq):
+		return freq - (self.frequency + self.offset)
+
+	# A device feeding more than one channel splits its capture once with a channelizer instead of having every
+	# chain translate the whole capture. Returns the channelizer, or None if the channels take the source directly
+	def build_channelizer(self):
+		if not self.use_channelizer or len(self.channels) < 2:
+			return None
+		self.channelizer = p25_channelizer(self.sample_rate, len(self.channels))
+		for i, chan in enumerate(self.channels):
+			chan.channelizer_output = i
+		self._log(logging.INFO, "Channelizing into %d bins of %d hz for %d channels", self.channelizer.num_bins, self.channelizer.bin_width, len(self.channels))
+		return self.channelizer
 ###
 
 
+# One demod/decode chain with its own trunking controller, data unit queue and dispatcher thread
 class Channel_Configuration(Configuration):
-	def __init__(self, log, param, device, msgq_id, rx_q):
+	def __init__(self, log, param, device, msgq_id, rx_queue_limit = GR_RX_QUEUE_LIMIT, lane_limit = DISPATCHER_LANE_LIMIT, publish = None):
 		self.log_proxy = log
+		self.publish = publish		# publish(topic, make_payload), for the plugin's event bus
 		self.device = device
 		self.msgq_id = msgq_id
-		self.rx_q = rx_q
+		self.rx_q = gr.msg_queue(rx_queue_limit)
+		self.lane_limit = lane_limit
+		self.chain = None
+		self.channelizer_output = None
+		self.trunk_rx = None
+		self.du_watcher = None
+		self.audio = None
+		self.tdma_state = False
+		self.last_freq_params = {"freq" : 0.0, "tgid" : None, "tag" : "", "tdma" : None}
+		self.retune_stats = Retune_Stats()
+		self.centering = Retune_Centering_Policy()
 		super(Channel_Configuration, self).__init__(param)
 		if not self.struct:
 			self._log(logging.WARNING, "No structure for channel configuration; cannot validate input")
 			return None
-		
-		
-	
+		self.udp_port = AUDIO_PORT + 2 * msgq_id
+		self.phase2_tdma = bool(self["phase2_tdma"])
+		self.control_channels = [get_frequency(f) for f in str(self["control_channel_list"] or "").split(",") if f.strip()]
+		self.frequency = self.control_channels[0] if self.control_channels else device.frequency
+
 	def _log(self, lvl, msg = None, *args, **kwargs):
 		if msg:
 			msg = ("[Channel %s]: " % str(self)) + msg
 		self.log_proxy(lvl, msg, *args, **kwargs)
+
+	def get_lo_freq(self, freq):
+		return self.device.offset + (self.device.frequency - freq)
+
+	def build_chain(self):
+		input_rate = self.device.sample_rate
+		relative_freq = self.get_lo_freq(self.frequency)
+		offset = self.device.offset
+		if self.device.channelizer:
+			input_rate = self.device.channelizer.output_rate
+			relative_freq = -self.device.channelizer.tune(self.channelizer_output, self.device.get_relative_freq(self.frequency))
+			offset = 0
+		self.chain = p25_rx_chain(	input_rate = input_rate,
+									rx_q = self.rx_q,
+									demod_type = self["demod_type"] or "cqpsk",
+									relative_freq = relative_freq,
+									offset = offset,
+									if_rate = self["if_rate"] or CHANNEL_IF_RATE,
+									symbol_rate = self["symbol_rate"] or CHANNEL_SYMBOL_RATE,
+									excess_bw = self["excess_bw"] or CHANNEL_DEFAULT_EXCESS_BW,
+									num_ambe = 1 if self.phase2_tdma else 0,
+									udp_port = self.udp_port,
+									debug = to_op25_verbosity()
+								 )
+		return self.chain
+
+	def to_op25_chan(self):
+		return {
+			"nac":					str(self["nac"] if self["nac"] else OP25_DEFAULT_NAC),
+			"sysname":				str(self),
+			"control_channel_list":	",".join("%f" % (freq / 1e6) for freq in self.control_channels),
+			"modulation":			self["demod_type"] or "cqpsk",
+			"center_frequency":		self.device.frequency
+		}
+
+	def start(self):
+		self.trunk_rx = trunking.rx_ctl(frequency_set = self.change_freq,
+										debug = to_op25_verbosity(),
+										chans = [self.to_op25_chan()],
+										logfile_workers = []
+										)
+		self.du_watcher = Message_Dispatcher(self.rx_q, self.trunk_rx.process_qmsg, self.lane_limit, name = "op25_channel_%d" % self.msgq_id)
+		self.trunk_rx.post_init()
+		audio_gain = self["audio_gain"] if self["audio_gain"] != None else 1.0
+		self.audio = audio_thread(AUDIO_HOST, self.udp_port, "default", False, audio_gain)
+
+	def stop(self):
+		if self.du_watcher:
+			self.du_watcher.stop()
+		if self.audio:
+			self.audio.stop()
+
+	# Called by the trunking controller when it wants to follow a control channel or a voice grant
+	def change_freq(self, params):
+		freq = params["freq"]
+		last_freq = self.last_freq_params["freq"]
+		self.last_freq_params = params
+		if freq == last_freq:
+			self.retune_stats.record(RETUNE_SAME)
+		else:
+			start_time = retune_timer()
+			decision = self.retune(freq, params["center_frequency"])
+			self.chain.decoder.reset_timer()
+			self.retune_stats.record(decision, retune_timer() - start_time)
+		self.configure_tdma(params)
+		if self.publish:
+			self.publish(OP25_TOPIC_CHANGE_FREQ, self.freq_params)
+
+	# Follows freq inside the device's passband when possible. A tunable device that has to move is centered
+	# where the following grants are likely to stay inside its passband too
+	def retune(self, freq, center_freq = None):
+		if self.device.channelizer:
+			relative_freq = self.device.get_relative_freq(freq)
+			if not self.device.channelizer.covers(relative_freq):
+				self._log(logging.WARNING, "Cannot tune to %d hz outside the shared capture around %d hz", freq, self.device.frequency)
+				return RETUNE_FAILED
+			self.chain.set_relative_frequency(-self.device.channelizer.tune(self.channelizer_output, relative_freq))
+			return RETUNE_RELATIVE
+		decision = RETUNE_RELATIVE
+		if self.device.tunable:
+			window = self.device.sample_rate / 2 - abs(self.device.offset) - RETUNE_EDGE_MARGIN
+			new_center = self.centering.choose_center(freq, self.device.frequency, center_freq, window)
+			if new_center != self.device.frequency and self.device.set_center_freq(new_center):
+				decision = RETUNE_DIRECT
+		if self.chain.set_relative_frequency(self.get_lo_freq(freq)):
+			return decision
+		if not self.device.set_center_freq(freq):		# relative tune not possible
+			self._log(logging.WARNING, "Cannot tune to %d hz from the device's center frequency %d hz", freq, self.device.frequency)
+			return RETUNE_FAILED
+		self.chain.set_relative_frequency(self.device.offset)
+		return RETUNE_FALLBACK
+
+	def configure_tdma(self, params):
+		if params["tdma"] is not None and not self.phase2_tdma:
+			self._log(logging.ERROR, "TDMA request for frequency %d failed - phase2_tdma option not enabled", params["freq"])
+			return None
+		set_tdma = params["tdma"] is not None
+		if set_tdma:
+			self.chain.decoder.set_slotid(params["tdma"])
+		if set_tdma == self.tdma_state:
+			return None	# already in desired state
+		self.tdma_state = set_tdma
+		if set_tdma:
+			hash, xor_chars = xor_mask_cache.get(params["nac"], params["sysid"], params["wacn"])
+			self.chain.decoder.set_xormask(xor_chars, hash)
+			rate = OP25_PHASE2_RATE
+		else:
+			rate = OP25_PHASE1_RATE
+		self.chain.demod.set_omega(rate)
+
+	def freq_params(self):
+		params = dict(self.last_freq_params)
+		params["json_type"] = "change_freq"
+		params["msgq_id"] = self.msgq_id
+		params["retune"] = self.retune_stats.get_report()
+		params["dispatcher"] = self.du_watcher.get_metrics() if self.du_watcher else None
+		return params
 ###
 
 
 # The P25 receiver based on multi_rx.py and adapted for plugin use
-# 
-# Many rx features such as source & save methods have been removed to reduce complexity. 
-# The intent of this is to be used as a plugin and therefore
-# features such as plot sinks and file sources/sinks have been removed
+#
+# N devices feed M channels. A tunable device serves one channel, while channels that fit in the passband of a
+# device that isn't retuned share it, split by the device's channelizer. Every channel decodes and trunks on its own threads
 class op25_multi_rx_block(gr.top_block):
-	def __init__(self, log, config):
+	def __init__(self, log, config, publish = None):
 		gr.top_block.__init__(self)
 		self.config = config
 		self.log_proxy = log
-		
+		self.publish = publish
+
 		self.devices = []
 		self.channels = []
-		
-		self.in_q = gr.msg_queue(GR_IO_QUEUE_LIMIT)
-		self.out_q = gr.msg_queue(GR_IO_QUEUE_LIMIT)
-		self.rx_q = gr.msg_queue(GR_RX_QUEUE_LIMIT)
-		
-		self._log(logging.DEBUG, "Enabling trunking")
-		"""self.trunk_rx = trunking.rx_ctl(frequency_set = self.change_freq,
-										debug = to_op25_verbosity(), 
-										slot_set = self.set_slot,
-										nbfm_ctrl = self.nbfm_control,
-										chans = self.to_op25_chans
-										)
-		self.du_watcher = DataUnit_Dispatcher(self.rx_q, self.trunk_rx.process_qmsg)"""
+
+		self.rx_queue_limit = config["rx_queue_limit"] or GR_RX_QUEUE_LIMIT
+		self.lane_limit = config["dispatch_lane_limit"] or DISPATCHER_LANE_LIMIT
+		self.input_queue = gr.msg_queue(config["io_queue_limit"] or GR_IO_QUEUE_LIMIT)
+		self.output_queue = gr.msg_queue(config["io_queue_limit"] or GR_IO_QUEUE_LIMIT)
+		self.codec = get_codec(config["message_codec"])
+		self.delta_encoder = Trunk_Update_Delta_Encoder() if config["message_delta"] else None
+
 		self.__init_devices()
 		self.__init_channels()
-		# self.trunk_rx.post_init()
-		# terminal
-	
+		xor_mask_cache.prewarm([get_channel_system(chan) for chan in self.channels if chan.phase2_tdma])
+		for dev in self.devices:
+			if dev.build_channelizer():
+				self.connect(dev.src, dev.channelizer)
+		for chan in self.channels:
+			if chan.device.channelizer:
+				self.connect((chan.device.channelizer, chan.channelizer_output), chan.build_chain())
+			else:
+				self.connect(chan.device.src, chan.build_chain())
+
 	def _log(self, lvl, msg = None, *args, **kwargs):
 		self.log_proxy(lvl, msg, *args, **kwargs)
-	
+
 	def __init_devices(self):
 		for i, config in self.config["devices"].items():
 			self._log(logging.INFO, "Found device in configuration: %s", str(config))
 			device = Device_Configuration(self._log, config)
-			if device:
+			if device.src:
 				self.devices.append(device)
-				break # remove this!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-	
+
+	# Finds the device a channel should be fed from, preferring the channel's dev_pref, then a device whose
+	# passband already covers it, then any tunable device nobody else is using
+	# Channelizing devices are shared by every channel inside their passband
+	def __find_device(self, config, freq):
+		for dev in self.devices:
+			if config["dev_pref"] and dev["name"] == config["dev_pref"] and (not dev.assigned or dev.use_channelizer and dev.covers(freq)):
+				return dev
+		for dev in self.devices:
+			if dev.covers(freq) and (not dev.assigned or dev.use_channelizer):
+				return dev
+		for dev in self.devices:
+			if not dev.assigned and dev.tunable:
+				return dev
+		return None
+
 	def __init_channels(self):
 		for i, config in self.config["channels"].items():
-			device = None
-			for dev in self.devices:
-				if not dev.assigned and dev["dev_pref"] == config["name"]:
-					device = dev
-					device.assigned = True
-					break
+			ccs = [get_frequency(f) for f in str(config["control_channel_list"] or "").split(",") if f.strip()]
+			device = self.__find_device(config, ccs[0] if ccs else 0)
 			if not device:
-				for dev in self.devices:
-					if not dev.assigned:
-						device = dev
-						device.assigned = True
-						break
-			if not device:
-				self._log(logging.WARNING, "Could not assign any device to channel")
-				return None
+				self._log(logging.WARNING, "Could not assign any device to channel '%s'", str(config))
+				continue
+			if ccs and not device.covers(ccs[0]):
+				device.set_center_freq(ccs[0])
+			if device.tunable:
+				device.assigned = True		# retuning would pull the rug out from under any other channel
+			if device.channels:
+				device.tunable = False		# shared from now on, so it stays where it is
+			chan = Channel_Configuration(self._log, config, device, len(self.channels), self.rx_queue_limit, self.lane_limit, self.publish)
+			device.channels.append(chan)
+			self.channels.append(chan)
 			self._log(logging.INFO, "Assigned device '%s' to channel '%s'", device, str(config))
-	
+
 	def to_op25_chans(self):
-		pass
-###
\ No newline at end of file
+		return [chan.to_op25_chan() for chan in self.channels]
+
+	def start(self, *args, **kwargs):
+		for chan in self.channels:
+			chan.start()
+		super(op25_multi_rx_block, self).start(*args, **kwargs)
+
+	def stop(self):
+		super(op25_multi_rx_block, self).stop()
+		for chan in self.channels:
+			chan.stop()
+
+	def get_channel(self, msgq_id):
+		msgq_id = int(msgq_id)
+		return self.channels[msgq_id] if 0 <= msgq_id < len(self.channels) else None
+
+	# Every channel's trunking state is merged into one trunk_update, so the gui sees a single snapshot
+	def get_trunk_update(self):
+		update = {"json_type": "trunk_update", "nacs": []}
+		for chan in self.channels:
+			chan_update = json.loads(chan.trunk_rx.to_json())
+			update["nacs"].extend(chan_update.pop("nacs", []))
+			update.update(chan_update)
+		return update
+
+	def trunk_update(self):
+		if len(self.channels) == 1 and self.delta_encoder is None and self.codec.codec_id == JSON_Message_Codec.codec_id:
+			js = self.channels[0].trunk_rx.to_json()	# already json, pass it through
+			return gr.message().make_from_string(js, CODEC_MSG_TYPE, self.codec.codec_id, 0)
+		update = self.get_trunk_update()
+		if self.delta_encoder is not None:
+			update = self.delta_encoder.encode(update)
+		return encode_message(self.codec, update)
+
+	def process_qmsg(self, msg):
+		# return true = end top block
+		RX_COMMANDS = "skip lockout hold whitelist reload"
+		s = msg.to_string()
+		if s == "quit":
+			return True
+		elif s == "update":
+			for chan in self.channels:
+				self.input_queue.insert_tail(encode_message(self.codec, chan.freq_params()))
+			if self.channels and all(chan.trunk_rx for chan in self.channels):
+				self.input_queue.insert_tail(self.trunk_update())
+			return False
+		chan = self.get_channel(msg.arg2())
+		if chan is None or chan.trunk_rx is None:
+			return False
+		if s == "dump_tgids":
+			chan.trunk_rx.dump_tgids()
+		elif s == "add_default_config":
+			chan.trunk_rx.add_default_config(int(msg.arg1()))
+		elif s in RX_COMMANDS:
+			chan.rx_q.insert_tail(msg)
+		return False
+###
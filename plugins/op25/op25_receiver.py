@@ -11,13 +11,16 @@ from math import pi
 from gnuradio import gr
 
 from plugin_op25 import *
+from op25_codec import *
+from op25_iq_source import *
+from op25_retune import *
+from op25_xor_cache import *
 
 import op25							# Python dist-packages
 import op25_repeater				# Python dist-packages
 import trunking						# apps
 import p25_demodulator				# apps
 import p25_decoder					# apps
-import lfsr							# apps/tdma
 from sockaudio import audio_thread	# apps
 
 OP25_OSMOSDR_SOURCES		= ["rtl", "airspy", "hackrf", "uhd"]
@@ -49,18 +52,17 @@ AUDIO_PORT	= 23456
 # The intent of this is to be used as a plugin and therefore
 # features such as plot sinks and file sources/sinks have been removed
 class gr_op25_rx_block(gr.top_block):
-	xor_cache = {}
-	
-	
 	def __init__(self, plugin_config, log):
 		gr.top_block.__init__(self)
 		self.plugin_config = plugin_config
 		self.log_proxy = log
 		
-		self.input_queue = gr.msg_queue(GR_IO_QUEUE_LIMIT)
-		self.output_queue = gr.msg_queue(GR_IO_QUEUE_LIMIT)
-		self.meta_queue = gr.msg_queue(GR_IO_QUEUE_LIMIT)
+		io_queue_limit = self["io_queue_limit"] if "io_queue_limit" in self.plugin_config else GR_IO_QUEUE_LIMIT
+		self.input_queue = gr.msg_queue(io_queue_limit)
+		self.output_queue = gr.msg_queue(io_queue_limit)
+		self.meta_queue = gr.msg_queue(io_queue_limit)
 		self.rx_queue = None
+		self.du_watcher = None
 		
 		self.demod = None
 		self.trunk_rx = None
@@ -77,6 +79,10 @@ class gr_op25_rx_block(gr.top_block):
 		self.last_change_freq = 0
 		self.last_change_freq_at = time.time()
 		self.last_freq_params = {"freq" : 0.0, "tgid" : None, "tag" : "", "tdma" : None}
+		self.tuned_center = None		# frequency the hardware is centered on, not counting the tuning offsets
+		self.target_freq = 0.0
+		self.retune_stats = Retune_Stats()
+		self.centering = Retune_Centering_Policy()
 
 		self.sps = 0.0
 		self.channel_rate = 0
@@ -89,6 +95,8 @@ class gr_op25_rx_block(gr.top_block):
 		self.nocrypt = bool(self["nocrypt"]) if "nocrypt" in self.plugin_config else True
 		self.audio_output = self["audio_output"] if "audio_output" in self.plugin_config else OP25_DEFAULT_AUDIO_OUTPUT
 		self.audio_gain = self["audio_gain"] if "audio_gain" in self.plugin_config else OP25_DEFAULT_AUDIO_GAIN
+		self.codec = get_codec(self["message_codec"] if "message_codec" in self.plugin_config else None)
+		self.delta_encoder = Trunk_Update_Delta_Encoder() if "message_delta" in self.plugin_config and self["message_delta"] else None
 		
 		if "channels" in self.plugin_config:
 			self.channels = self["channels"].as_obj()
@@ -98,9 +106,40 @@ class gr_op25_rx_block(gr.top_block):
 					chan["nac"] = "0"
 				if not "sysname" in chan:
 					chan["sysname"] = "P25 SYSTEM"
+			if self.phase2_tdma:
+				xor_mask_cache.prewarm([get_channel_system(chan) for chan in self.channels])
+		
+		self.src = None
+		self.iq_source = None
+		self.channel_rate = int(self["sample_rate"])
+		self.set_sps(OP25_DEFAULT_SPEED)
+		
+		# Set rx
+		if "iq_file" in self.plugin_config and self["iq_file"]:
+			self.set_rx_from_file()
+		else:
+			self.__open_osmosdr()
+			self.set_rx_from_osmosdr()
+		if "frequency" in self.plugin_config:
+			self.last_freq_params["freq"] = self["frequency"]
+			self.set_freq(self["frequency"])
+			self.tuned_center = self["frequency"]	# a recording is centered here too, even though there's nothing to tune
+		
+		self.trunk_rx.post_init()
 		
-		# SDR configuration
-		# This version only configures as an sdr source method to reduce complexity
+		# self.terminal = op25_terminal(self.input_queue, self.output_queue, "curses")
+		self.audio = audio_thread(AUDIO_HOST, AUDIO_PORT, self.audio_output, False, self.audio_gain)
+	
+	def __getitem__(self, key):
+		return self.plugin_config[key]
+		
+	# No clue what sps stands for. something per symbol??
+	def set_sps(self, rate):
+		self.sps = OP25_BASIC_RATE / rate
+	
+	# SDR configuration
+	# This version only configures as an sdr source method to reduce complexity
+	def __open_osmosdr(self):
 		osmosdr_args = str(self["osmosdr_args"])
 		print(osmosdr_args)
 		# Should be in a try-catch block, but we'll let the plugin handle the exception if there is one
@@ -128,32 +167,11 @@ class gr_op25_rx_block(gr.top_block):
 		if freq_corr:
 			self.src.set_freq_corr(freq_corr)
 			self.log_proxy(logging.DEBUG, "Set frequency correction to: %d ppm", freq_corr)
-	
+		
 		if "gain_mode" in self.plugin_config:
 			agc = self["gain_mode"] == True
 			self.src.set_gain_mode(agc, 0)
 			self.log_proxy(logging.DEBUG, "Automatic gain control is set to: %s", self.src.get_gain_mode())
-			
-		self.channel_rate = int(self["sample_rate"])
-		self.set_sps(OP25_DEFAULT_SPEED)
-		
-		# Set rx
-		self.set_rx_from_osmosdr()
-		if "frequency" in self.plugin_config:
-			self.last_freq_params["freq"] = self["frequency"]
-			self.set_freq(self["frequency"])
-		
-		self.trunk_rx.post_init()
-		
-		# self.terminal = op25_terminal(self.input_queue, self.output_queue, "curses")
-		self.audio = audio_thread(AUDIO_HOST, AUDIO_PORT, self.audio_output, False, self.audio_gain)
-	
-	def __getitem__(self, key):
-		return self.plugin_config[key]
-		
-	# No clue what sps stands for. something per symbol??
-	def set_sps(self, rate):
-		self.sps = OP25_BASIC_RATE / rate
 	
 	# Setup to rx from sdr source
 	def set_rx_from_osmosdr(self):
@@ -166,10 +184,19 @@ class gr_op25_rx_block(gr.top_block):
 		self.log_proxy(logging.DEBUG, "Capture rate: %d", capture_rate)		
 		# Finally
 		self.__build_graph(self.src, capture_rate)
+	
+	# Setup to rx from an IQ recording instead of an sdr. The recording's center frequency is taken as fixed, so only relative tunes happen
+	def set_rx_from_file(self):
+		file_name = os.path.expanduser(str(self["iq_file"]))
+		file_format = str(self["iq_format"]) if "iq_format" in self.plugin_config and self["iq_format"] else None
+		throttle = bool(self["iq_throttle"]) if "iq_throttle" in self.plugin_config else True
+		self.iq_source = iq_file_source(file_name, self.channel_rate, file_format, throttle = throttle)
+		self.log_proxy(logging.INFO, "Replaying %s IQ recording '%s' (%.1fs)", self.iq_source.file_format, file_name, self.iq_source.get_duration())
+		self.__build_graph(self.iq_source, self.channel_rate)
 		
 	# Setup common flow graph elements	
 	def __build_graph(self, source, capture_rate):
-		self.rx_queue = gr.msg_queue(GR_RX_QUEUE_LIMIT)
+		self.rx_queue = gr.msg_queue(self["rx_queue_limit"] if "rx_queue_limit" in self.plugin_config else GR_RX_QUEUE_LIMIT)
 		
 		# Set local oscillator frequency
 		self.lo_freq = self.offset
@@ -208,7 +235,8 @@ class gr_op25_rx_block(gr.top_block):
 										logfile_workers = logfile_workers, 
 										crypt_behavior  = self.nocrypt
 										)
-		self.du_watcher = du_queue_watcher(self.rx_queue, self.trunk_rx.process_qmsg)
+		lane_limit = self["dispatch_lane_limit"] if "dispatch_lane_limit" in self.plugin_config else DISPATCHER_LANE_LIMIT
+		self.du_watcher = Message_Dispatcher(self.rx_queue, self.trunk_rx.process_qmsg, lane_limit, name = "op25_rx")
 	
 	
 	### From rx.py ###
@@ -223,29 +251,47 @@ class gr_op25_rx_block(gr.top_block):
 		self.last_change_freq_at = time.time()
 		
 		# Ignore requests to tune to same freq
-		if freq != last_freq:
+		if freq == last_freq:
+			self.retune_stats.record(RETUNE_SAME)
+		else:
 			self.log_proxy(logging.DEBUG, "Changing frequency to: %d", freq)
-			if params["center_frequency"]:
-				relative_freq = center_freq - freq
-				if abs(relative_freq + self.offset) > self.channel_rate / 2:
-					self.lo_freq = self.offset							# relative tune not possible
-					self.demod.set_relative_frequency(self.lo_freq)		# reset demod relative freq
-					self.set_freq(freq + offset)						# direct tune instead
-				else:	
-					self.lo_freq = self.offset + relative_freq
-					if self.demod.set_relative_frequency(self.lo_freq):	# relative tune successful
-						self.demod.reset()								# reset gardner-costas loop
-						self.set_freq(center_freq + offset)
-					else:
-						self.lo_freq = self.offset						# relative tune unsuccessful
-						self.demod.set_relative_frequency(self.lo_freq)	# reset demod relative freq
-						self.set_freq(freq + offset)					# direct tune instead
-			else:
-				self.set_freq(freq + offset)
+			start_time = retune_timer()
+			decision = self.retune(freq, offset, center_freq)
 			self.decoder.reset_timer()
+			self.retune_stats.record(decision, retune_timer() - start_time)
 		self.configure_tdma(params)
 		self.freq_update()
 	
+	# How far a frequency can be from the hardware center and still be reached by the down converter
+	def get_relative_tune_window(self):
+		return self.channel_rate / 2 - abs(self.offset) - RETUNE_EDGE_MARGIN
+	
+	# Follows freq with the down converter when the hardware's center allows it, and moves the hardware otherwise
+	# The centering policy picks where the hardware goes so the following grants are likely to stay relative
+	def retune(self, freq, offset, center_freq = None):
+		decision = RETUNE_RELATIVE
+		if self.src:
+			new_center = self.centering.choose_center(freq, self.tuned_center, center_freq, self.get_relative_tune_window())
+		else:
+			new_center = self.tuned_center		# nothing to move
+		if new_center != self.tuned_center:
+			decision = RETUNE_DIRECT
+			self.set_freq(new_center + offset)
+			self.tuned_center = new_center
+		lo_freq = self.offset + (new_center - freq) if new_center else self.offset
+		if self.demod.set_relative_frequency(lo_freq):
+			self.lo_freq = lo_freq
+			if decision == RETUNE_RELATIVE:
+				self.demod.reset()								# reset gardner-costas loop, set_freq does it otherwise
+			return decision
+		self.lo_freq = self.offset								# relative tune unsuccessful
+		self.demod.set_relative_frequency(self.lo_freq)			# reset demod relative freq
+		if not self.set_freq(freq + offset):					# direct tune instead
+			self.log_proxy(logging.WARNING, "Cannot tune to %d hz", freq)
+			return RETUNE_FAILED
+		self.tuned_center = freq
+		return RETUNE_FALLBACK
+	
 	# Set the center frequency we're interested in.
 	def set_freq(self, target_freq):
 		# Tuning is a two step process.  First we ask the front-end to tune as close to the desired frequency as it can. 
@@ -262,10 +308,10 @@ class gr_op25_rx_block(gr.top_block):
 		params = self.last_freq_params
 		params["json_type"] = "change_freq"
 		params["fine_tune"] = self.fine_tune
+		params["retune"] = self.retune_stats.get_report()
+		params["dispatcher"] = self.du_watcher.get_metrics() if self.du_watcher else None
 		# params["stream_url"] = self.stream_url
-		js = json.dumps(params)
-		msg = gr.message().make_from_string(js, -4, 0, 0)
-		self.input_queue.insert_tail(msg)
+		self.input_queue.insert_tail(encode_message(self.codec, params))
 	
 	def adj_tune(self, tune_incr):
 		if self.target_freq == 0.0:
@@ -286,10 +332,8 @@ class gr_op25_rx_block(gr.top_block):
 			return	# already in desired state
 		self.tdma_state = set_tdma
 		if set_tdma:
-			hash = "%x%x%x" % (params["nac"], params["sysid"], params["wacn"])
-			if hash not in self.xor_cache:
-				self.xor_cache[hash] = lfsr.p25p2_lfsr(params["nac"], params["sysid"], params["wacn"]).xor_chars
-			self.decoder.set_xormask(self.xor_cache[hash], hash)
+			hash, xor_chars = xor_mask_cache.get(params["nac"], params["sysid"], params["wacn"])
+			self.decoder.set_xormask(xor_chars, hash)
 			rate = 6000
 		else:
 			rate = 4800
@@ -308,12 +352,21 @@ class gr_op25_rx_block(gr.top_block):
 			if self.trunk_rx is None:
 				return False	## possible race cond - just ignore
 			js = self.trunk_rx.to_json() # extract data from trunking module
-			msg = gr.message().make_from_string(js, -4, 0, 0)
+			if self.delta_encoder is None and self.codec.codec_id == JSON_Message_Codec.codec_id:
+				msg = gr.message().make_from_string(js, CODEC_MSG_TYPE, self.codec.codec_id, 0)	# already json, pass it through
+			else:
+				update = json.loads(js)
+				if self.delta_encoder is not None:
+					update = self.delta_encoder.encode(update)
+				msg = encode_message(self.codec, update)
 			self.input_queue.insert_tail(msg)
 		elif s == "set_freq":
 			freq = msg.arg1()
 			self.last_freq_params["freq"] = freq
-			self.set_freq(freq)
+			if self.set_freq(freq):
+				self.tuned_center = freq
+				self.lo_freq = self.offset
+				self.demod.set_relative_frequency(self.lo_freq)
 		elif s == "adj_tune":
 			freq = msg.arg1()
 			self.adj_tune(freq)
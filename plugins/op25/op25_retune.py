@@ -0,0 +1,96 @@
+# Copyright 2020 Scott Maday
+
+# Bookkeeping for how the receivers follow the trunking controller from one frequency to the next
+# A relative tune only moves the demod's digital down converter, while a direct tune moves the hardware and costs
+# far more, so the receivers keep statistics on both and try to stay on the relative path
+
+import threading, time
+from collections import deque, Counter
+
+RETUNE_SAME			= "same"		# asked for the frequency we're already on
+RETUNE_RELATIVE		= "relative"	# followed with the down converter alone
+RETUNE_DIRECT		= "direct"		# moved the hardware center, then tuned relative to it
+RETUNE_FALLBACK		= "fallback"	# the demod refused the relative tune, so the hardware was tuned onto the frequency
+RETUNE_FAILED		= "failed"		# the frequency could not be reached
+RETUNE_DECISIONS	= [RETUNE_SAME, RETUNE_RELATIVE, RETUNE_DIRECT, RETUNE_FALLBACK, RETUNE_FAILED]
+
+RETUNE_LATENCY_BUCKETS	= [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250]	# upper bounds (ms). One more bucket catches the rest
+RETUNE_EDGE_MARGIN		= 12500		# keep grants this far (hz) inside the edge of the capture, a P25 channel plus guard
+RETUNE_HISTORY_SIZE		= 256		# number of recent frequencies the centering policy weighs
+
+retune_timer = getattr(time, "perf_counter", time.time)
+
+
+# Counts retune decisions and keeps a latency histogram for each of them
+class Retune_Stats(object):
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._counts = dict((decision, 0) for decision in RETUNE_DECISIONS)
+		self._histograms = dict((decision, [0] * (len(RETUNE_LATENCY_BUCKETS) + 1)) for decision in RETUNE_DECISIONS)
+		self._total_time = dict((decision, 0.0) for decision in RETUNE_DECISIONS)
+		self._last = None
+
+	# latency is in seconds
+	def record(self, decision, latency = 0.0):
+		latency_ms = latency * 1000
+		bucket = len(RETUNE_LATENCY_BUCKETS)
+		for i, bound in enumerate(RETUNE_LATENCY_BUCKETS):
+			if latency_ms <= bound:
+				bucket = i
+				break
+		with self._lock:
+			self._counts[decision] += 1
+			self._histograms[decision][bucket] += 1
+			self._total_time[decision] += latency_ms
+			self._last = {"decision": decision, "latency_ms": latency_ms}
+
+	# Returns a JSON friendly summary, which the receivers put in their change_freq status messages
+	def get_report(self):
+		with self._lock:
+			tunes = sum(self._counts[decision] for decision in RETUNE_DECISIONS if decision != RETUNE_SAME)
+			return {
+				"counts":		dict(self._counts),
+				"relative_ratio":	float(self._counts[RETUNE_RELATIVE]) / tunes if tunes else 0.0,
+				"mean_ms":		dict((decision, self._total_time[decision] / self._counts[decision]) for decision in RETUNE_DECISIONS if self._counts[decision]),
+				"buckets_ms":	RETUNE_LATENCY_BUCKETS,
+				"histogram":	dict((decision, list(self._histograms[decision])) for decision in RETUNE_DECISIONS if self._counts[decision]),
+				"last":			dict(self._last) if self._last else None
+			}
+###
+
+
+# Chooses where the hardware should be centered so that most grants can be followed with a relative tune
+# The hardware stays put while a grant is inside its window. Otherwise it moves to the center that puts the most
+# recently seen frequencies inside the window along with the new one
+class Retune_Centering_Policy(object):
+	def __init__(self, history_size = RETUNE_HISTORY_SIZE):
+		self._history = deque(maxlen = history_size)
+
+	def observe(self, freq):
+		self._history.append(freq)
+
+	# window is how far (hz) a frequency can be from the center and still be reached with a relative tune
+	def choose_center(self, freq, current_center = None, preferred_center = None, window = 0):
+		self.observe(freq)
+		if current_center and abs(current_center - freq) <= window:
+			return current_center
+		if preferred_center and abs(preferred_center - freq) <= window:
+			return preferred_center
+		return self.get_best_center(freq, window)
+
+	def get_best_center(self, freq, window):
+		weights = Counter(f for f in self._history if abs(f - freq) <= 2 * window)
+		freqs = sorted(weights)
+		best_weight, best_span = 0, (freq, freq)
+		end, weight = 0, 0
+		for start in range(len(freqs)):	# slide a span no wider than the window across the frequencies around freq
+			if freqs[start] > freq:
+				break
+			while end < len(freqs) and freqs[end] - freqs[start] <= 2 * window:
+				weight += weights[freqs[end]]
+				end += 1
+			if freqs[end - 1] >= freq and weight > best_weight:
+				best_weight, best_span = weight, (freqs[start], freqs[end - 1])
+			weight -= weights[freqs[start]]
+		return int(round((best_span[0] + best_span[1]) / 2.0))
+###
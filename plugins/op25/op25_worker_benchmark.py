@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# Run from the repository root: python2 -B plugins/op25/op25_worker_benchmark.py -r 20 -s 3
+
+# Copyright 2020 Scott Maday
+
+# CPU usage of the gui worker while it waits for receiver messages
+# A synthetic producer posts trunk_update and change_freq messages into a gr.msg_queue at a fixed rate, the same way the
+# receiver does, and the process CPU time is measured for the blocking worker and for the busy polling loop it replaced
+
+import os, sys, json, time, threading
+from optparse import OptionParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "src"))
+
+from gnuradio import gr
+from PyQt5 import QtCore
+
+from op25_codec import *
+from plugin_op25_gui import GUI_Plugin_OP25_Worker, Trunk_Update_Coalescer, GUI_MSG_TYPE_JSON
+
+BENCHMARK_MODES			= ["blocking", "busy-poll"]
+BENCHMARK_QUEUE_LIMIT	= 10
+BENCHMARK_NAC			= "293"
+
+
+# The worker loop as it was before it blocked on the queue, spinning on empty_p until a message shows up
+class Busy_Poll_Worker(GUI_Plugin_OP25_Worker):
+	def run(self):
+		while self.keep_running:
+			while not self.input_queue.empty_p():
+				msg = self.input_queue.delete_head()
+				if msg.type() == GUI_MSG_TYPE_JSON:
+					obj = decode_message(msg)
+					if obj != None:
+						self.process_obj(obj)
+###
+
+
+# A trunk_update like the trunking module's to_json() with frequencies entries, the first one changing every message
+def synthetic_trunk_update(frequencies, sequence):
+	frequency_data = {}
+	for i in range(frequencies):
+		frequency_data[str(851000000 + i * 12500)] = {
+			"tgids":			[1000 + i],
+			"last_activity":	str(sequence if i == 0 else 0),
+			"counter":			sequence if i == 0 else 1
+		}
+	return {
+		"json_type":	"trunk_update",
+		BENCHMARK_NAC:	{
+			"system":			"Benchmark",
+			"wacn":				0xbee00,
+			"sysid":			0x1a2,
+			"last_tsbk":		time.time(),
+			"tsbks":			sequence,
+			"frequency_data":	frequency_data
+		}
+	}
+
+def synthetic_change_freq(sequence):
+	return {
+		"json_type":	"change_freq",
+		"freq":			851000000 + (sequence % 10) * 12500,
+		"tgid":			1000 + sequence % 10,
+		"fine_tune":	0,
+		"system":		"Benchmark"
+	}
+
+# Posts a message every 1/rate seconds until stop_event is set. One in every five is a change_freq
+def produce(input_queue, rate, frequencies, codec, stop_event):
+	sequence = 0
+	next_time = time.time()
+	while not stop_event.is_set():
+		obj = synthetic_change_freq(sequence) if sequence % 5 == 4 else synthetic_trunk_update(frequencies, sequence)
+		if not input_queue.full_p():		# the receiver drops messages the same way when the gui falls behind
+			input_queue.insert_tail(encode_message(codec, obj))
+		sequence += 1
+		next_time += 1.0 / rate
+		stop_event.wait(max(0, next_time - time.time()))
+	return sequence
+
+
+# Runs the worker against the producer for seconds and returns the measurements
+def run_benchmark(mode, rate, seconds, frequencies = 50, codec_name = None):
+	input_queue = gr.msg_queue(BENCHMARK_QUEUE_LIMIT)
+	coalescer = Trunk_Update_Coalescer()
+	worker = (Busy_Poll_Worker if mode == "busy-poll" else GUI_Plugin_OP25_Worker)(None, coalescer)
+	worker.input_queue = input_queue
+	stop_event = threading.Event()
+	producer = threading.Thread(target = produce, args = (input_queue, rate, frequencies, get_codec(codec_name), stop_event))
+	producer.daemon = True
+
+	start_times = os.times()
+	start_time = time.time()
+	worker.start()
+	producer.start()
+	time.sleep(seconds)
+	stop_event.set()
+	producer.join()
+	worker.stop()
+	worker.wait()
+	wall_time = time.time() - start_time
+	end_times = os.times()
+	cpu_time = (end_times[0] - start_times[0]) + (end_times[1] - start_times[1])
+	metrics = coalescer.get_metrics()
+	return {
+		"mode":			mode,
+		"rate":			rate,
+		"frequencies":	frequencies,
+		"wall_time":	wall_time,
+		"cpu_time":		cpu_time,
+		"cpu_percent":	100.0 * cpu_time / wall_time if wall_time > 0 else 0,	# of one core, producer included
+		"received":		metrics["received"]
+	}
+
+
+def main():
+	parser = OptionParser(usage="%prog [options]")
+	parser.add_option("-r", "--rate", type="float", default=20, help="Messages per second the producer posts")
+	parser.add_option("-s", "--seconds", type="float", default=3, help="Seconds to measure each mode for")
+	parser.add_option("-f", "--frequencies", type="int", default=50, help="Frequencies in each synthetic trunk_update")
+	parser.add_option("-c", "--codec", type="choice", choices=sorted(MESSAGE_CODECS_BY_NAME), default=CODEC_DEFAULT, help="Message codec the producer encodes with")
+	parser.add_option("-m", "--mode", type="choice", choices=BENCHMARK_MODES, action="append", default=None, help="Only measure this worker loop (%s). May be repeated" % ", ".join(BENCHMARK_MODES))
+	parser.add_option("-j", "--json", action="store_true", default=False, help="Print the results as JSON")
+	options, args = parser.parse_args()
+	if len(args) != 0:
+		parser.print_help()
+		sys.exit(1)
+	app = QtCore.QCoreApplication(sys.argv[:1])		# QThread expects an application to exist
+
+	results = [run_benchmark(mode, options.rate, options.seconds, options.frequencies, options.codec) for mode in (options.mode or BENCHMARK_MODES)]
+	if options.json:
+		print(json.dumps(results if len(results) > 1 else results[0], indent=4))
+		return None
+	for result in results:
+		print("%-9s %.0f msgs/s: cpu %.2fs / %.2fs wall (%.0f%% of a core), %d messages received" % (result["mode"], result["rate"], result["cpu_time"], result["wall_time"], result["cpu_percent"], result["received"]))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,132 @@
+# Copyright 2020 Scott Maday
+
+# P25 phase 2 scrambling masks, kept in a bounded LRU cache that survives restarts
+# Generating a mask takes long enough to lose the start of the first TDMA call of a system, so the masks of the
+# configured systems are generated ahead of time and the ones already seen are read back from disk
+
+import os, logging, threading
+from collections import OrderedDict
+
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
+
+from configuration import write_file_atomic
+
+XOR_CACHE_SIZE		= 64
+XOR_CACHE_FILE		= os.path.join(os.path.dirname(os.path.abspath(__file__)), "xor_masks.cache")
+XOR_CACHE_VERSION	= 1
+
+xor_cache_logger = logging.getLogger(__name__)
+
+
+# The same key the decoder is given along with the mask
+def get_xor_mask_key(nac, sysid, wacn):
+	return "%x%x%x" % (nac, sysid, wacn)
+
+# Returns (nac, sysid, wacn) of a configured channel, or None if it doesn't name all three
+def get_channel_system(chan):
+	try:
+		return tuple(int(str(chan[key]), 0) for key in ["nac", "sysid", "wacn"])
+	except (KeyError, TypeError, ValueError):
+		return None
+
+def generate_xor_mask(nac, sysid, wacn):
+	import lfsr		# apps/tdma
+	return lfsr.p25p2_lfsr(nac, sysid, wacn).xor_chars
+
+
+class XOR_Mask_Cache(object):
+	def __init__(self, capacity = XOR_CACHE_SIZE, file_name = XOR_CACHE_FILE):
+		self.capacity = capacity
+		self.file_name = file_name
+		self._lock = threading.Lock()
+		self._save_lock = threading.Lock()		# saves share one temporary file, so only one may write at a time
+		self._masks = OrderedDict()		# key -> mask, least recently used first
+		self._loaded = False
+		self._metrics = {
+			"hits":			0,
+			"misses":		0,
+			"evictions":	0
+		}
+
+	# Reads the masks saved by an earlier run. Anything unreadable is ignored and regenerated when needed
+	def load(self):
+		with self._lock:
+			if self._loaded:
+				return None
+			self._loaded = True
+			if not self.file_name or not os.path.isfile(self.file_name):
+				return None
+			try:
+				with open(self.file_name, "rb") as file:
+					cached = pickle.load(file)
+			except Exception:
+				xor_cache_logger.debug("XOR mask cache '%s' could not be read", self.file_name, exc_info=True)
+				return None
+			if not isinstance(cached, dict) or cached.get("version") != XOR_CACHE_VERSION:
+				return None
+			for key, mask in cached["masks"]:
+				self.__put(key, mask)
+
+	# The prewarm and dispatcher threads may save at the same time. Saves take turns, and each one snapshots the masks
+	# once it has its turn so an older snapshot never replaces a newer one. Lookups only wait for the snapshot
+	def save(self):
+		if not self.file_name:
+			return None
+		with self._save_lock:
+			with self._lock:
+				data = pickle.dumps({"version": XOR_CACHE_VERSION, "masks": list(self._masks.items())}, pickle.HIGHEST_PROTOCOL)
+			try:
+				write_file_atomic(self.file_name, data, "wb")
+			except Exception:
+				xor_cache_logger.debug("XOR mask cache '%s' could not be written", self.file_name, exc_info=True)
+
+	def __put(self, key, mask):
+		self._masks[key] = mask
+		while len(self._masks) > self.capacity:
+			self._masks.popitem(last = False)
+			self._metrics["evictions"] += 1
+
+	# Returns (key, mask) for the system, generating and saving the mask if it isn't cached
+	def get(self, nac, sysid, wacn):
+		self.load()
+		key = get_xor_mask_key(nac, sysid, wacn)
+		with self._lock:
+			mask = self._masks.pop(key, None)
+			if mask is not None:
+				self._masks[key] = mask		# most recently used again
+				self._metrics["hits"] += 1
+				return key, mask
+			self._metrics["misses"] += 1
+		mask = generate_xor_mask(nac, sysid, wacn)
+		with self._lock:
+			self.__put(key, mask)
+		self.save()
+		return key, mask
+
+	# Generates the masks of the given (nac, sysid, wacn) systems on a background thread
+	def prewarm(self, systems):
+		systems = [system for system in systems if system]
+		if not systems:
+			return None
+		def work():
+			for nac, sysid, wacn in systems:
+				try:
+					self.get(nac, sysid, wacn)
+				except Exception:
+					xor_cache_logger.warning("Could not generate the XOR mask for nac %x sysid %x wacn %x", nac, sysid, wacn, exc_info=True)
+		thread = threading.Thread(target = work, name = "xor_mask_prewarm")
+		thread.daemon = True
+		thread.start()
+		return thread
+
+	def get_metrics(self):
+		with self._lock:
+			metrics = dict(self._metrics)
+			metrics["size"] = len(self._masks)
+			return metrics
+###
+
+xor_mask_cache = XOR_Mask_Cache()
@@ -10,13 +10,29 @@
 # This plugin is a simplified version of rx.py included in op25
 
 import os, sys, logging, threading, json, time
+from collections import deque
 
 import pluginlib
 
-from plugin import Plugin
+from plugin import Plugin, event_bus
 
 PLUGIN_UPDATE_INTERVAL	= 0.5
 
+DISPATCHER_LANE_CONTROL		= 0			# control channel data units
+DISPATCHER_LANE_STATUS		= 1			# status polls, commands and timeouts
+DISPATCHER_LANES			= 2
+DISPATCHER_LANE_LIMIT		= 100
+DISPATCHER_MSG_TYPE_WAKEUP	= -101		# posted by stop() to wake the pump up
+DISPATCHER_JOIN_TIMEOUT		= 1.0
+
+dispatcher_timer = getattr(time, "perf_counter", time.time)
+
+OP25_TOPIC_CHANGE_FREQ		= "op25.change_freq"	# a channel followed the trunking controller to a frequency
+OP25_TOPIC_TRUNK_UPDATE		= "op25.trunk_update"	# every channel's trunking state merged, each PLUGIN_UPDATE_INTERVAL
+
+event_bus.register_topic(OP25_TOPIC_CHANGE_FREQ, dict, ["freq", "msgq_id"], "Parameters of a channel's new frequency, as in change_freq messages")
+event_bus.register_topic(OP25_TOPIC_TRUNK_UPDATE, dict, ["nacs"], "Merged trunking state, as in trunk_update messages")
+
 
 def to_op25_verbosity():
 	return 6 - logging.getLogger().getEffectiveLevel() // 10
@@ -27,6 +43,10 @@ def num_to_freq(num):
 		s = s + ("0" * (9 - len(s)))
 	return "%s.%s.%s" % (s[0:3], s[3:6], s[6:9])
 
+# op25 gives data units their DUID as the message type, and uses negative types for everything else
+def get_message_lane(msg):
+	return DISPATCHER_LANE_CONTROL if msg.type() >= 0 else DISPATCHER_LANE_STATUS
+
 def tgid_list_tostring(tgids):
 	tgids = list(filter(None, tgids))
 	tgids = map(str, tgids)
@@ -44,6 +64,7 @@ class Plugin_OP25(Plugin):
 		super(Plugin_OP25, self).__init__(*args)
 		# self._gui_class = GUI_Plugin_OP25
 		self.queue_watcher = None
+		self.update_publisher = None
 		self.top_block = None
 		self.keep_running = False
 	
@@ -61,7 +82,17 @@ class Plugin_OP25(Plugin):
 		from op25_multi_receiver import op25_multi_rx_block
 		global op25_multi_rx_block
 		
-		self.top_block = op25_multi_rx_block(self.log, self.plugin_config)
+		self.top_block = op25_multi_rx_block(self.log, self.plugin_config, self.publish_lazy)
+		if not self.top_block.channels:
+			self._deactivate("No channel could be assigned a device")
+			return None
+		self.top_block.start()
+		self.keep_running = True
+		self.queue_watcher = Message_Dispatcher(self.top_block.output_queue, self.process_qmsg, self.top_block.lane_limit, name = "op25_commands")
+		self.update_publisher = threading.Thread(target = self.__publish_updates, name = "op25_updates")
+		self.update_publisher.daemon = True
+		self.update_publisher.start()
+		self._log(logging.DEBUG, "OP25 plugin initalized with %d devices and %d channels", len(self.top_block.devices), len(self.top_block.channels))
 		
 		"""try:
 			self.top_block = op25_multi_rx_block(self.plugin_config, self.log)
@@ -97,24 +128,110 @@ class Plugin_OP25(Plugin):
 	def log(self, lvl, msg = None, *args, **kwargs):
 		self._log(lvl, msg, *args, **kwargs)
 	
+	# The payload is only built when somebody is subscribed to the topic
+	def publish_lazy(self, topic, make_payload):
+		if event_bus.has_subscribers(topic):
+			self.publish(topic, make_payload())
+	
+	def __publish_updates(self):
+		while self.keep_running:
+			time.sleep(PLUGIN_UPDATE_INTERVAL)
+			if self.keep_running and all(chan.trunk_rx for chan in self.top_block.channels):
+				self.publish_lazy(OP25_TOPIC_TRUNK_UPDATE, self.top_block.get_trunk_update)
+	
 	def process_qmsg(self, msg):
 		if self.top_block.process_qmsg(msg):
 			self.keep_running = False
-
-# Data unit receive queue
-class DataUnit_Dispatcher(threading.Thread):
-
-	def __init__(self, msgq,  callback, **kwds):
-		threading.Thread.__init__ (self, **kwds)
-		self.setDaemon(1)
+			self.queue_watcher.stop()
+			self.top_block.stop()
+
+# Drains a gr.msg_queue into priority lanes and hands the messages to the callback on a worker thread
+# Control channel data units (non negative types) are taken before status and command messages, and a lane that is
+# full drops its oldest message instead of holding up the queue, so a burst can't stall trunking
+class Message_Dispatcher(object):
+	def __init__(self, msgq, callback, lane_limit = DISPATCHER_LANE_LIMIT, func_lane = None, name = "dispatcher"):
 		self.msgq = msgq
 		self.callback = callback
+		self.lane_limit = lane_limit
+		self.func_lane = func_lane if func_lane else get_message_lane
+		self.name = name
 		self.keep_running = True
-		self.start()
-
-	def run(self):
-		while(self.keep_running):
+		self._cond = threading.Condition()
+		self._lanes = [deque() for i in range(DISPATCHER_LANES)]
+		self._metrics = {
+			"received":		0,
+			"dispatched":	0,
+			"errors":		0,								# callbacks that raised
+			"dropped":		[0] * DISPATCHER_LANES,		# oldest messages thrown away by a full lane
+			"max_depth":	[0] * DISPATCHER_LANES,
+			"wait_ms":		0.0,							# total time messages spent in the lanes
+			"latency_ms":	0.0,							# total time spent in the callback
+			"max_latency_ms":	0.0
+		}
+		self._pump = threading.Thread(target = self.__pump, name = name + "_pump")
+		self._worker = threading.Thread(target = self.__work, name = name)
+		for thread in [self._pump, self._worker]:
+			thread.daemon = True
+			thread.start()
+	
+	# Moves messages off the gr.msg_queue as they arrive so the flowgraph never waits on the callback
+	def __pump(self):
+		while self.keep_running:
 			msg = self.msgq.delete_head()
-			# sys.stderr.write(msg.to_string())
-			self.callback(msg)
-
+			if msg.type() == DISPATCHER_MSG_TYPE_WAKEUP:
+				continue
+			lane = self.func_lane(msg)
+			with self._cond:
+				queue = self._lanes[lane]
+				if len(queue) >= self.lane_limit:
+					queue.popleft()
+					self._metrics["dropped"][lane] += 1
+				queue.append((msg, dispatcher_timer()))
+				self._metrics["received"] += 1
+				self._metrics["max_depth"][lane] = max(self._metrics["max_depth"][lane], len(queue))
+				self._cond.notify()
+	
+	def __work(self):
+		while True:
+			with self._cond:
+				while self.keep_running and not any(self._lanes):
+					self._cond.wait()
+				if not self.keep_running:
+					return None
+				queue = next(queue for queue in self._lanes if queue)
+				msg, queued_at = queue.popleft()
+			start_time = dispatcher_timer()
+			try:
+				self.callback(msg)
+			except Exception:
+				logging.getLogger(__name__).exception("[%s]: Callback raised while handling a message", self.name)
+				self._metrics["errors"] += 1
+			latency = (dispatcher_timer() - start_time) * 1000
+			with self._cond:
+				self._metrics["dispatched"] += 1
+				self._metrics["wait_ms"] += (start_time - queued_at) * 1000
+				self._metrics["latency_ms"] += latency
+				self._metrics["max_latency_ms"] = max(self._metrics["max_latency_ms"], latency)
+	
+	# Stops both threads. The pump is blocked in delete_head, so it's woken with a message of its own
+	def stop(self, timeout = DISPATCHER_JOIN_TIMEOUT):
+		from gnuradio import gr
+		with self._cond:
+			self.keep_running = False
+			self._cond.notify_all()
+		self.msgq.insert_tail(gr.message().make_from_string("", DISPATCHER_MSG_TYPE_WAKEUP, 0, 0))
+		for thread in [self._pump, self._worker]:
+			if thread is not threading.current_thread():
+				thread.join(timeout)
+	
+	def get_metrics(self):
+		with self._cond:
+			metrics = dict(self._metrics)
+			metrics["dropped"] = list(metrics["dropped"])
+			metrics["max_depth"] = list(metrics["max_depth"])
+			metrics["depth"] = [len(queue) for queue in self._lanes]
+			dispatched = metrics["dispatched"]
+			metrics["mean_wait_ms"] = metrics.pop("wait_ms") / dispatched if dispatched else 0.0
+			metrics["mean_latency_ms"] = metrics.pop("latency_ms") / dispatched if dispatched else 0.0
+			return metrics
+###
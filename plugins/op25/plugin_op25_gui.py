@@ -2,19 +2,24 @@
 
 import os, sys, logging, threading, json, time
 
-from PyQt5.QtCore import QThread, pyqtSignal
-from PyQt5.QtWidgets import QMessageBox, QTableWidgetItem
-from PyQt5.QtGui import QColor
+from PyQt5 import QtCore
+from PyQt5.QtCore import Qt, QThread, QTimer, QModelIndex
+from PyQt5.QtWidgets import QMessageBox
+from PyQt5.QtGui import QColor, QBrush
 from gnuradio import gr
 
 from plugin import PLUGIN_DIR_NAME
 from gui import *
+from op25_codec import *
 
 GUI_FREQUENCY_DATA_HEADERS		= ["Frequency", "Talkgroup ID", "Last seen", "Count"]
 GUI_COLOR_COL_HIGHLIGHT_TGID	= QColor(46, 204, 113)
 GUI_COLOR_ROW_HIGHLIGHT			= QColor(46, 204, 113)
 GUI_COLOR_ROW_HIGHLIGHT_ENCRYPT	= QColor(192, 57, 43)
 GUI_UPDATE_INTERVAL				= 0.5
+GUI_FRAME_RATE					= 4.0		# default rate (hz) that coalesced updates are delivered to the gui at
+GUI_MSG_TYPE_JSON				= -4		# json messages from the receiver
+GUI_MSG_TYPE_WAKEUP				= -100		# posted to the input queue by the gui to wake the worker up
 
 
 class GUI_Plugin_OP25(GUI_MainWindow):
@@ -28,11 +33,17 @@ class GUI_Plugin_OP25(GUI_MainWindow):
 		self.current_freq = 0
 		self.current_tgid = 0
 		self.encrypted = False
-		self.freq_data = []
+		self.freq_model = Frequency_Table_Model(self)
 		
-		self.worker = GUI_Plugin_OP25_Worker(self)
-		self.worker.sig_trunk_update.connect(self.on_trunk_update)
-		self.worker.sig_change_freq.connect(self.on_change_freq)
+		self.coalescer = Trunk_Update_Coalescer()
+		self.worker = GUI_Plugin_OP25_Worker(self, self.coalescer)
+		self.update_timer = QTimer(self)
+		self.update_timer.setInterval(int(GUI_UPDATE_INTERVAL * 1000))
+		self.update_timer.timeout.connect(lambda: self.worker.send_command("update"))
+		frame_rate = self["gui_frame_rate"] if self["gui_frame_rate"] else GUI_FRAME_RATE
+		self.frame_timer = QTimer(self)
+		self.frame_timer.setInterval(int(1000 / frame_rate))
+		self.frame_timer.timeout.connect(self.deliver_updates)
 		
 		self.label_sysname = self.findChild(QtWidgets.QLabel, "label_sysname")
 		self.label_sysname.setText("")
@@ -43,9 +54,8 @@ class GUI_Plugin_OP25(GUI_MainWindow):
 		self.label_frequency = self.findChild(QtWidgets.QLabel, "label_frequency")
 		self.label_fine_tune = self.findChild(QtWidgets.QLabel, "label_fine_tune")
 		
-		self.table_frequency_data = self.findChild(QtWidgets.QTableWidget, "table_frequency_data")
-		self.table_frequency_data.setColumnCount(len(GUI_FREQUENCY_DATA_HEADERS))
-		self.table_frequency_data.setHorizontalHeaderLabels(GUI_FREQUENCY_DATA_HEADERS)
+		self.table_frequency_data = self.findChild(QtWidgets.QTableView, "table_frequency_data")
+		self.table_frequency_data.setModel(self.freq_model)
 		header = self.table_frequency_data.horizontalHeader()
 		header.setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
 		for i in range(len(GUI_FREQUENCY_DATA_HEADERS) - 1):
@@ -57,10 +67,33 @@ class GUI_Plugin_OP25(GUI_MainWindow):
 		
 	def start(self):
 		self.worker.start()
+		self.worker.send_command("update")
+		self.update_timer.start()
+		self.frame_timer.start()
+	
+	def stop(self):
+		self.update_timer.stop()
+		self.frame_timer.stop()
+		if self.worker.isRunning():
+			self.worker.stop()
+			self.worker.wait()
+		self._logger.debug("OP25 gui update metrics: %s", str(self.coalescer.get_metrics()))
+	
+	# Called by the frame timer with whatever arrived since the last frame
+	def deliver_updates(self):
+		trunk_update, change_freq = self.coalescer.take()
+		if change_freq:
+			self.on_change_freq(change_freq)
+		if trunk_update:
+			self.on_trunk_update(trunk_update)
+	
+	def closeEvent(self, event):
+		self.stop()
+		super(GUI_Plugin_OP25, self).closeEvent(event)
 	
 	def on_trunk_update(self, msg):
 		# print(json.dumps(msg))
-		nacs = [x for x in list(msg.keys()) if x.isnumeric() ]
+		nacs = [x for x in list(msg.keys()) if is_nac_key(x)]
 		if not nacs:
 			return
 		sysnames = {}
@@ -91,20 +124,11 @@ class GUI_Plugin_OP25(GUI_MainWindow):
 			self.encrypted = False
 		
 		# format frequency_data into a more standardized and comparable format
-		self.freq_data = [None] * len(current_data["frequency_data"])
-		for i, (freq, data) in enumerate(current_data["frequency_data"].items()):
-			tgids = data["tgids"] if len(data["tgids"]) > 0 else [0, None]
-			self.freq_data[i] = [int(freq), data["tgids"], data["last_activity"], data["counter"]]
-		self.table_frequency_data.setRowCount(len(self.freq_data))
-		for row, data in enumerate(self.freq_data):
-			self.table_frequency_data.setItem(row, 0, QTableWidgetItem(num_to_freq(data[0])))
-			self.table_frequency_data.setItem(row, 1, QTableWidgetItem(tgid_list_tostring(data[1])))
-			self.table_frequency_data.setItem(row, 2, QTableWidgetItem(str(data[2]) + "s"))
-			self.table_frequency_data.setItem(row, 3, QTableWidgetItem(str(data[3])))
-			if self.current_freq == data[0]:
-				for col in range(self.table_frequency_data.columnCount()): self.table_frequency_data.item(row, col).setBackground(GUI_COLOR_ROW_HIGHLIGHT_ENCRYPT if self.encrypted else GUI_COLOR_ROW_HIGHLIGHT)
-			elif self.current_tgid == data[1][0]:
-				self.table_frequency_data.item(row, 1).setBackground(GUI_COLOR_COL_HIGHLIGHT_TGID)
+		freq_data = {}
+		for freq, data in current_data["frequency_data"].items():
+			freq_data[int(freq)] = [int(freq), data["tgids"], data["last_activity"], data["counter"]]
+		self.freq_model.update(freq_data)
+		self.freq_model.set_highlight(self.current_freq, self.current_tgid, self.encrypted)
 	
 	def on_change_freq(self, msg):
 		self.current_freq = 0
@@ -117,49 +141,190 @@ class GUI_Plugin_OP25(GUI_MainWindow):
 			self.label_frequency.setText(num_to_freq(self.current_freq))
 		if "tgid" in msg and msg["tgid"]:
 			self.current_tgid = msg["tgid"]
+		self.freq_model.set_highlight(self.current_freq, self.current_tgid, self.encrypted)
 ###
 
-# From the curses terminal in op25 apps adapted to dispatch signals on a QThread
-class GUI_Plugin_OP25_Worker(QThread):	
-	sig_trunk_update = pyqtSignal(dict)
-	sig_change_freq = pyqtSignal(dict)
-	
+
+# Frequency table keyed by frequency. Updates only insert, remove or repaint the rows that changed
+class Frequency_Table_Model(QtCore.QAbstractTableModel):
 	def __init__(self, parent = None):
+		super(Frequency_Table_Model, self).__init__(parent)
+		self.freqs = []		# frequencies in row order
+		self.rows = {}		# frequency -> [frequency, tgids, last activity, count]
+		self.current_freq = 0
+		self.current_tgid = 0
+		self.encrypted = False
+	
+	# freq_data maps each frequency to its row
+	def update(self, freq_data):
+		for row in reversed(range(len(self.freqs))):
+			if not self.freqs[row] in freq_data:
+				self.beginRemoveRows(QModelIndex(), row, row)
+				del self.rows[self.freqs.pop(row)]
+				self.endRemoveRows()
+		for row, freq in enumerate(self.freqs):
+			if self.rows[freq] != freq_data[freq]:
+				self.rows[freq] = freq_data[freq]
+				self.dataChanged.emit(self.index(row, 0), self.index(row, len(GUI_FREQUENCY_DATA_HEADERS) - 1))
+		new_freqs = [freq for freq in freq_data if not freq in self.rows]
+		if new_freqs:
+			self.beginInsertRows(QModelIndex(), len(self.freqs), len(self.freqs) + len(new_freqs) - 1)
+			for freq in new_freqs:
+				self.freqs.append(freq)
+				self.rows[freq] = freq_data[freq]
+			self.endInsertRows()
+	
+	# Only the rows highlighted before or after the change are repainted
+	def set_highlight(self, freq, tgid, encrypted):
+		if (freq, tgid, encrypted) == (self.current_freq, self.current_tgid, self.encrypted):
+			return None
+		affected_freqs = set([self.current_freq, freq])
+		affected_tgids = set([self.current_tgid, tgid])
+		self.current_freq = freq
+		self.current_tgid = tgid
+		self.encrypted = encrypted
+		for row, row_freq in enumerate(self.freqs):
+			if row_freq in affected_freqs or self.get_first_tgid(row_freq) in affected_tgids:
+				self.dataChanged.emit(self.index(row, 0), self.index(row, len(GUI_FREQUENCY_DATA_HEADERS) - 1), [Qt.BackgroundRole])
+	
+	def get_first_tgid(self, freq):
+		tgids = self.rows[freq][1]
+		return tgids[0] if len(tgids) > 0 else None
+	
+	def rowCount(self, parent = QModelIndex()):
+		return 0 if parent.isValid() else len(self.freqs)
+	
+	def columnCount(self, parent = QModelIndex()):
+		return 0 if parent.isValid() else len(GUI_FREQUENCY_DATA_HEADERS)
+	
+	def data(self, index, role = Qt.DisplayRole):
+		if not index.isValid():
+			return None
+		freq = self.freqs[index.row()]
+		data = self.rows[freq]
+		column = index.column()
+		if role == Qt.DisplayRole:
+			if column == 0:
+				return num_to_freq(data[0])
+			elif column == 1:
+				return tgid_list_tostring(data[1])
+			elif column == 2:
+				return str(data[2]) + "s"
+			return str(data[3])
+		elif role == Qt.BackgroundRole:
+			if self.current_freq == freq:
+				return QBrush(GUI_COLOR_ROW_HIGHLIGHT_ENCRYPT if self.encrypted else GUI_COLOR_ROW_HIGHLIGHT)
+			elif column == 1 and self.current_tgid and self.current_tgid == self.get_first_tgid(freq):
+				return QBrush(GUI_COLOR_COL_HIGHLIGHT_TGID)
+		return None
+	
+	def headerData(self, section, orientation, role = Qt.DisplayRole):
+		if role != Qt.DisplayRole:
+			return None
+		return GUI_FREQUENCY_DATA_HEADERS[section] if orientation == Qt.Horizontal else section + 1
+###
+
+# Collects trunk_update and change_freq messages between gui frames
+# trunk_update snapshots are kept per NAC, so only the latest snapshot of each system survives until the next frame
+class Trunk_Update_Coalescer(object):
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._trunk_update = None
+		self._change_freq = None
+		self._metrics = {
+			"received":		0,		# messages put in
+			"delivered":	0,		# merged messages taken out by the gui
+			"merged":		0,		# messages merged into one that was still pending
+			"dropped":		0		# NAC snapshots replaced before the gui saw them
+		}
+	
+	def put(self, msg):
+		with self._lock:
+			self._metrics["received"] += 1
+			if msg["json_type"] == "trunk_update":
+				if self._trunk_update == None:
+					self._trunk_update = msg
+					return None
+				self._metrics["merged"] += 1
+				for key, value in msg.items():
+					if is_nac_key(key) and key in self._trunk_update:
+						self._metrics["dropped"] += 1
+					self._trunk_update[key] = value
+			elif msg["json_type"] == "change_freq":
+				if self._change_freq == None:
+					self._change_freq = msg
+					return None
+				self._metrics["merged"] += 1
+				self._change_freq.update(msg)
+	
+	# Returns the pending (trunk_update, change_freq), either of which may be None
+	def take(self):
+		with self._lock:
+			pending = (self._trunk_update, self._change_freq)
+			self._trunk_update = None
+			self._change_freq = None
+			self._metrics["delivered"] += len([msg for msg in pending if msg != None])
+		return pending
+	
+	def get_metrics(self):
+		with self._lock:
+			return dict(self._metrics)
+###
+
+
+# From the curses terminal in op25 apps adapted to dispatch messages from a QThread
+# The worker sleeps in a blocking delete_head until a message arrives. Periodic updates are requested by the gui's timer
+class GUI_Plugin_OP25_Worker(QThread):	
+	def __init__(self, parent = None, coalescer = None):
 		super(GUI_Plugin_OP25_Worker, self).__init__(parent)
+		self.coalescer = coalescer
+		self.delta_decoder = Trunk_Update_Delta_Decoder()
 		self.input_queue = None
 		self.output_queue = None
-		self.last_update = 0
+		self.keep_running = False
 		self.current_msgqid = "0"
-		
-	def do_auto_update(self):
-		if self.last_update + GUI_UPDATE_INTERVAL > time.time():
-			return False
-		self.last_update = time.time()
-		return True
+	
+	# keep_running is set before the thread starts, so a stop() that comes before run() gets going isn't overwritten
+	def start(self, *args, **kwargs):
+		self.keep_running = True
+		super(GUI_Plugin_OP25_Worker, self).start(*args, **kwargs)
+	
+	# Wakes the blocked worker so it can see that it should stop
+	def stop(self):
+		self.keep_running = False
+		if self.input_queue:
+			self.input_queue.insert_tail(gr.message().make_from_string("", GUI_MSG_TYPE_WAKEUP, 0, 0))
 	
 	def process_json(self, js):
-		msg = json.loads(js)
-		if msg["json_type"] == "trunk_update":	self.sig_trunk_update.emit(msg)
-		elif msg["json_type"] == "change_freq":	self.sig_change_freq.emit(msg)
+		self.process_obj(json.loads(js))
+	
+	# Messages from a delta encoding receiver are rebuilt into full trunk_updates before the gui sees them
+	def process_obj(self, msg):
+		if msg["json_type"] == CODEC_DELTA_JSON_TYPE or "seq" in msg:
+			msg = self.delta_decoder.decode(msg)
+			if msg == None:
+				return None
+		if msg["json_type"] in ["trunk_update", "change_freq"]:
+			self.coalescer.put(msg)
 		
 	def send_command(self, command, arg1 = 0, arg2 = None):
+		if not self.output_queue:
+			return None
 		if arg2 == None:
 			arg2 = int(self.current_msgqid)
 		msg = gr.message().make_from_string(command, -2, arg1, arg2)
 		self.output_queue.insert_tail(msg)
 	
 	def run(self):
-		self.keep_running = True
 		while self.keep_running:
-			# Send updates
-			if self.do_auto_update():
-				self.send_command("update")
-			# Check input queue
-			while not self.input_queue.empty_p():
-				msg = self.input_queue.delete_head() # delete_head_nowait()
-				if msg.type() == -4:
-					self.process_json(msg.to_string())
-		keep_running = False
+			msg = self.input_queue.delete_head()	# blocks until the receiver or stop() posts something
+			if msg.type() == GUI_MSG_TYPE_WAKEUP:
+				break
+			if msg.type() == GUI_MSG_TYPE_JSON:
+				obj = decode_message(msg)
+				if obj != None:
+					self.process_obj(obj)
+		self.keep_running = False
 
 
 from plugin_op25 import *
\ No newline at end of file
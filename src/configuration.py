@@ -5,12 +5,17 @@
 # It was kind of over-engineered but the Configuration is designed for use with a structure that helps data loaded from a JSON file
 # to be aware of defaults, ranges, options, and any other attributes defined in the structure file.
 
-import sys, os.path, json, logging
+import sys, os.path, json, logging, hashlib
 from shutil import copyfile
+from multiprocessing.pool import ThreadPool
+from json.encoder import encode_basestring_ascii
 from xml.etree import ElementTree
 
 if sys.version_info[0] >= 3:
 	unicode = str
+	import pickle
+else:
+	import cPickle as pickle
 
 
 class Stuctural_Type(object):
@@ -19,67 +24,171 @@ class Stuctural_Type(object):
 		self.func_cast = func_cast
 		self.func_validate = func_validate if func_validate else lambda: None
 
-def validate_number(type, x, attribs):
+# Validators are called as func_validate(value, prop) with the Structure_Property, so they can use its precomputed limits and options
+# They used to receive the raw attribute dict instead. The property still answers "key" in prop, prop["key"] and prop.get("key")
+# from its attributes, so validators written against the attribute dict keep working
+def validate_number(x, prop):
 	x_num = 0
-	castor = int if type == "int" else float
 	try:
-		x_num = castor(x)
-	except ValueError:
+		x_num = prop.struct_type.func_cast(x)
+	except (ValueError, TypeError):
 		return False
-	if "min" in attribs and x_num < castor(attribs["min"]):
+	if prop.min != None and x_num < prop.min:
 		return False
-	if "max" in attribs and x_num > castor(attribs["max"]):
+	if prop.max != None and x_num > prop.max:
 		return False
 	return True
 
-def validate_string(x, attribs):
-	if "min" in attribs and len(x) < int(attribs["min"]):
+def validate_string(x, prop):
+	if not isinstance(x, (str, unicode)):
 		return False
-	if "max" in attribs and len(x) > int(attribs["max"]):
+	if prop.min != None and len(x) < prop.min:
+		return False
+	if prop.max != None and len(x) > prop.max:
+		return False
+	if prop.option_set != None and not x in prop.option_set:
 		return False
-	if "options" in attribs:
-		options = attribs["options"].split(SCHEMA_OPTION_DELIMITER)
-		if not x in options:
-			return False
 	return not x.isspace()
 
 def get_structural_type(type_name):
-	for struct_type in CONFIGURATION_STRUCTURAL_TYPES:
-		if struct_type.type_name == type_name:
-			return struct_type
-	return None
+	return CONFIGURATION_STRUCTURAL_TYPE_REGISTRY.get(type_name)
+
+BOOL_TRUE_STRINGS	= frozenset(["true", "1"])
+BOOL_STRINGS		= frozenset(["true", "1", "false", "0"])
 
 CONFIGURATION_STRUCTURAL_TYPES	= [
-	Stuctural_Type("bool", lambda x=None: str(x).lower() in ["true", "1"] if x else bool(), lambda x, attribs: str(x).lower() in ["true", "1", "false", "0"]),
-	Stuctural_Type("int", int, lambda x, attribs: validate_number("int", x, attribs) ),
-	Stuctural_Type("float", float, lambda x, attribs: validate_number("float", x, attribs) ),
+	Stuctural_Type("bool", lambda x=None: str(x).lower() in BOOL_TRUE_STRINGS if x else bool(), lambda x, prop: str(x).lower() in BOOL_STRINGS),
+	Stuctural_Type("int", int, validate_number),
+	Stuctural_Type("float", float, validate_number),
 	Stuctural_Type("string", str, validate_string),
-	Stuctural_Type("file", str, lambda x, attribs: validate_string(x, attribs) and os.path.isfile(x)),
-	Stuctural_Type("directory", str, lambda x, attribs: validate_string(x, attribs) and os.path.isdir(x))
+	Stuctural_Type("file", str, lambda x, prop: validate_string(x, prop) and os.path.isfile(x)),
+	Stuctural_Type("directory", str, lambda x, prop: validate_string(x, prop) and os.path.isdir(x))
 ]
+CONFIGURATION_STRUCTURAL_TYPE_REGISTRY			= dict((x.type_name, x) for x in CONFIGURATION_STRUCTURAL_TYPES)
 CONFIGURATION_APPLY_IMPLICIT_PROPERTIES			= False
+CONFIGURATION_LAZY_STRUCTURE					= True		# default copies in arrays are only built once they are needed
+CONFIGURATION_JSON_INDENT						= 4
+CONFIGURATION_CACHE_JSON						= True		# keep the JSON of clean subtrees between saves instead of streaming every save
 CONFIGURATION_STRUCTURE_OBJECT_CONTEXT_LABEL	= "name"
+CONFIGURATION_VALIDATE_WORKERS					= 8			# threads used to validate types that stat the filesystem
+CONFIGURATION_VALIDATE_FILESYSTEM_TYPES			= ["file", "directory"]
 
 SCHEMA_OPTION_DELIMITER						= ","
 SCHEMA_NULL_KEYWORDS_ENABLED				= True
 SCHEMA_NULL_KEYWORDS						= ["null", "none"]
 SCHEMA_STRUCTURE_OBJECT_CONTEXT_ATTRIBUTES	= True				# gives context to attributes in objects in structural arrays
 SCHEMA_STRUCTURE_OBJECT_CONTEXT_NAME		= "_schema_name"
+SCHEMA_CACHE_ENABLED						= True
+SCHEMA_CACHE_EXTENSION						= ".cache"			# compiled schemas are stored next to the schema as {schema}{extension}
+SCHEMA_CACHE_VERSION						= 3					# bump whenever the structure classes change shape
 	
 ################################ [ START OF MAIN CODE ]	################################
 
 
+# A list of structures that drops the name index of the Structure_Object owning it whenever it is edited
+class Structure_Tree(list):
+	def __init__(self, owner, structs = ()):
+		list.__init__(self, structs)
+		self._owner = owner
+	
+	def _invalidate(self):
+		owner = getattr(self, "_owner", None)	# unpickling fills the list before the owner is restored
+		if owner is not None:
+			owner.invalidate_index()
+	
+	def __setitem__(self, *args):
+		list.__setitem__(self, *args)
+		self._invalidate()
+	
+	def __delitem__(self, *args):
+		list.__delitem__(self, *args)
+		self._invalidate()
+	
+	def __setslice__(self, *args):	# python2 only
+		list.__setslice__(self, *args)
+		self._invalidate()
+	
+	def __delslice__(self, *args):	# python2 only
+		list.__delslice__(self, *args)
+		self._invalidate()
+	
+	def __iadd__(self, structs):
+		list.extend(self, structs)
+		self._invalidate()
+		return self
+	
+	def __imul__(self, count):
+		result = list.__imul__(self, count)
+		self._invalidate()
+		return result
+	
+	def append(self, struct):
+		list.append(self, struct)
+		self._invalidate()
+	
+	def extend(self, structs):
+		list.extend(self, structs)
+		self._invalidate()
+	
+	def insert(self, index, struct):
+		list.insert(self, index, struct)
+		self._invalidate()
+	
+	def remove(self, struct):
+		list.remove(self, struct)
+		self._invalidate()
+	
+	def pop(self, *args):
+		struct = list.pop(self, *args)
+		self._invalidate()
+		return struct
+	
+	def sort(self, *args, **kwargs):
+		list.sort(self, *args, **kwargs)
+		self._invalidate()
+	
+	def reverse(self):
+		list.reverse(self)
+		self._invalidate()
+###
+
+# Base of everything that can be placed in a Structure_Object
+# Renaming a structure drops the name index of the Structure_Object it was last indexed in
+class Structure_Node(object):
+	@property
+	def name(self):
+		return self._name
+	
+	@name.setter
+	def name(self, name):
+		self._name = name
+		owner = getattr(self, "_owner", None)
+		if owner is not None:
+			owner.invalidate_index()
+###
+
 # A tree that represents the configuration structure of objects in the schema
-class Structure_Object(object):
+class Structure_Object(Structure_Node):
 	__logger = logging.getLogger(__name__)
 	
 	def __init__(self, name = None, label = None, attributes = None):
+		self._owner = None		# the Structure_Object this one was last indexed in
 		self.name = name
 		self.label = label if label else name
 		self.attributes = attributes if isinstance(attributes, dict) else {}
-		self.tree = []
+		self._tree = Structure_Tree(self)
 		self.is_array = False
-		
+		self._index = None		# maps child names to the first child with that name; None until it is (re)built
+	
+	@property
+	def tree(self):
+		return self._tree
+	
+	@tree.setter
+	def tree(self, structs):
+		self._tree = Structure_Tree(self, structs)
+		self.invalidate_index()
+	
 	def get_num_copies(self):
 		if not self.is_array:	# non-array objects cannot have copies
 			return None
@@ -91,20 +200,35 @@ class Structure_Object(object):
 		if struct == None:
 			return None
 		assert isinstance(struct, (Structure_Object, Structure_Property))
-		self.tree.append(struct)
+		self._tree.append(struct)
+	
+	def remove(self, struct):
+		self._tree.remove(struct)
+	
+	# Drops the name index so it is rebuilt on the next lookup
+	# Every edit of the tree goes through Structure_Tree, which calls this, and so do renames of its structures
+	def invalidate_index(self):
+		self._index = None
+	
+	def reindex(self):
+		index = {}
+		for struct in self._tree:
+			index.setdefault(struct.name, struct)
+			struct._owner = self
+		self._index = index
+	
+	def __get_index(self):
+		if self._index is None:
+			self.reindex()
+		return self._index
 	
 	def __contains__(self, key):
-		for struct in self.tree:
-			if struct.name == key:
-				return True
-		return False
+		return key in self.__get_index()
 	
 	def __getitem__(self, key):
 		if isinstance(key, (Structure_Object, Structure_Property)):
 			key = key.name
-		for struct in self.tree:
-			if struct.name == key:
-				return struct
+		return self.__get_index().get(key)
 	
 	def __iter__(self):
 		return self.tree.__iter__()
@@ -123,28 +247,39 @@ class Structure_Object(object):
 
 # Represents the configuration structure based on the schema
 # This is the base class for all structured items and functions to encaptulate other structures
-class Structure_Property(object):
+class Structure_Property(Structure_Node):
 	__logger = logging.getLogger(__name__)
 	
 	def __init__(self, struct_type, name = None, label = None, default = None, attributes = None):
 		self.struct_type = struct_type
 		assert isinstance(struct_type, Stuctural_Type)
+		self._owner = None		# the Structure_Object this one was last indexed in
 		self.name = name
 		self.label = label if label else name
 		self.default = (self.cast_value(default) if default != None else self.struct_type.func_cast()) if not SCHEMA_NULL_KEYWORDS_ENABLED or str(default).lower() not in SCHEMA_NULL_KEYWORDS else None
 		self.attributes = attributes if isinstance(attributes, dict) else {}
+		self.parse_attributes()
+	
+	# Casts the attributes used while validating once, instead of on every validation
+	# Call this again if the attributes are changed after the property is created
+	def parse_attributes(self):
+		limit_cast = self.struct_type.func_cast if self.struct_type.type_name in ["int", "float"] else int	# strings are limited by length
+		self.min = limit_cast(self.attributes["min"]) if "min" in self.attributes else None
+		self.max = limit_cast(self.attributes["max"]) if "max" in self.attributes else None
+		self.options = None
+		self.option_set = None
+		if "options" in self.attributes:
+			self.options = self.attributes["options"].split(SCHEMA_OPTION_DELIMITER)
+			if self.struct_type.type_name != "string":	# no need to waste time casting things that are already strings
+				self.options = [self.struct_type.func_cast(option) for option in self.options]
+			self.option_set = frozenset(self.options)
+		self.implicit = "presentation" in self.attributes and self.attributes["presentation"] == "implicit"
 	
 	def get_options(self):
-		if not "options" in self.attributes:
-			return None
-		options = self.attributes["options"].split(SCHEMA_OPTION_DELIMITER)
-		if self.struct_type.type_name != "string":	# no need to waste time casting things that are already strings
-			for i, option in enumerate(options):
-				options[i] = self.struct_type.func_cast(option)
-		return options
+		return list(self.options) if self.options != None else None
 	
 	def validate_value(self, value):
-		return self.struct_type.func_validate(value, self.attributes)
+		return self.struct_type.func_validate(value, self)
 		
 	def cast_value(self, value):
 		if SCHEMA_NULL_KEYWORDS_ENABLED and str(value).lower() in SCHEMA_NULL_KEYWORDS:
@@ -152,7 +287,27 @@ class Structure_Property(object):
 		return self.struct_type.func_cast(value)
 	
 	def is_implicit(self):
-		return "presentation" in self.attributes and self.attributes["presentation"] == "implicit"
+		return self.implicit
+	
+	# Lets validators written against the attribute dict read the attributes from the property
+	def __contains__(self, key):
+		return key in self.attributes
+	
+	def __getitem__(self, key):
+		return self.attributes[key]
+	
+	def get(self, key, default = None):
+		return self.attributes.get(key, default)
+	
+	# The structural type holds functions that cannot be pickled, so only its name is stored
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["struct_type"] = self.struct_type.type_name
+		return state
+	
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.struct_type = get_structural_type(state["struct_type"])
 	
 	def __repr__(self):
 		return "%s(%s): %s=%s" % (type(self).__name__, self.struct_type.type_name, self.name, self.default)
@@ -169,12 +324,18 @@ class Configuration(object):
 	
 	def __init__(self, param = None):
 		self._content = {}
+		self._pending_copies = 0	# number of default copies of an array that have not been built yet
+		self._parent = None			# the configuration this one was last placed in, so changes can invalidate it
+		self._json = None			# cached (indent level, JSON text) of this subtree; None while dirty
+		self._source = None			# the configuration a copy shares its content with. Both use the source's JSON cache
 		self.struct = None
 		
+		# A copy is another view of the same content, so an edit through either one is seen by both, and so are their caches
 		if issubclass(type(param), Configuration):
 			self.struct = param.struct
-			self.build_structure()
-			self._content = param._content
+			param.materialize()					# the pending copies would otherwise be built into the shared content by both
+			self._content = param._content		# the content is shared, so there is no point in building the structure
+			self._source = param._source if param._source is not None else param
 		elif isinstance(param, Structure_Object):
 			self.struct = param
 			self.build_structure()
@@ -184,14 +345,34 @@ class Configuration(object):
 	def build_structure(self):
 		assert isinstance(self.struct, Structure_Object)
 		num_copies = 1
+		self._pending_copies = 0
+		self._mark_dirty()
 		if self.struct.is_array:
-			self._content = []
+			self.__set_content([])
 			num_copies = self.struct.get_num_copies()
 		else:
-			self._content = {}
+			self.__set_content({})
 		if num_copies == 0:
 			return None
-		
+		if self.struct.is_array and CONFIGURATION_LAZY_STRUCTURE:
+			self._pending_copies = num_copies	# set_data usually replaces these anyway
+			return None
+		self.__build_copies(num_copies)
+	
+	# Replaces the content. A copy then has content of its own and stops sharing its source's
+	def __set_content(self, content):
+		self._content = content
+		self._source = None
+	
+	# Builds any default array copies that build_structure deferred
+	def materialize(self):
+		if self._pending_copies:
+			num_copies = self._pending_copies
+			self._pending_copies = 0
+			self.__build_copies(num_copies)
+		return self
+	
+	def __build_copies(self, num_copies):
 		for i in range(num_copies):	# almost certainly the laziest way to do this but oh well
 			for sub_struct in self.struct:
 				if isinstance(sub_struct, Structure_Property):
@@ -206,9 +387,10 @@ class Configuration(object):
 	# Sets data from a JSON file
 	def set_data(self, data):
 		assert isinstance(data, (dict, list))
+		self._mark_dirty()
 		# Reformat content in preference of the data if no structure is given
 		if not self.struct:
-			self._content = {} if isinstance(data, dict) else []
+			self.__set_content({} if isinstance(data, dict) else [])
 		
 		# Place the data into content as a configuration
 		if isinstance(self._content, dict) and isinstance(data, dict):
@@ -227,7 +409,8 @@ class Configuration(object):
 					self[key].set_data(sub_data)
 		# Lists will try to be smart about what Structure gets assigned to which object
 		elif isinstance(self._content, list) and isinstance(data, list):
-			self._content = []	# why did i waste my time writing what's below when this is way better and works when objects get removed?
+			self._pending_copies = 0
+			self.__set_content([])	# why did i waste my time writing what's below when this is way better and works when objects get removed?
 			"""content_len = len(self._content)
 			data_len = len(data)
 			if data_len > content_len:
@@ -242,27 +425,149 @@ class Configuration(object):
 				if isinstance(sub_data, (dict, list)):
 					sub_config.set_data(sub_data)
 				# self._content[i] = sub_config
+				sub_config._parent = self
 				self._content.append(sub_config)
 			
 	
 	# Casts to object to be written as a JSON
 	def as_obj(self):
+		self.materialize()
 		obj = {}
 		if isinstance(self._content, dict):
 			for key, sub_data in self._content.items():
-				if CONFIGURATION_APPLY_IMPLICIT_PROPERTIES or not (isinstance(self.struct, Structure_Object) and key in self.struct and self.struct[key].is_implicit() and sub_data == self.struct[key].default):
-					obj[key] = sub_data
 				if isinstance(sub_data, Configuration):
 					obj[key] = sub_data.as_obj()
+				elif self._is_serialized(key, sub_data):
+					obj[key] = sub_data
 		elif isinstance(self._content, list):
 			obj = []
 			for sub_data in self._content:
-				if sub_data != None:
-					obj.append(sub_data)
 				if isinstance(sub_data, Configuration):
 					obj.append(sub_data.as_obj())
+				elif sub_data != None:
+					obj.append(sub_data)
 		return obj
 	
+	# Produces the same text as json.dumps(self.as_obj(), indent=CONFIGURATION_JSON_INDENT) for a configuration
+	# nested indent_level deep, reusing the cached text of subtrees that have not changed since they were last serialized
+	def to_json(self, indent_level = 0):
+		if self._source is not None:
+			return self._source.to_json(indent_level)
+		if self._json and self._json[0] == indent_level:
+			return self._json[1]
+		self.materialize()
+		inner_indent = "\n" + " " * (CONFIGURATION_JSON_INDENT * (indent_level + 1))
+		fragments = []
+		if isinstance(self._content, dict):
+			for key, sub_data in self._content.items():
+				if isinstance(sub_data, Configuration):
+					fragments.append(self._json_value(key) + ": " + sub_data.to_json(indent_level + 1))
+				elif self._is_serialized(key, sub_data):
+					fragments.append(self._json_value(key) + ": " + self._json_value(sub_data))
+			brackets = "{}"
+		else:
+			for sub_data in self._content:
+				if isinstance(sub_data, Configuration):
+					fragments.append(sub_data.to_json(indent_level + 1))
+				elif sub_data != None:
+					fragments.append(self._json_value(sub_data))
+			brackets = "[]"
+		if fragments:
+			text = brackets[0] + inner_indent + ("," + inner_indent).join(fragments) + "\n" + " " * (CONFIGURATION_JSON_INDENT * indent_level) + brackets[1]
+		else:
+			text = brackets
+		self._json = (indent_level, text)
+		return text
+	
+	# Streams the same text as to_json into a file-like object without building the document in memory
+	# Cached text is written for clean subtrees, but nothing new is cached
+	def dump(self, file, indent_level = 0):
+		if self._source is not None:
+			return self._source.dump(file, indent_level)
+		if self._json and self._json[0] == indent_level:
+			file.write(self._json[1])
+			return None
+		self.materialize()
+		inner_indent = "\n" + " " * (CONFIGURATION_JSON_INDENT * (indent_level + 1))
+		is_dict = isinstance(self._content, dict)
+		file.write("{" if is_dict else "[")
+		separator = inner_indent
+		for key, sub_data in (self._content.items() if is_dict else enumerate(self._content)):
+			if not isinstance(sub_data, Configuration) and (not self._is_serialized(key, sub_data) if is_dict else sub_data == None):
+				continue
+			prefix = separator + self._json_value(key) + ": " if is_dict else separator
+			separator = "," + inner_indent
+			if isinstance(sub_data, Configuration):
+				file.write(prefix)
+				sub_data.dump(file, indent_level + 1)
+			else:
+				file.write(prefix + self._json_value(sub_data))
+		if separator != inner_indent:	# something was written
+			file.write("\n" + " " * (CONFIGURATION_JSON_INDENT * indent_level))
+		file.write("}" if is_dict else "]")
+	
+	# Implicit properties are left out of the JSON while they still hold their default value
+	def _is_serialized(self, key, value):
+		if CONFIGURATION_APPLY_IMPLICIT_PROPERTIES or not isinstance(self.struct, Structure_Object):
+			return True
+		sub_struct = self.struct[key]
+		return not (isinstance(sub_struct, Structure_Property) and sub_struct.is_implicit() and value == sub_struct.default)
+	
+	# json.dumps for a single value, with a shortcut for the common case of strings
+	@staticmethod
+	def _json_value(value):
+		if isinstance(value, (str, unicode)):
+			return encode_basestring_ascii(value)
+		return json.dumps(value)
+	
+	# Invalidates the cached JSON of this configuration and every configuration containing it
+	# A copy keeps no JSON of its own, so its source is invalidated in its place
+	def _mark_dirty(self):
+		config = self
+		while config is not None:
+			if config._source is not None:
+				config = config._source
+			if config._json is None:	# a clean parent never holds a dirty child, so stop at the first dirty one
+				break
+			config._json = None
+			config = config._parent
+	
+	# Yields (path, Structure_Property, value) for every value in this tree that has a structure
+	# path is a tuple of the keys and indexes leading to the value
+	def iter_properties(self, path = ()):
+		for key, sub_data in self.items():
+			if isinstance(sub_data, Configuration):
+				for prop in sub_data.iter_properties(path + (key,)):
+					yield prop
+			elif isinstance(self.struct, Structure_Object):
+				sub_struct = self.struct[key]
+				if isinstance(sub_struct, Structure_Property):
+					yield path + (key,), sub_struct, sub_data
+	
+	# Validates every value in this tree against its structure in one pass and returns every Configuration_Violation found
+	# Types that stat the filesystem are validated on a thread pool of max_workers. Unset (null) values are not validated
+	def validate(self, max_workers = CONFIGURATION_VALIDATE_WORKERS):
+		props = [prop for prop in self.iter_properties() if prop[2] != None]
+		results = [None] * len(props)
+		deferred = []	# indexes of the properties left for the thread pool
+		for i, (path, struct, value) in enumerate(props):
+			if max_workers > 1 and struct.struct_type.type_name in CONFIGURATION_VALIDATE_FILESYSTEM_TYPES:
+				deferred.append(i)
+			else:
+				results[i] = struct.validate_value(value)
+		if len(deferred) > 1:	# a single check is not worth starting threads for
+			pool = ThreadPool(min(max_workers, len(deferred)))
+			try:
+				deferred_results = pool.map(lambda i: props[i][1].validate_value(props[i][2]), deferred)
+			finally:
+				pool.close()
+				pool.join()
+		else:
+			deferred_results = [props[i][1].validate_value(props[i][2]) for i in deferred]
+		for i, valid in zip(deferred, deferred_results):
+			results[i] = valid
+		return [Configuration_Violation(*prop) for prop, valid in zip(props, results) if not valid]
+	
 	# Returns the set of all allowed configurations for a structural array (an array in a schema that is only defined to show its structure)
 	# NOTE: False returns are an empty array [] and NOT None
 	def get_structural_array_configurations(self, warning = True):
@@ -295,25 +600,34 @@ class Configuration(object):
 	def append(self, value):
 		if not isinstance(self._content, list):
 			return None
+		self.materialize()
+		if isinstance(value, Configuration):
+			value._parent = self
 		self._content.append(value)
+		self._mark_dirty()
 	
 	def remove(self, value, key = None):
+		self.materialize()
 		if isinstance(self._content, dict):
 			self._content.pop(key)
 		elif isinstance(self._content, list):
 			self._content.remove(value)
+		self._mark_dirty()
 		return self
 	
 	def items(self):
+		self.materialize()
 		if isinstance(self._content, dict):
 			return self._content.items()
 		elif isinstance(self._content, list):
 			return enumerate(self._content)
 			
 	def __contains__(self, key):
+		self.materialize()
 		return (isinstance(self._content, dict) and key in self._content) or (isinstance(self._content, list) and isinstance(key, list) and 0 <= key < len(self._content))
 	
 	def __getitem__(self, key):
+		self.materialize()
 		if isinstance(self._content, dict) and key != None and key in self._content:
 			return self._content[key]
 		elif isinstance(self._content, list) and isinstance(key, int) and 0 <= key < len(self._content):
@@ -323,27 +637,69 @@ class Configuration(object):
 	def __setitem__(self, key, value):
 		if not isinstance(self._content, dict):
 			return None
+		if isinstance(value, Configuration):
+			value._parent = self
 		self._content[key] = value
+		self._mark_dirty()
 	
 	def __str__(self):
 		return self[CONFIGURATION_STRUCTURE_OBJECT_CONTEXT_LABEL] if isinstance(self._content, dict) and CONFIGURATION_STRUCTURE_OBJECT_CONTEXT_LABEL in self and isinstance(self[CONFIGURATION_STRUCTURE_OBJECT_CONTEXT_LABEL], str) else (self.struct.label if self.struct and self.struct.label else (self.get_name()))
 	
 	def __repr__(self):
+		self.materialize()
 		return repr(self._content)
 ###
 
+# A value that failed validation against its structure
+class Configuration_Violation(object):
+	def __init__(self, path, struct, value):
+		self.path = path
+		self.struct = struct
+		self.value = value
+	
+	def get_path_string(self):
+		path_string = ""
+		for key in self.path:
+			path_string += ("[%d]" % key) if isinstance(key, int) else ("." + str(key) if path_string else str(key))
+		return path_string
+	
+	def get_message(self):
+		constraints = []
+		if self.struct.min != None:
+			constraints.append("min %s" % str(self.struct.min))
+		if self.struct.max != None:
+			constraints.append("max %s" % str(self.struct.max))
+		if self.struct.options != None:
+			constraints.append("one of %s" % SCHEMA_OPTION_DELIMITER.join([str(x) for x in self.struct.options]))
+		message = "%s is not a valid %s" % (repr(self.value), self.struct.struct_type.type_name)
+		return message + (" (%s)" % ", ".join(constraints) if constraints else "")
+	
+	def __repr__(self):
+		return "%s(%s)" % (type(self).__name__, self.get_path_string())
+	
+	def __str__(self):
+		return "%s: %s" % (self.get_path_string(), self.get_message())
+###
+
 # Configuration root node
 class Root_Configuration(Configuration):
 	__logger = logging.getLogger(__name__)
 	
 	def __init__(self, file_name, param = None):
 		super(Root_Configuration, self).__init__(param)
+		self._saved_json = None		# the exact text last written by save, so unchanged saves can be skipped
 		if issubclass(type(param), Root_Configuration):
 			self.file_name = param.file_name
 		else:
 			self.file_name = file_name
 	
-	def save(self):
+	# Writes the configuration through a temporary file, skipping the write if nothing changed since the last save
+	# Without CONFIGURATION_CACHE_JSON the text is streamed through dump and every save writes
+	def save(self, force = False):
+		text = self.to_json() if CONFIGURATION_CACHE_JSON else None
+		if not force and text != None and text == self._saved_json and os.path.isfile(self.file_name):
+			self.__logger.debug("Configuration '%s' has not changed since it was last saved", self.file_name)
+			return None
 		backup_name = self.file_name + ".bak"
 		if os.path.isfile(self.file_name) and not os.path.exists(backup_name):
 			try:
@@ -351,8 +707,12 @@ class Root_Configuration(Configuration):
 				self.__logger.info("Backup '%s' created for configuration", backup_name)
 			except Exception:
 				self.__logger.exception("Exception raised while trying to backup for configuration: %s", self.file_name)
-		with open(self.file_name, "w") as file:
-			json.dump(self.as_obj(), file, indent=4)
+		if text != None:
+			write_file_atomic(self.file_name, text)
+		else:
+			writer = self.dump
+			write_file_atomic(self.file_name, writer)
+		self._saved_json = text
 	
 	def get_name(self):
 		return os.path.splitext(os.path.basename(self.file_name))[0] # if not self.struct or not self.struct.label else self.struct.label
@@ -363,7 +723,7 @@ class Root_Configuration(Configuration):
 config_logger = logging.getLogger(__name__)
 
 def structure_from_xml(elem):
-	assert isinstance(elem, ElementTree.Element) and (any(elem.tag == x.type_name for x in CONFIGURATION_STRUCTURAL_TYPES) or elem.tag in ["object", "array"])
+	assert isinstance(elem, ElementTree.Element) and (elem.tag in CONFIGURATION_STRUCTURAL_TYPE_REGISTRY or elem.tag in ["object", "array"])
 	
 	name = None
 	label = None
@@ -381,12 +741,7 @@ def structure_from_xml(elem):
 			struct_obj.append(structure_from_xml(sub_elem))
 		return struct_obj
 	else:
-		struct_type = None
-		for x in CONFIGURATION_STRUCTURAL_TYPES:
-			if elem.tag == x.type_name:
-				struct_type = x
-				break
-		return Structure_Property(struct_type, name, label, elem.text, elem.attrib)
+		return Structure_Property(get_structural_type(elem.tag), name, label, elem.text, elem.attrib)
 
 def configuration_from_obj(obj):
 	data_type = type(obj).__name__
@@ -408,12 +763,73 @@ def configuration_from_obj(obj):
 			data.append(sub_config)
 	return Configuration(data_type, None, None, {}, data)
 
-def schema_from_file(schema_file):
+# Atomically replaces file_name with data by writing to a temporary file first
+# data may also be a function that writes into the file it is given
+def write_file_atomic(file_name, data, mode = "w"):
+	temp_name = file_name + ".tmp"
+	with open(temp_name, mode) as file:
+		if callable(data):
+			data(file)
+		else:
+			file.write(data)
+		file.flush()
+		os.fsync(file.fileno())
+	if hasattr(os, "replace"):
+		os.replace(temp_name, file_name)
+	else:
+		os.rename(temp_name, file_name)		# python2 only overwrites atomically on posix
+
+def get_schema_cache_key(schema_file, schema_data):
+	return {
+		"version":	SCHEMA_CACHE_VERSION,
+		"path":		os.path.abspath(schema_file),
+		"mtime":	os.path.getmtime(schema_file),
+		"hash":		hashlib.sha1(schema_data).hexdigest()
+	}
+
+# Returns the compiled structure for the schema if the cache is fresh, otherwise None
+def schema_from_cache(schema_file, cache_key):
+	cache_file = schema_file + SCHEMA_CACHE_EXTENSION
+	if not os.path.isfile(cache_file):
+		return None
+	try:
+		with open(cache_file, "rb") as file:
+			cached = pickle.load(file)
+	except Exception:
+		config_logger.debug("Schema cache '%s' could not be read and will be rebuilt", cache_file, exc_info=True)
+		return None
+	if not isinstance(cached, dict) or cached.get("key") != cache_key:
+		config_logger.debug("Schema cache '%s' is stale", cache_file)
+		return None
+	return cached["struct"]
+
+def schema_to_cache(schema_file, cache_key, struct):
+	cache_file = schema_file + SCHEMA_CACHE_EXTENSION
+	try:
+		write_file_atomic(cache_file, pickle.dumps({"key": cache_key, "struct": struct}, pickle.HIGHEST_PROTOCOL), "wb")
+	except Exception:
+		config_logger.debug("Schema cache '%s' could not be written", cache_file, exc_info=True)
+
+# use_cache defaults to SCHEMA_CACHE_ENABLED as it is when called, so it can be switched off at startup
+def schema_from_file(schema_file, use_cache = None):
+	if use_cache is None:
+		use_cache = SCHEMA_CACHE_ENABLED
 	if not schema_file or not os.path.isfile(schema_file):
 		config_logger.warning("Schema file '%s' cannot be opened. The configuration may not behave as intended.", schema_file)
 		return None
-	tree_root = ElementTree.parse(schema_file)
-	struct = structure_from_xml(tree_root.getroot())
+	with open(schema_file, "rb") as file:
+		schema_data = file.read()
+	struct = None
+	cache_key = None
+	if use_cache:
+		cache_key = get_schema_cache_key(schema_file, schema_data)
+		struct = schema_from_cache(schema_file, cache_key)
+	if not struct:
+		struct = structure_from_xml(ElementTree.fromstring(schema_data))
+		if use_cache:
+			schema_to_cache(schema_file, cache_key, struct)
+	else:
+		config_logger.debug("Loaded schema '%s' from cache", schema_file)
 	struct.attributes["file_name"] = os.path.abspath(schema_file)	# this will come in handy later
 	return struct
 
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# Run from the repository root, for example:
+# python2 -B src/configuration_benchmark.py -n 1000,5000 index
+# python2 -B src/configuration_benchmark.py -s schema.xml -s plugins/op25/schema.xml schema
+# python3 -B src/configuration_benchmark.py -n 2000,5000 serialize
+# python2 -B src/configuration_benchmark.py -n 10000 validate
+# python2 -B src/configuration_benchmark.py -n 1000,5000 validate_tree
+# python3 -B src/configuration_benchmark.py -n 500,2000 lazy
+
+# Copyright 2020 Scott Maday
+
+# Micro-benchmarks for the configuration module
+# Each benchmark times one part of the configuration at each of the requested sizes, against the slower path it replaced
+# where there was one, so the numbers quoted for those changes can be reproduced
+
+import os, sys, json, time, timeit, tempfile, shutil
+from optparse import OptionParser
+
+import configuration
+from configuration import *
+
+try:
+	import tracemalloc		# python3 only, so peak memory is only reported there
+except ImportError:
+	tracemalloc = None
+
+BENCHMARK_SIZES		= [1000, 5000]
+BENCHMARK_REPEAT	= 5
+BENCHMARK_OP25_SCHEMA	= os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "op25", "schema.xml")
+
+
+# Returns the best time of repeat runs of func, in seconds
+def best_time(func, repeat = BENCHMARK_REPEAT, number = 1):
+	return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+# Returns the best time of repeat runs of func and the peak traced allocation of the last run, in bytes
+# setup is called before every run and its result is passed to func, so each run starts from cold caches
+def best_time_memory(setup, func, repeat = BENCHMARK_REPEAT):
+	times = []
+	peak = None
+	for i in range(repeat):
+		arg = setup()
+		if tracemalloc and i == repeat - 1:		# tracing slows the run down, so the last run is traced but not timed
+			tracemalloc.start()
+			func(arg)
+			peak = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+			break
+		start_time = time.time()
+		func(arg)
+		times.append(time.time() - start_time)
+	return min(times) if times else None, peak
+
+# A file that throws away what is written to it, so only serializing is measured
+class Null_File(object):
+	def write(self, text):
+		pass
+###
+
+# A flat object with size int properties named prop_0 to prop_{size-1}
+def flat_structure(size):
+	struct = Structure_Object("benchmark")
+	for i in range(size):
+		struct.append(Structure_Property(get_structural_type("int"), "prop_%d" % i, None, str(i), {"min": "0", "max": str(size)}))
+	return struct
+
+# The XML of a flat object with size int properties, written the way schema.xml files are
+def flat_schema_xml(size):
+	lines = ["<object name=\"benchmark\">"]
+	for i in range(size):
+		lines.append("\t<int name=\"prop_%d\" label=\"Property %d\" min=\"0\" max=\"%d\">%d</int>" % (i, i, size, i))
+	lines.append("</object>")
+	return "\n".join(lines)
+
+
+# Name lookups through the Structure_Object index against the linear scan they replaced
+def benchmark_index(size):
+	struct = flat_structure(size)
+	config = Configuration(struct)
+	names = [sub_struct.name for sub_struct in struct]
+	def linear_lookup():
+		for name in names:
+			for sub_struct in struct.tree:
+				if sub_struct.name == name:
+					break
+	def indexed_lookup():
+		for name in names:
+			struct[name]
+	return {
+		"lookup_linear":	best_time(linear_lookup),
+		"lookup_indexed":	best_time(indexed_lookup),
+		"as_obj":			best_time(config.as_obj)
+	}
+
+# Loading a schema without its cache (parse only), with a missing cache (parse and write it) and with a fresh cache
+def time_schema_file(schema_file):
+	cache_file = schema_file + SCHEMA_CACHE_EXTENSION
+	def cold_load():
+		if os.path.isfile(cache_file):
+			os.remove(cache_file)
+		schema_from_file(schema_file, True)
+	result = {
+		"parse_only":	best_time(lambda: schema_from_file(schema_file, False)),
+		"cold_cache":	best_time(cold_load)
+	}
+	result["warm_cache"] = best_time(lambda: schema_from_file(schema_file, True))
+	return result
+
+# Schema files given with --schema are timed in a copy, so their own caches are left alone
+def benchmark_schema(size, schema_file = None):
+	temp_dir = tempfile.mkdtemp()
+	try:
+		temp_file = os.path.join(temp_dir, "schema.xml")
+		if schema_file:
+			shutil.copyfile(schema_file, temp_file)
+		else:
+			with open(temp_file, "w") as file:
+				file.write(flat_schema_xml(size))
+		return time_schema_file(temp_file)
+	finally:
+		shutil.rmtree(temp_dir)
+
+# The OP25 plugin configuration with size devices and size channels, each holding its defaults
+def op25_configuration(size):
+	struct = schema_from_file(BENCHMARK_OP25_SCHEMA, False)
+	data = {}
+	for array_name in ["devices", "channels"]:
+		item = struct[array_name].tree[0]
+		item_obj = Configuration(item).as_obj()
+		item_obj[SCHEMA_STRUCTURE_OBJECT_CONTEXT_NAME] = item.name
+		data[array_name] = [dict(item_obj) for i in range(size)]
+	config = Root_Configuration("benchmark.json", struct)
+	config.set_data(data)
+	return config
+
+# Loading a configuration with the default array copies built up front and with them deferred
+# op25 is the OP25 plugin configuration with size devices and size channels in its data. copies is an array whose schema
+# declares size default copies of the OP25 device, with 10 devices in its data, where every default copy is thrown away
+def benchmark_lazy(size):
+	struct = schema_from_file(BENCHMARK_OP25_SCHEMA, False)
+	op25_data = {}
+	for array_name in ["devices", "channels"]:
+		item = struct[array_name].tree[0]
+		item_obj = Configuration(item).as_obj()
+		item_obj[SCHEMA_STRUCTURE_OBJECT_CONTEXT_NAME] = item.name
+		op25_data[array_name] = [dict(item_obj) for i in range(size)]
+	copies_struct = Structure_Object("devices", None, {"copies": str(size)})
+	copies_struct.is_array = True
+	copies_struct.append(struct["devices"].tree[0])
+	copies_data = op25_data["devices"][:10]
+	def load(args):
+		load_struct, data = args
+		config = Configuration(load_struct)
+		config.set_data(data)
+	lazy_structure = configuration.CONFIGURATION_LAZY_STRUCTURE
+	result = {}
+	try:
+		for mode, lazy in [("eager", False), ("lazy", True)]:
+			configuration.CONFIGURATION_LAZY_STRUCTURE = lazy
+			for name, load_struct, data in [("op25", struct, op25_data), ("copies", copies_struct, copies_data)]:
+				key = "%s_%s" % (name, mode)
+				result[key], peak = best_time_memory(lambda: (load_struct, data), load)
+				if peak != None:
+					result[key + "_peak_kib"] = peak / 1024.0
+	finally:
+		configuration.CONFIGURATION_LAZY_STRUCTURE = lazy_structure
+	return result
+
+# Serializing through as_obj and json.dump, to_json and the streaming dump, with cold caches
+# to_json is also timed with warm caches, and again after one value is changed
+def benchmark_serialize(size):
+	def setup():
+		return op25_configuration(size)
+	def edit_setup():
+		config = op25_configuration(size)
+		config.to_json()
+		config["devices"][size // 2]["ppm"] = 1.0
+		return config
+	def warm_setup():
+		config = op25_configuration(size)
+		config.to_json()
+		return config
+	result = {}
+	for name, setup_func, func in [
+		("as_obj_json_dump",	setup,		lambda config: json.dump(config.as_obj(), Null_File(), indent=CONFIGURATION_JSON_INDENT)),
+		("to_json",				setup,		lambda config: config.to_json()),
+		("dump",				setup,		lambda config: config.dump(Null_File())),
+		("to_json_one_edit",	edit_setup,	lambda config: config.to_json()),
+		("to_json_unchanged",	warm_setup,	lambda config: config.to_json())
+	]:
+		result[name], peak = best_time_memory(setup_func, func)
+		if peak != None:
+			result[name + "_peak_kib"] = peak / 1024.0
+	return result
+
+# The validators as they were before limits and options were precomputed, reading the attribute dict on every call
+# They are given the property, which still answers like the attribute dict
+def legacy_validate_number(x, attribs, castor):
+	try:
+		x_num = castor(x)
+	except ValueError:
+		return False
+	if "min" in attribs and x_num < castor(attribs["min"]):
+		return False
+	if "max" in attribs and x_num > castor(attribs["max"]):
+		return False
+	return True
+
+def legacy_validate_string(x, attribs):
+	if "min" in attribs and len(x) < int(attribs["min"]):
+		return False
+	if "max" in attribs and len(x) > int(attribs["max"]):
+		return False
+	if "options" in attribs and not x in attribs["options"].split(SCHEMA_OPTION_DELIMITER):
+		return False
+	return not x.isspace()
+
+# size calls of each validator against the legacy validator, and of get_options against splitting the options every call
+def benchmark_validate(size):
+	options = ",".join(["option_%d" % i for i in range(10)])
+	cases = [
+		("int",		Structure_Property(get_structural_type("int"), "int", None, "50", {"min": "0", "max": "100"}), "50",
+					lambda x, prop: legacy_validate_number(x, prop, int)),
+		("float",	Structure_Property(get_structural_type("float"), "float", None, "0.5", {"min": "0", "max": "1"}), "0.5",
+					lambda x, prop: legacy_validate_number(x, prop, float)),
+		("string",	Structure_Property(get_structural_type("string"), "string", None, "option_9", {"options": options}), "option_9",
+					legacy_validate_string),
+		("bool",	Structure_Property(get_structural_type("bool"), "bool", None, "true"), "false",
+					lambda x, prop: str(x).lower() in ["true", "1", "false", "0"])
+	]
+	calls = range(size)
+	result = {}
+	for name, prop, value, legacy_validate in cases:
+		assert prop.validate_value(value) and legacy_validate(value, prop)
+		result[name + "_legacy"] = best_time(lambda: [legacy_validate(value, prop) for i in calls])
+		result[name] = best_time(lambda: [prop.validate_value(value) for i in calls])
+	prop = cases[2][1]
+	result["get_options_legacy"] = best_time(lambda: [prop["options"].split(SCHEMA_OPTION_DELIMITER) for i in calls])
+	result["get_options"] = best_time(lambda: [prop.get_options() for i in calls])
+	return result
+
+# Configuration.validate over the whole OP25 plugin configuration with size devices and size channels
+# Every value is checked serially, and again with the filesystem types on the validation pool
+def benchmark_validate_tree(size):
+	config = op25_configuration(size)
+	values = len(list(config.iter_properties()))
+	return {
+		"values":		values,
+		"serial":		best_time(lambda: config.validate(1)),
+		"pooled":		best_time(lambda: config.validate())
+	}
+
+BENCHMARKS = {
+	"index":		benchmark_index,
+	"lazy":			benchmark_lazy,
+	"schema":		benchmark_schema,
+	"serialize":	benchmark_serialize,
+	"validate":		benchmark_validate,
+	"validate_tree":	benchmark_validate_tree
+}
+
+
+def main():
+	parser = OptionParser(usage="%%prog [options] [%s]..." % "|".join(sorted(BENCHMARKS)))
+	parser.add_option("-n", "--sizes", type="string", default=",".join([str(x) for x in BENCHMARK_SIZES]), help="Comma separated sizes to measure: properties in a schema, devices and channels, or validator calls")
+	parser.add_option("-s", "--schema", type="string", action="append", default=[], help="Time this schema file in the schema benchmark instead of synthetic ones. May be repeated")
+	parser.add_option("-j", "--json", action="store_true", default=False, help="Print the results as JSON")
+	options, args = parser.parse_args()
+	names = args if args else sorted(BENCHMARKS)
+	if any(name not in BENCHMARKS for name in names):
+		parser.print_help()
+		sys.exit(1)
+	sizes = [int(x) for x in options.sizes.split(",")]
+
+	results = []
+	for name in names:
+		if name == "schema" and options.schema:
+			for schema_file in options.schema:
+				result = benchmark_schema(None, schema_file)
+				result.update({"benchmark": name, "size": schema_file})
+				results.append(result)
+			continue
+		for size in sizes:
+			result = BENCHMARKS[name](size)
+			result.update({"benchmark": name, "size": size})
+			results.append(result)
+	if options.json:
+		print(json.dumps(results, indent=4, sort_keys=True))
+		return None
+	for result in results:
+		timings = []
+		for key, value in sorted(result.items()):
+			if key in ["benchmark", "size"]:
+				continue
+			if isinstance(value, int):		# counts
+				timings.append("%s %d" % (key, value))
+			elif key.endswith("_kib"):
+				timings.append("%s %.0f" % (key, value))
+			else:
+				timings.append("%s %.2fms" % (key, value * 1000))
+		timings = ", ".join(timings)
+		print("%-10s %6s: %s" % (result["benchmark"], result["size"], timings))
+
+if __name__ == "__main__":
+	main()
@@ -3,7 +3,8 @@
 
 import os.path, logging
 
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtCore import Qt, QModelIndex, pyqtSignal
 from PyQt5.QtWidgets import QMessageBox, QFileDialog
 
 from main import DEFAULT_CONFIG_FILE
@@ -13,36 +14,225 @@ from gui import *
 
 GUI_CONFIG_TREE_COLUMNS	= ["Label", "Object"]
 GUI_CONFIG_DATA_HEADERS	= ["Key", "Type", "Value"]
+GUI_CONFIG_FETCH_BATCH	= 256		# children added to the tree per fetchMore
 
 
-def configuration_to_configurable_qtreewidgetitem(config):
-	assert issubclass(type(config), Configuration)
-	item = Data_Defined_QTreeWidgetItem(config)
-	item.setText(0, str(config))
-	if config.struct and config.struct.name:
-		item.setText(1, config.struct.name)
-	for key, value in config.items():
-		if not issubclass(type(value), Configuration):
-			continue
-		child_text = str(key) if not config.is_list() or not value.struct or not value.struct.name else value.struct.name
-		child_item = configuration_to_configurable_qtreewidgetitem(value)
-		if child_item:
-			item.addChild(child_item)
-	return item
+# A configuration in the tree model. Children are only created as the view fetches them
+class Configuration_Tree_Node(object):
+	def __init__(self, config, parent = None, row = 0):
+		self.config = config
+		self.parent = parent
+		self.row = row
+		self.children = []			# fetched child nodes, always a prefix of child_configs
+		self.child_configs = None	# every child configuration, found on first use
+	
+	def get_child_configs(self):
+		if self.child_configs == None:
+			self.child_configs = [value for key, value in self.config.items() if issubclass(type(value), Configuration)]
+		return self.child_configs
+	
+	def has_children(self):
+		if self.child_configs != None:
+			return len(self.child_configs) > 0
+		return any(issubclass(type(value), Configuration) for key, value in self.config.items())
+	
+	def can_fetch_more(self):
+		return len(self.children) < len(self.get_child_configs())
+###
+
+
+# Model over a live Configuration tree for the object tree of the editor
+class Configuration_Tree_Model(QtCore.QAbstractItemModel):
+	def __init__(self, parent = None):
+		super(Configuration_Tree_Model, self).__init__(parent)
+		self.root = None
+	
+	def set_config(self, config):
+		self.beginResetModel()
+		self.root = Configuration_Tree_Node(config) if config else None
+		self.endResetModel()
+	
+	def get_node(self, index):
+		return index.internalPointer() if index.isValid() else None
+	
+	def get_config(self, index):
+		node = self.get_node(index)
+		return node.config if node else None
+	
+	# Index of the top level configuration
+	def get_root_index(self):
+		return self.createIndex(0, 0, self.root) if self.root else QModelIndex()
+	
+	def index(self, row, column, parent = QModelIndex()):
+		if not self.hasIndex(row, column, parent):
+			return QModelIndex()
+		if not parent.isValid():
+			return self.createIndex(row, column, self.root)
+		return self.createIndex(row, column, self.get_node(parent).children[row])
+	
+	def parent(self, index):
+		node = self.get_node(index)
+		if not node or not node.parent:
+			return QModelIndex()
+		return self.createIndex(node.parent.row, 0, node.parent)
+	
+	def rowCount(self, parent = QModelIndex()):
+		if parent.column() > 0:
+			return 0
+		if not parent.isValid():
+			return 1 if self.root else 0
+		return len(self.get_node(parent).children)
+	
+	def columnCount(self, parent = QModelIndex()):
+		return len(GUI_CONFIG_TREE_COLUMNS)
+	
+	def hasChildren(self, parent = QModelIndex()):
+		if not parent.isValid():
+			return self.root != None
+		return parent.column() == 0 and self.get_node(parent).has_children()
+	
+	def canFetchMore(self, parent):
+		return parent.isValid() and self.get_node(parent).can_fetch_more()
+	
+	def fetchMore(self, parent):
+		node = self.get_node(parent)
+		if not node:
+			return None
+		child_configs = node.get_child_configs()
+		start = len(node.children)
+		end = min(start + GUI_CONFIG_FETCH_BATCH, len(child_configs))
+		if end <= start:
+			return None
+		self.beginInsertRows(parent, start, end - 1)
+		for row in range(start, end):
+			node.children.append(Configuration_Tree_Node(child_configs[row], node, row))
+		self.endInsertRows()
+	
+	def data(self, index, role = Qt.DisplayRole):
+		if role != Qt.DisplayRole:
+			return None
+		config = self.get_config(index)
+		if index.column() == 0:
+			return str(config)
+		if index.column() == 1 and config.struct and config.struct.name:
+			return config.struct.name
+		return None
+	
+	def headerData(self, section, orientation, role = Qt.DisplayRole):
+		if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+			return GUI_CONFIG_TREE_COLUMNS[section]
+		return None
+	
+	# Call after appending config to the configuration at parent
+	def append_config(self, parent, config):
+		node = self.get_node(parent)
+		child_configs = node.get_child_configs()
+		fully_fetched = len(node.children) == len(child_configs)
+		child_configs.append(config)
+		if fully_fetched:	# otherwise the next fetchMore picks it up
+			row = len(node.children)
+			self.beginInsertRows(parent, row, row)
+			node.children.append(Configuration_Tree_Node(config, node, row))
+			self.endInsertRows()
+	
+	# Call after removing the configuration at index from its parent configuration
+	def remove_config(self, index):
+		node = self.get_node(index)
+		if not node or not node.parent:
+			return None
+		parent_node = node.parent
+		self.beginRemoveRows(self.parent(index), node.row, node.row)
+		parent_node.children.pop(node.row)
+		parent_node.child_configs.pop(node.row)
+		for row in range(node.row, len(parent_node.children)):
+			parent_node.children[row].row = row
+		self.endRemoveRows()
+###
+
+
+# Model over the values (not objects) of one configuration for the value table of the editor
+# Cells are rendered from the configuration on demand and edits are validated against the structure
+class Configuration_Table_Model(QtCore.QAbstractTableModel):
+	sig_value_changed	= pyqtSignal(str)
+	sig_value_rejected	= pyqtSignal(str)
+	
+	def __init__(self, parent = None):
+		super(Configuration_Table_Model, self).__init__(parent)
+		self.config = None
+		self.keys = []
+	
+	def set_config(self, config):
+		self.beginResetModel()
+		self.config = config
+		self.keys = []
+		if config:
+			for key, child in config.items():
+				if issubclass(type(child), Configuration) or (SCHEMA_STRUCTURE_OBJECT_CONTEXT_ATTRIBUTES and key == SCHEMA_STRUCTURE_OBJECT_CONTEXT_NAME):
+					continue
+				self.keys.append(key)
+		self.endResetModel()
+	
+	def get_struct(self, key):
+		return self.config.struct[key] if self.config.struct and key in self.config.struct else None
+	
+	def rowCount(self, parent = QModelIndex()):
+		return 0 if parent.isValid() else len(self.keys)
+	
+	def columnCount(self, parent = QModelIndex()):
+		return 0 if parent.isValid() else len(GUI_CONFIG_DATA_HEADERS)
+	
+	def data(self, index, role = Qt.DisplayRole):
+		if not index.isValid():
+			return None
+		key = self.keys[index.row()]
+		child = self.config[key]
+		child_struct = self.get_struct(key)
+		column = index.column()
+		if role in (Qt.DisplayRole, Qt.EditRole):
+			if column == 0:
+				return str(key)
+			elif column == 1:
+				return child_struct.struct_type.type_name if child_struct else type(child).__name__
+			return str(child)
+		elif role == Qt.ToolTipRole and child_struct:
+			if column == 0 and child_struct.label:
+				return child_struct.label
+			elif column == 2 and child_struct.default:
+				return str(child_struct.default)
+		return None
+	
+	def headerData(self, section, orientation, role = Qt.DisplayRole):
+		if role != Qt.DisplayRole:
+			return None
+		return GUI_CONFIG_DATA_HEADERS[section] if orientation == Qt.Horizontal else section + 1
+	
+	# Keys and types can't be edited, and values can only be edited if there is a structure to validate them
+	def flags(self, index):
+		if not index.isValid():
+			return Qt.NoItemFlags
+		if not self.get_struct(self.keys[index.row()]):
+			return Qt.ItemIsSelectable
+		if index.column() == 2:
+			return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+		return Qt.ItemIsSelectable | Qt.ItemIsEnabled
+	
+	def setData(self, index, value, role = Qt.EditRole):
+		if role != Qt.EditRole or not index.isValid() or index.column() != 2:
+			return False
+		key = self.keys[index.row()]
+		child_struct = self.get_struct(key)
+		if not child_struct:
+			self.sig_value_rejected.emit("This value cannot be modified because no structure for this key could be found. Either reload with the schema file or directly modify the JSON.")
+			return False
+		if not child_struct.validate_value(value):
+			self.sig_value_rejected.emit("The value entered is not valid")
+			return False
+		self.config[key] = child_struct.cast_value(value)
+		self.dataChanged.emit(index, index)
+		self.sig_value_changed.emit(str(key))
+		return True
+###
 
-def configuration_to_qtablewidgetitem_matrix(config):
-	items = []
-	for key, child in config.items():
-		if issubclass(type(child), Configuration) or (SCHEMA_STRUCTURE_OBJECT_CONTEXT_ATTRIBUTES and key == SCHEMA_STRUCTURE_OBJECT_CONTEXT_NAME):
-			continue
-		child_struct = config.struct[key] if config.struct and key in config.struct else None
-		disabled_flags = FLAG_TABLE_CELL_PARTIAL_ENABLED if child_struct else FLAG_TABLE_CELL_FULL_ENABLED
-		items.append([
-			Data_Defined_QTableWidgetItem(key, key).enable_flags(disabled_flags, False).setToolTip(child_struct.label if child_struct and child_struct.label else None),
-			Data_Defined_QTableWidgetItem(key, child_struct.struct_type.type_name if child_struct else type(child).__name__).enable_flags(disabled_flags, False),
-			Data_Defined_QTableWidgetItem(key, str(child)).enable_flags(0 if child_struct else disabled_flags, False).setToolTip(str(child_struct.default) if child_struct and hasattr(child_struct, "default") and child_struct.default else None)
-		])
-	return items
 
 def create_file_dialog(parent, title, format, save_mode = False, existing_file = None):
 	if format == "config":
@@ -63,7 +253,6 @@ class GUI_Configuration_Advanced(GUI_MainWindow):
 	def __init__(self, config = None, *args, **kwargs):
 		super(GUI_Configuration_Advanced, self).__init__(config, *args, **kwargs)
 		self.working_config = None
-		self.loading_table = False
 		self.changes = False
 		self.__init_gui()
 		self.load_config()
@@ -85,10 +274,10 @@ class GUI_Configuration_Advanced(GUI_MainWindow):
 		self.dialog_buttons.button(QtWidgets.QDialogButtonBox.Cancel).clicked.connect(lambda: self.safe_close(False))
 		self.dialog_buttons.button(QtWidgets.QDialogButtonBox.Ok).clicked.connect(lambda: self.safe_close(True))
 		
-		self.config_tree = self.findChild(QtWidgets.QTreeWidget, "config_tree")
-		self.config_tree.itemClicked.connect(self.config_tree_item_clicked)
-		self.config_tree.setColumnCount(len(GUI_CONFIG_TREE_COLUMNS))
-		self.config_tree.setHeaderLabels(GUI_CONFIG_TREE_COLUMNS)
+		self.config_tree_model = Configuration_Tree_Model(self)
+		self.config_tree = self.findChild(QtWidgets.QTreeView, "config_tree")
+		self.config_tree.setModel(self.config_tree_model)
+		self.config_tree.clicked.connect(self.config_tree_item_clicked)
 		tree_header = self.config_tree.header()
 		tree_header.setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
 		# tree_header.resizeSection(0, 400)
@@ -96,10 +285,11 @@ class GUI_Configuration_Advanced(GUI_MainWindow):
 		for i in range(len(GUI_CONFIG_TREE_COLUMNS) - 1):
 			tree_header.setSectionResizeMode(i, QtWidgets.QHeaderView.ResizeToContents)
 		
-		self.config_table = self.findChild(QtWidgets.QTableWidget, "config_table")
-		self.config_table.itemChanged.connect(self.config_table_cell_changed)
-		self.config_table.setColumnCount(len(GUI_CONFIG_DATA_HEADERS))
-		self.config_table.setHorizontalHeaderLabels(GUI_CONFIG_DATA_HEADERS)
+		self.config_table_model = Configuration_Table_Model(self)
+		self.config_table_model.sig_value_changed.connect(self.config_table_cell_changed)
+		self.config_table_model.sig_value_rejected.connect(lambda message: QMessageBox.critical(self, "Cannot modify value", message, QMessageBox.Ok))
+		self.config_table = self.findChild(QtWidgets.QTableView, "config_table")
+		self.config_table.setModel(self.config_table_model)
 		table_header = self.config_table.horizontalHeader()
 		table_header.setSectionResizeMode(len(GUI_CONFIG_DATA_HEADERS) - 1, QtWidgets.QHeaderView.Stretch)
 		for i in range(len(GUI_CONFIG_DATA_HEADERS) - 1):
@@ -109,8 +299,8 @@ class GUI_Configuration_Advanced(GUI_MainWindow):
 		selection = self.get_selection()
 		has_config = self.config != None
 		has_selection = selection != None
-		selection_is_structural_array = has_selection and len(selection.data.get_structural_array_configurations(False)) > 0
-		parent_selection_is_structural_array = has_selection and selection.parent() != None and len(selection.parent().data.get_structural_array_configurations(False)) > 0 
+		selection_is_structural_array = has_selection and len(self.config_tree_model.get_config(selection).get_structural_array_configurations(False)) > 0
+		parent_selection_is_structural_array = has_selection and selection.parent().isValid() and len(self.config_tree_model.get_config(selection.parent()).get_structural_array_configurations(False)) > 0
 		self.actionSave.setEnabled(has_config)
 		self.actionSave_As.setEnabled(has_config)
 		self.actionSave_Object.setEnabled(has_selection)
@@ -121,15 +311,16 @@ class GUI_Configuration_Advanced(GUI_MainWindow):
 		self.actionReset.setEnabled(has_config)
 		
 	def get_selection(self):
-		if len(self.config_tree.selectedItems()) == 0:
+		selected = self.config_tree.selectionModel().selectedIndexes()
+		if len(selected) == 0:
 			return None
-		return self.config_tree.selectedItems()[0]
+		return selected[0]
 	
 	def get_selected_config(self):
 		selection = self.get_selection()
 		if not selection:
 			return None
-		return selection.data
+		return self.config_tree_model.get_config(selection)
 	
 	def prompt_unsaved_changes(self, cancelable = False):
 		if not self.changes:
@@ -153,12 +344,8 @@ class GUI_Configuration_Advanced(GUI_MainWindow):
 		assert self.config == None or issubclass(type(self.config), Configuration)
 		self.working_config = None
 		self.changes = False
-		self.config_tree.clear()
-		self.config_table.clearContents()
-		self.config_table.setRowCount(0)
-		if self.config:
-			top_item = configuration_to_configurable_qtreewidgetitem(self.config)
-			self.config_tree.addTopLevelItem(top_item)
+		self.config_table_model.set_config(None)
+		self.config_tree_model.set_config(self.config)
 		self.refresh_action_buttons()
 	
 	def save_config(self, config = None, prompt_dialog = False):
@@ -231,39 +418,23 @@ class GUI_Configuration_Advanced(GUI_MainWindow):
 		self.config = config
 		self.load_config()
 	
-	def config_tree_item_clicked(self, item):
-		self.refresh_config_table(item)
+	def config_tree_item_clicked(self, index):
+		self.refresh_config_table(index)
 		self.refresh_action_buttons()
 	
-	def refresh_config_table(self, item):
-		self.working_config = item.data
-		self.loading_table = True
-		qtablewidgetitems_matrix = configuration_to_qtablewidgetitem_matrix(self.working_config)
-		self.config_table.setRowCount(len(qtablewidgetitems_matrix))
-		for row, qtablewidgetitems in enumerate(qtablewidgetitems_matrix):
-			for col, qtablewidgetitem in enumerate(qtablewidgetitems):
-				self.config_table.setItem(row, col, qtablewidgetitem)
-		self.loading_table = False
-	
-	def config_table_cell_changed(self, item):
-		if self.loading_table or not self.working_config or not item.data in self.working_config:
-			return None
-		key = item.data
-		if not self.working_config.struct or not key in self.working_config.struct:
-			QMessageBox.critical(self, "Cannot modify value", "This value cannot be modified because no structure for this key could be found. Either reload with the schema file or directly modify the JSON.", QMessageBox.Ok)
-			return None
-		new_value = item.text()
-		if not self.working_config.struct[key].validate_value(new_value):
-			QMessageBox.critical(self, "Cannot modify value", "The value entered is not valid", QMessageBox.Ok)
-			return None
-		self.working_config[key] = self.working_config.struct[key].cast_value(new_value)
+	def refresh_config_table(self, index):
+		self.working_config = self.config_tree_model.get_config(index)
+		self.config_table_model.set_config(self.working_config)
+	
+	# The table model has already validated and stored the value
+	def config_table_cell_changed(self, key):
 		self.changes = True
 	
 	def add_object(self, checked = False):
-		item = self.get_selection()
-		if not item:
+		index = self.get_selection()
+		if not index:
 			return None
-		config = item.data
+		config = self.config_tree_model.get_config(index)
 		configs = config.get_structural_array_configurations()
 		if len(configs) == 0:
 			return None
@@ -275,33 +446,44 @@ class GUI_Configuration_Advanced(GUI_MainWindow):
 				return None
 			config_append = prompt.get_selected()
 		config.append(config_append)
-		item.addChild(configuration_to_configurable_qtreewidgetitem(config_append))
+		self.config_tree_model.append_config(index, config_append)
 		self.changes = True
 	
 	def remove_object(self, checked = False):
-		item = self.get_selection()
-		if not item:
+		index = self.get_selection()
+		if not index:
 			return None
-		item_config = item.data
-		parent = item.parent()
-		if not parent:
+		item_config = self.config_tree_model.get_config(index)
+		parent = index.parent()
+		if not parent.isValid():
 			return None
-		parent_config = parent.data
+		parent_config = self.config_tree_model.get_config(parent)
 		if len(parent_config.get_structural_array_configurations()) == 0:
 			return None
+		if item_config is self.working_config:
+			self.working_config = None
+			self.config_table_model.set_config(None)
 		parent_config.remove(item_config)
-		parent.removeChild(item)
+		self.config_tree_model.remove_config(index)
 		self.changes = True
 		
 		
-	def expand_config_tree(self, expand, item = None):
-		if not item and len(self.config_tree.selectedItems()) > 0:
-			item = self.config_tree.selectedItems()[0]
-		elif self.config_tree.topLevelItemCount() > 0:
-			item = self.config_tree.topLevelItem(0)
-		else:
+	def expand_config_tree(self, expand, index = None):
+		if not index:
+			index = self.get_selection()
+		if not index:
+			index = self.config_tree_model.get_root_index()
+		if not index.isValid():
 			return None
-		item.expand_recusive(expand)
+		self.expand_recursive(index, expand)
+	
+	# Expanding fetches every child, while collapsing only visits children that were already fetched
+	def expand_recursive(self, index, expand):
+		self.config_tree.setExpanded(index, expand)
+		while expand and self.config_tree_model.canFetchMore(index):
+			self.config_tree_model.fetchMore(index)
+		for row in range(self.config_tree_model.rowCount(index)):
+			self.expand_recursive(self.config_tree_model.index(row, 0, index), expand)
 ###
 
 
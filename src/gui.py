@@ -1,12 +1,17 @@
 # Copyright 2020 Scott Maday
 
-import os, logging
+import os, io, logging
+from xml.etree import ElementTree
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QTreeWidgetItem, QTableWidgetItem
 
 GUI_DIRECTORY_NAME = "gui"
 
+GUI_COMPILED_FORMS_ENABLED	= True			# use python forms compiled from .ui files instead of parsing the .ui on every window
+GUI_COMPILED_FORM_SUFFIX	= "_ui.py"		# gui/main.ui is compiled to gui/main_ui.py
+GUI_FORM_FILE_TAGS			= ["normaloff", "normalon", "disabledoff", "disabledon", "activeoff", "activeon", "selectedoff", "selectedon", "pixmap"]
+
 FLAG_ITEM_ISSELECTABLE	= Qt.ItemIsSelectable
 FLAG_ITEM_ISEDITABLE	= Qt.ItemIsEditable
 FLAG_ITEM_ISENABLED		= Qt.ItemIsEnabled
@@ -17,6 +22,71 @@ FLAG_TABLE_CELL_FULL_ENABLED		= FLAG_ITEM_ISEDITABLE | FLAG_ITEM_ISENABLED
 
 ################################ [ HELPER FUNCTIONS & CLASSES ]	################################
 
+gui_logger = logging.getLogger(__name__)
+_form_classes = {}	# compiled form file -> (mtime, form class), so reopening a window does not even re-execute the form
+
+def get_compiled_form_file(ui_file):
+	return os.path.splitext(ui_file)[0] + GUI_COMPILED_FORM_SUFFIX
+
+# Compiles a .ui file into a python form next to it
+# uic.loadUi resolves icons relative to the .ui file while compiled forms resolve them relative to the working directory,
+# so relative file paths are rewritten to include the .ui file's directory first
+def compile_ui_form(ui_file):
+	tree = ElementTree.parse(ui_file)
+	ui_dir = os.path.dirname(ui_file)
+	for elem in tree.iter():
+		if elem.tag in GUI_FORM_FILE_TAGS and elem.text and not elem.text.startswith(":") and not os.path.isabs(elem.text):
+			elem.text = os.path.join(ui_dir, elem.text)
+	form_file = get_compiled_form_file(ui_file)
+	temp_file = form_file + ".tmp"
+	with open(temp_file, "w") as file:	# compileUi writes str, which io.StringIO would refuse on python2
+		uic.compileUi(io.BytesIO(ElementTree.tostring(tree.getroot())), file)
+	if hasattr(os, "replace"):
+		os.replace(temp_file, form_file)
+	else:
+		os.rename(temp_file, form_file)
+	gui_logger.debug("Compiled form %s to %s", ui_file, form_file)
+	return form_file
+
+def compile_ui_forms(ui_files):
+	for ui_file in ui_files:
+		try:
+			compile_ui_form(ui_file)
+		except Exception:
+			gui_logger.exception("Could not compile form %s", ui_file)
+
+# Returns the form class for a .ui file, compiling it first if there is no compiled form or the .ui is newer
+def load_form_class(ui_file):
+	form_file = get_compiled_form_file(ui_file)
+	if not os.path.isfile(form_file) or os.path.getmtime(form_file) < os.path.getmtime(ui_file):
+		compile_ui_form(ui_file)
+	mtime = os.path.getmtime(form_file)
+	if form_file in _form_classes and _form_classes[form_file][0] == mtime:
+		return _form_classes[form_file][1]
+	namespace = {}
+	with open(form_file, "r") as file:
+		exec(compile(file.read(), form_file, "exec"), namespace)
+	form_class = next(value for name, value in namespace.items() if name.startswith("Ui_") and isinstance(value, type))
+	_form_classes[form_file] = (mtime, form_class)
+	return form_class
+
+# Does what uic.loadUi(ui_file, widget) does, using a compiled form when possible
+def setup_ui(widget, ui_file):
+	if GUI_COMPILED_FORMS_ENABLED:
+		form_class = None
+		try:
+			form_class = load_form_class(ui_file)
+		except Exception:
+			gui_logger.warning("Could not use a compiled form for %s. Falling back to parsing it", ui_file, exc_info=True)
+		if form_class:
+			form = form_class()
+			form.setupUi(widget)
+			for name, value in vars(form).items():	# loadUi sets every named widget as an attribute of the widget
+				setattr(widget, name, value)
+			return widget
+	uic.loadUi(ui_file, widget)
+	return widget
+
 def enable_flags(current_flags, flags, enable):
 	flags = int(flags)
 	if enable:
@@ -65,7 +135,7 @@ class GUI_MainWindow(QtWidgets.QMainWindow):
 	def __init__(self, config = None, *args, **kwargs):
 		super(GUI_MainWindow, self).__init__(*args, **kwargs)
 		if self._file_name:
-			uic.loadUi(self._file_name, self)
+			setup_ui(self, self._file_name)
 		self.statusBar().setSizeGripEnabled(False)
 		self.config = config
 	
@@ -83,7 +153,7 @@ class GUI_DialogWindow(QtWidgets.QDialog):
 		super(GUI_DialogWindow, self).__init__(*args, **kwargs)
 		self.setWindowModality(Qt.ApplicationModal)
 		if self._file_name:
-			uic.loadUi(self._file_name, self)
+			setup_ui(self, self._file_name)
 		self.config = config
 	
 	def __getitem__(self, key):
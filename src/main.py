@@ -3,12 +3,14 @@
 
 # Copyright 2020 Scott Maday
 
-import sys, os, logging
+import sys, os, logging, time, atexit, glob
 from optparse import OptionParser
+from multiprocessing.pool import ThreadPool
 
 import pluginlib
 from PyQt5 import QtWidgets
 
+import configuration
 from configuration import *
 from plugin import *
 from gui import *
@@ -31,19 +33,33 @@ def cli_options():
 	parser.add_option("-v", "--verbose", type="int", default=DEFAULT_VERBOSITY, help="Verbosity of logging. The number is based off of python's logging library")
 	parser.add_option("-c", "--config", type="string", default=DEFAULT_CONFIG_FILE, help="Location of configuration json file")
 	parser.add_option("-s", "--schema", type="string", default=DEFAULT_SCHEMA_FILE, help="Location of schema xml file")
+	parser.add_option("--compile-ui", action="store_true", default=False, help="Compile every .ui form into a python form and exit")
+	parser.add_option("-p", "--profile", type="string", default=None, help="Write a plugin startup timing report to this file on exit. Use a .folded extension for flame graph tools, otherwise JSON")
+	parser.add_option("--no-schema-cache", action="store_true", default=False, help="Parse every schema.xml instead of loading its compiled cache. Use with --profile to compare cold and warm startup")
 	options, args = parser.parse_args()
 	if len(args) != 0:
 		parser.print_help()
 		sys.exit(1)
 	logging.basicConfig(level=options.verbose)
+	if options.compile_ui:
+		compile_ui_forms(glob.glob(os.path.join(GUI_DIRECTORY_NAME, "*.ui")) + glob.glob(os.path.join(PLUGIN_DIR_NAME, "*", "*.ui")))
+		sys.exit(0)
+	if options.no_schema_cache:
+		configuration.SCHEMA_CACHE_ENABLED = False
+	if options.profile:
+		plugin_profiler.enable()
+		atexit.register(lambda: plugin_profiler.dump(options.profile))
 	
 	if os.path.isfile(options.config):
 		logger.info("Main configuration file set to: %s", options.config)
-	main_config = configuration_from_file(options.config, options.schema, True)
+	with plugin_profiler.phase("main", "configuration"):
+		main_config = configuration_from_file(options.config, options.schema, True)
 	
 def run_gui():
 	global qt_app, main_config
 	qt_app = QtWidgets.QApplication(sys.argv[:1])
+	event_bus.attach_qt()
+	plugin_async_runtime.attach_qt()
 	main = GUI_Main(main_config)
 	# main.show()
 	for plugin_obj in plugins:
@@ -51,29 +67,49 @@ def run_gui():
 			plugin_obj.start()
 	# c = GUI_Configuration_Advanced(None)
 	# c.show()
-	sys.exit(qt_app.exec_())
+	status = qt_app.exec_()
+	plugin_async_runtime.shutdown()
+	plugin_executor.shutdown(False)
+	sys.exit(status)
 
+# With PLUGIN_LAZY_IMPORT only plugins that will run straight away are imported here
+def load_plugin(module):
+	global main_config
+	start_time = time.time()
+	module_name = os.path.splitext(os.path.basename(module))[0]
+	try:
+		if PLUGIN_LAZY_IMPORT:
+			plugin_obj = Plugin_Proxy(module, main_config)
+			plugin_obj.load_time = time.time() - start_time
+			if plugin_obj.active and plugin_obj.auto_run:
+				plugin_obj.resolve()
+		else:
+			plugin_obj = plugin_from_class(os.path.dirname(module), plugin_class_from_module(module), main_config)
+			plugin_obj.load_time = time.time() - start_time
+	except:
+		logger.exception("Exception raised while loading plugin module: %s", module)
+		return None
+	logger.info("Loaded plugin module %s in %.3fs", module_name, time.time() - start_time)
+	return plugin_obj
+
+# Plugins are discovered, imported and configured on a thread pool. The order of the plugin list is kept stable
 def load_plugins():
-	global plugins, main_config
-	plugin_modules = get_plugin_modules()
-	for module in plugin_modules:
-		module_name = os.path.splitext(os.path.basename(module))[0]
-		module_dir = os.path.dirname(module)
-		sys.path.append(module_dir)
-		# Each module gets its own loader to isolate themselves if an import fails
-		loader = pluginlib.PluginLoader(modules=[module_name])
-		try:
-			plugin_list = getattr(loader.plugins, PLUGIN_ROOT)
-			plugin_class = getattr(plugin_list, next(iter(plugin_list))) # better than loader.get_plugin(PLUGIN_ROOT, ...) ??
-			plugin_obj = plugin_from_class(module_dir, plugin_class, main_config)
-			plugins.append(plugin_obj)
-		except:
-			logger.exception("Exception raised while loading plugin module: %s", module)
+	global plugins
+	pool = ThreadPool(PLUGIN_LOAD_WORKERS)
+	try:
+		with plugin_profiler.phase("main", "discovery"):
+			plugin_modules = get_plugin_modules(pool)
+		for module in plugin_modules:
+			sys.path.append(os.path.dirname(module))	# sys.path is only changed from this thread
+		plugins.extend([plugin_obj for plugin_obj in pool.map(load_plugin, plugin_modules) if plugin_obj])
+	finally:
+		pool.close()
+		pool.join()
 
+# Every plugin is invoked on the plugin executor, so a slow plugin doesn't hold up the others. Returns their futures
 def invoke_plugins(method_name, *args, **kwargs):
 	global plugins
-	for plugin_obj in plugins:
-		plugin_obj.invoke(method_name, *args, **kwargs)
+	return [plugin_obj.invoke(method_name, *args, **kwargs) for plugin_obj in plugins]
 
 
 def main():
@@ -1,14 +1,25 @@
 # Copyright (C) 2020 Scott Maday
 
-import sys, os.path, logging, threading, time, platform, re
+import sys, os.path, logging, threading, time, platform, re, ast, json, heapq
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 if sys.version_info.major >= 3:
 	from queue import Queue
 else:
 	from Queue import Queue
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None		# python2 can only report wall time
+try:
+	import asyncio
+except ImportError:
+	asyncio = None			# python2 plugins only have the executor
 
 import pluginlib
 from PyQt5 import QtWidgets
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QObject, pyqtSignal
 
 from configuration import *
 from gui import *
@@ -20,6 +31,13 @@ PLUGIN_ENTRY_FILE_PREFIX	= "plugin_"			# used to reduce module name conflicts
 PLUGIN_CONFIG_FILE_NAME		= "config.json"		# file name for configuration
 PLUGIN_SCHEMA_FILE_NAME		= "schema.xml"		# file name of plugin schema
 PLUGIN_LOG_INACTIVE_PLUGINS	= False
+PLUGIN_LOAD_WORKERS			= 4					# threads used to discover and load plugins concurrently
+PLUGIN_LAZY_IMPORT			= True				# plugin modules are only imported once they are started or invoked
+PLUGIN_EXECUTOR_WORKERS		= 8					# threads shared by every plugin's invoke calls and event deliveries
+PLUGIN_MAX_CONCURRENCY		= 1					# calls of one plugin that may run at once, unless its schema sets max_concurrency
+PLUGIN_INVOKE_TIMEOUT		= None				# seconds before an invoke gives up, unless its schema sets invoke_timeout
+EVENT_BUS_PENDING_LIMIT		= 100				# events a subscriber may have waiting before the oldest are dropped
+PLUGIN_ASYNC_JOIN_TIMEOUT	= 2.0				# seconds shutdown waits for the coroutines to finish cancelling
 
 ANSI_PLUGIN_ENABLED		= "\033[92m"
 ANSI_PLUGIN_DISABLED	= "\033[91m"
@@ -27,6 +45,718 @@ ANSI_PLUGIN_EXCEPTION	= "\033[1m"
 ANSI_ENDC				= "\033[0m"
 
 
+# Records the wall time and allocations of each phase of loading and starting plugins
+# Disabled unless enable() is called, in which case phase() only costs a flag check
+class Plugin_Profiler(object):
+	def __init__(self):
+		self.enabled = False
+		self.records = []
+		self._origin = time.time()
+		self._lock = threading.Lock()
+	
+	def enable(self, trace_allocations = True):
+		self.enabled = True
+		self._origin = time.time()
+		if trace_allocations and tracemalloc and not tracemalloc.is_tracing():
+			tracemalloc.start()
+	
+	# Allocations are process wide, so phases that overlap on other threads are counted in each other
+	@contextmanager
+	def phase(self, plugin_name, phase_name):
+		if not self.enabled:
+			yield
+			return
+		tracing = tracemalloc != None and tracemalloc.is_tracing()
+		alloc_start = tracemalloc.get_traced_memory()[0] if tracing else None
+		start_time = time.time()
+		try:
+			yield
+		finally:
+			self.record(plugin_name, phase_name, start_time, time.time() - start_time, tracemalloc.get_traced_memory()[0] - alloc_start if tracing else None)
+	
+	# For phases that don't run inside one block, like coroutines
+	def record(self, plugin_name, phase_name, start_time, duration, allocated = None):
+		if not self.enabled:
+			return None
+		record = {
+			"plugin":		plugin_name,
+			"phase":		phase_name,
+			"thread":		threading.current_thread().name,
+			"start":		start_time - self._origin,
+			"duration":		duration,
+			"allocated":	allocated
+		}
+		with self._lock:
+			self.records.append(record)
+	
+	def get_report(self):
+		with self._lock:
+			records = sorted(self.records, key=lambda record: record["start"])
+		totals = {}
+		for record in records:
+			plugin_totals = totals.setdefault(record["plugin"], {})
+			plugin_totals[record["phase"]] = plugin_totals.get(record["phase"], 0) + record["duration"]
+		return {"phases": records, "totals": totals}
+	
+	# Writes a JSON report, or a folded stack file ("plugin;phase microseconds") for flame graph tools if the name ends with .folded
+	def dump(self, file_name):
+		report = self.get_report()
+		with open(file_name, "w") as file:
+			if file_name.endswith(".folded"):
+				for plugin_name, phases in sorted(report["totals"].items()):
+					for phase_name, duration in sorted(phases.items()):
+						file.write("%s;%s %d\n" % (plugin_name, phase_name, int(duration * 1e6)))
+			else:
+				json.dump(report, file, indent=4)
+
+plugin_profiler = Plugin_Profiler()
+
+
+class Plugin_Timeout_Error(Exception):
+	pass
+
+class Plugin_Cancelled_Error(Exception):
+	pass
+
+# The result of a call submitted to the Plugin_Executor
+# Mirrors the parts of concurrent.futures.Future that are needed, since python2 doesn't have it
+class Plugin_Future(object):
+	def __init__(self):
+		self._done = threading.Event()
+		self._lock = threading.Lock()
+		self._started = False
+		self._result = None
+		self._exception = None
+		self._callbacks = []
+		self._canceller = None		# set while a coroutine runs, since those can be cancelled where they await
+	
+	def done(self):
+		return self._done.is_set()
+	
+	def running(self):
+		return self._started and not self.done()
+	
+	# Only a call that hasn't started, or a running coroutine, can be cancelled
+	def cancel(self):
+		with self._lock:
+			canceller = self._canceller
+			if self._started and not canceller:
+				return False
+		if canceller:
+			canceller()
+			return not self.done()
+		return self._finish(None, Plugin_Cancelled_Error())
+	
+	def result(self, timeout = None):
+		if not self._done.wait(timeout):
+			raise Plugin_Timeout_Error("Waited %ss for the result" % timeout)
+		if self._exception:
+			raise self._exception
+		return self._result
+	
+	def exception(self, timeout = None):
+		if not self._done.wait(timeout):
+			raise Plugin_Timeout_Error("Waited %ss for the result" % timeout)
+		return self._exception
+	
+	def add_done_callback(self, callback):
+		with self._lock:
+			if not self.done():
+				self._callbacks.append(callback)
+				return None
+		callback(self)
+	
+	# Returns False if the future was already finished, in which case nothing changes
+	def _finish(self, result, exception = None):
+		with self._lock:
+			if self.done():
+				return False
+			self._result = result
+			self._exception = exception
+			self._done.set()
+			callbacks, self._callbacks = self._callbacks, []
+		for callback in callbacks:
+			try:
+				callback(self)
+			except Exception:
+				logging.getLogger(__name__).exception("Exception raised in a future's done callback")
+		return True
+	
+	# Claims the future for running. Returns False if it was cancelled or timed out while it waited
+	def _start(self):
+		with self._lock:
+			if self.done():
+				return False
+			self._started = True
+			return True
+
+def completed_future(result = None):
+	future = Plugin_Future()
+	future._finish(result)
+	return future
+
+# Finishes target with the result of future once it's done
+def chain_future(future, target):
+	future.add_done_callback(lambda future: target._finish(None if future.exception() else future.result(), future.exception()))
+	return target
+
+
+# A bounded pool of threads shared by all plugins
+# Calls are queued per key (the plugin alias) so no plugin runs more than its concurrency limit at once, which leaves
+# the remaining threads to the other plugins when one of them is slow. A call past its timeout has its future
+# failed with Plugin_Timeout_Error. Python can't interrupt the thread, so the call keeps its slot until it returns
+# Calls that may run for as long as the plugin does, like on_loaded, are spawned on their own thread instead
+class Plugin_Executor(object):
+	__logger = logging.getLogger(__name__)
+	
+	def __init__(self, max_workers = PLUGIN_EXECUTOR_WORKERS, max_concurrency = PLUGIN_MAX_CONCURRENCY):
+		self.max_workers = max_workers
+		self.max_concurrency = max_concurrency
+		self._cond = threading.Condition()
+		self._ready = deque()			# calls that may start as soon as a thread is free
+		self._backlog = {}				# key -> calls waiting for the key to get under its limit
+		self._running = {}				# key -> number of calls running
+		self._limits = {}
+		self._deadlines = []			# heap of (deadline, sequence, future, key)
+		self._sequence = 0
+		self._threads = []
+		self._idle = 0
+		self._watchdog = None
+		self._shutdown = False
+		self._metrics = {
+			"submitted":	0,
+			"spawned":		0,		# calls given a thread of their own
+			"completed":	0,
+			"failed":		0,
+			"timed_out":	0
+		}
+	
+	def set_limit(self, key, max_concurrency):
+		with self._cond:
+			self._limits[key] = max(1, int(max_concurrency)) if max_concurrency else self.max_concurrency
+	
+	def submit(self, key, func, args = (), kwargs = None, timeout = None):
+		future = Plugin_Future()
+		job = (key, future, func, args, kwargs or {})
+		with self._cond:
+			if self._shutdown:
+				future._finish(None, Plugin_Cancelled_Error("The executor has been shut down"))
+				return future
+			self._metrics["submitted"] += 1
+			if self._running.get(key, 0) < self._limits.get(key, self.max_concurrency):
+				self._running[key] = self._running.get(key, 0) + 1
+				self._ready.append(job)
+				self.__spawn()
+			else:
+				self._backlog.setdefault(key, deque()).append(job)
+			if timeout:
+				self._sequence += 1
+				heapq.heappush(self._deadlines, (time.time() + timeout, self._sequence, future, key))
+				self.__spawn_watchdog()
+			self._cond.notify_all()
+		return future
+	
+	# Runs a call on a thread of its own, outside the pool and the key's limit, and returns its Plugin_Future
+	# A long or endless call then holds neither a pool thread nor the slot the key's other calls need
+	def spawn(self, key, func, args = (), kwargs = None):
+		future = Plugin_Future()
+		with self._cond:
+			if self._shutdown:
+				future._finish(None, Plugin_Cancelled_Error("The executor has been shut down"))
+				return future
+			self._metrics["submitted"] += 1
+			self._metrics["spawned"] += 1
+		thread = threading.Thread(target = self.__run, args = (key, future, func, args, kwargs or {}), name = "plugin_%s" % key)
+		thread.daemon = True
+		thread.start()
+		return future
+	
+	# Starts another thread if nothing is idle and the pool isn't full. Called with the lock held
+	def __spawn(self):
+		if len(self._ready) <= self._idle or len(self._threads) >= self.max_workers:
+			return None
+		thread = threading.Thread(target = self.__work, name = "plugin_executor_%d" % len(self._threads))
+		thread.daemon = True
+		self._threads.append(thread)
+		thread.start()
+	
+	def __spawn_watchdog(self):
+		if self._watchdog:
+			return None
+		self._watchdog = threading.Thread(target = self.__watch, name = "plugin_executor_watchdog")
+		self._watchdog.daemon = True
+		self._watchdog.start()
+	
+	def __work(self):
+		while True:
+			with self._cond:
+				self._idle += 1
+				while not self._ready and not self._shutdown:
+					self._cond.wait()
+				self._idle -= 1
+				if not self._ready:
+					return None
+				key, future, func, args, kwargs = self._ready.popleft()
+			self.__run(key, future, func, args, kwargs)
+			self.__release(key)
+	
+	def __run(self, key, future, func, args, kwargs):
+		if not future._start():
+			return None
+		try:
+			result = func(*args, **kwargs)
+		except Exception as e:
+			self.__logger.exception("Exception raised in a call of '%s'", key)
+			future._finish(None, e)
+			self.__count("failed")
+		else:
+			future._finish(result)
+			self.__count("completed")
+	
+	# Frees the key's slot and lets its next waiting call run
+	def __release(self, key):
+		with self._cond:
+			backlog = self._backlog.get(key)
+			if backlog:
+				self._ready.append(backlog.popleft())
+				self.__spawn()
+				self._cond.notify_all()
+			else:
+				self._running[key] -= 1
+	
+	def __count(self, name):
+		with self._cond:
+			self._metrics[name] += 1
+	
+	def __watch(self):
+		while True:
+			with self._cond:
+				while not self._shutdown and (not self._deadlines or self._deadlines[0][0] > time.time()):
+					self._cond.wait(self._deadlines[0][0] - time.time() if self._deadlines else None)
+				if self._shutdown:
+					return None
+				deadline, sequence, future, key = heapq.heappop(self._deadlines)
+			if future._finish(None, Plugin_Timeout_Error("A call of '%s' did not finish in time" % key)):
+				self.__logger.warning("A call of '%s' timed out", key)
+				self.__count("timed_out")
+	
+	# Calls that haven't started are cancelled. Running calls are waited on if wait is set
+	def shutdown(self, wait = True):
+		with self._cond:
+			self._shutdown = True
+			jobs = list(self._ready)
+			for backlog in self._backlog.values():
+				jobs.extend(backlog)
+			self._ready.clear()
+			self._backlog.clear()
+			self._cond.notify_all()
+		for job in jobs:
+			job[1].cancel()
+		if wait:
+			for thread in self._threads:
+				if thread is not threading.current_thread():
+					thread.join()
+	
+	def get_metrics(self):
+		with self._cond:
+			metrics = dict(self._metrics)
+			metrics["threads"] = len(self._threads)
+			metrics["running"] = dict((key, count) for key, count in self._running.items() if count)
+			metrics["queued"] = len(self._ready) + sum(len(backlog) for backlog in self._backlog.values())
+			return metrics
+
+plugin_executor = Plugin_Executor()
+
+
+def is_coroutine_function(func):
+	return asyncio != None and asyncio.iscoroutinefunction(func)
+
+# Lets a coroutine await a Plugin_Future. Must be called on the loop's thread
+def to_asyncio_future(future, loop):
+	async_future = loop.create_future()
+	def copy(future):
+		if async_future.cancelled():
+			return None
+		if future.exception():
+			async_future.set_exception(future.exception())
+		else:
+			async_future.set_result(future.result())
+	future.add_done_callback(lambda future: loop.call_soon_threadsafe(copy, future))
+	return async_future
+
+# Lives on the Qt thread and runs the calls posted to it there
+class Plugin_Qt_Call_Relay(QObject):
+	sig_call = pyqtSignal(object, object)
+	
+	def __init__(self):
+		super(Plugin_Qt_Call_Relay, self).__init__()
+		self.sig_call.connect(self.__call)
+	
+	def __call(self, func, future):
+		if not future._start():
+			return None
+		try:
+			future._finish(func())
+		except Exception as e:
+			future._finish(None, e)
+###
+
+# One asyncio event loop on one thread, shared by every plugin whose on_loaded or invoked method is a coroutine
+# I/O bound plugins wait with await instead of each holding a thread of the executor. Coroutines reach the Qt thread
+# with call_in_qt and blocking code with run_blocking, and are handed out as Plugin_Futures like executor calls
+class Plugin_Async_Runtime(object):
+	__logger = logging.getLogger(__name__)
+	
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._loop = None
+		self._thread = None
+		self._tasks = set()
+		self._qt_relay = None
+		self._metrics = {
+			"submitted":	0,
+			"completed":	0,
+			"failed":		0,
+			"cancelled":	0,
+			"timed_out":	0
+		}
+	
+	@property
+	def available(self):
+		return asyncio != None
+	
+	# Creates the Qt relay. Must be called on the Qt thread
+	def attach_qt(self):
+		with self._lock:
+			if self._qt_relay is None:
+				self._qt_relay = Plugin_Qt_Call_Relay()
+	
+	# The loop and its thread are only started once the first coroutine is submitted
+	def get_loop(self):
+		with self._lock:
+			if self._loop is None:
+				if not self.available:
+					raise RuntimeError("Coroutine plugins need asyncio, which this python doesn't have")
+				ready = threading.Event()
+				self._thread = threading.Thread(target = self.__run_loop, args = (ready,), name = "plugin_asyncio")
+				self._thread.daemon = True
+				self._thread.start()
+				ready.wait()
+			return self._loop
+	
+	# Whether the caller is the loop's thread, where waiting for a coroutine's result would never return
+	def is_loop_thread(self):
+		return self._thread is not None and threading.current_thread() is self._thread
+	
+	def __run_loop(self, ready):
+		self._loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self._loop)
+		ready.set()
+		self._loop.run_forever()
+		tasks = list(self._tasks)
+		if tasks:
+			self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions = True))
+		self._loop.close()
+	
+	# Schedules coro_func(*args, **kwargs) on the loop and returns a Plugin_Future of its result
+	# key is accepted for symmetry with the executor. Coroutines aren't limited per plugin since they don't hold a thread
+	def submit(self, key, coro_func, args = (), kwargs = None, timeout = None):
+		future = Plugin_Future()
+		loop = self.get_loop()
+		with self._lock:
+			self._metrics["submitted"] += 1
+		loop.call_soon_threadsafe(self.__start, future, coro_func, args, kwargs or {}, timeout)
+		return future
+	
+	def __start(self, future, coro_func, args, kwargs, timeout):
+		if not future._start():
+			return None
+		try:
+			coro = coro_func(*args, **kwargs)
+			task = self._loop.create_task(asyncio.wait_for(coro, timeout) if timeout else coro)
+		except Exception as e:
+			self.__finish(future, None, e)
+			return None
+		self._tasks.add(task)
+		future._canceller = lambda: self._loop.call_soon_threadsafe(task.cancel)
+		task.add_done_callback(lambda task: self.__done(future, task))
+	
+	def __done(self, future, task):
+		self._tasks.discard(task)
+		future._canceller = None
+		if task.cancelled():
+			self.__finish(future, None, Plugin_Cancelled_Error())
+		elif isinstance(task.exception(), asyncio.TimeoutError):
+			self.__finish(future, None, Plugin_Timeout_Error("A coroutine timed out"))
+		else:
+			self.__finish(future, None if task.exception() else task.result(), task.exception())
+	
+	def __finish(self, future, result, exception):
+		with self._lock:
+			if isinstance(exception, Plugin_Cancelled_Error):
+				self._metrics["cancelled"] += 1
+			elif isinstance(exception, Plugin_Timeout_Error):
+				self._metrics["timed_out"] += 1
+			elif exception:
+				self._metrics["failed"] += 1
+			else:
+				self._metrics["completed"] += 1
+		future._finish(result, exception)
+	
+	# Runs func on the Qt thread and returns a Plugin_Future of its result. Works from any thread and doesn't need the loop
+	# func runs straight away on the calling thread if Qt isn't attached
+	def post_to_qt(self, func, *args, **kwargs):
+		future = Plugin_Future()
+		if self._qt_relay:
+			self._qt_relay.sig_call.emit(lambda: func(*args, **kwargs), future)
+		else:
+			try:
+				future._finish(func(*args, **kwargs))
+			except Exception as e:
+				future._finish(None, e)
+		return future
+	
+	# Awaitable from a coroutine. Runs func on the Qt thread, or straight away on the loop if Qt isn't attached
+	def call_in_qt(self, func, *args, **kwargs):
+		return to_asyncio_future(self.post_to_qt(func, *args, **kwargs), self._loop)
+	
+	# Awaitable from a coroutine. Runs blocking code on the plugin executor under key
+	def run_blocking(self, key, func, *args, **kwargs):
+		return to_asyncio_future(plugin_executor.submit(key, func, args, kwargs), self._loop)
+	
+	# Cancels every coroutine and stops the loop
+	def shutdown(self, timeout = PLUGIN_ASYNC_JOIN_TIMEOUT):
+		with self._lock:
+			loop, thread = self._loop, self._thread
+		if loop is None:
+			return None
+		def stop():
+			for task in list(self._tasks):
+				task.cancel()
+			loop.stop()
+		loop.call_soon_threadsafe(stop)
+		thread.join(timeout)
+	
+	def get_metrics(self):
+		with self._lock:
+			metrics = dict(self._metrics)
+			metrics["running"] = len(self._tasks)
+			return metrics
+###
+
+plugin_async_runtime = Plugin_Async_Runtime()
+
+
+# Payloads are frozen once when published and the same objects are handed to every subscriber, so nobody can
+# change what the others see and nothing has to be copied or serialized per subscriber
+class Frozen_Dict(dict):
+	def __readonly(self, *args, **kwargs):
+		raise TypeError("event payloads are read only")
+	
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __readonly
+	
+	def __hash__(self):
+		return hash(tuple(sorted(self.items())))
+	
+	def __reduce__(self):
+		return (Frozen_Dict, (dict(self),))
+	
+	def thaw(self):
+		return thaw_payload(self)
+###
+
+def freeze_payload(obj):
+	if isinstance(obj, Frozen_Dict):
+		return obj
+	if isinstance(obj, dict):
+		return Frozen_Dict((key, freeze_payload(value)) for key, value in obj.items())
+	if isinstance(obj, (list, tuple)):
+		return tuple(freeze_payload(value) for value in obj)
+	if isinstance(obj, (set, frozenset)):
+		return frozenset(freeze_payload(value) for value in obj)
+	return obj
+
+# A mutable deep copy, for subscribers that want to change what they were given
+def thaw_payload(obj):
+	if isinstance(obj, dict):
+		return dict((key, thaw_payload(value)) for key, value in obj.items())
+	if isinstance(obj, tuple):
+		return [thaw_payload(value) for value in obj]
+	if isinstance(obj, frozenset):
+		return set(thaw_payload(value) for value in obj)
+	return obj
+
+
+Plugin_Event = namedtuple("Plugin_Event", ["topic", "payload", "source", "time"])
+
+# A topic is published with payloads of one type. Dict payloads are checked for the keys the topic requires
+class Event_Topic(object):
+	def __init__(self, name, payload_type = dict, required_keys = None, description = None):
+		self.name = name
+		self.payload_type = payload_type
+		self.required_keys = list(required_keys or [])
+		self.description = description
+	
+	def check(self, payload):
+		if not isinstance(payload, self.payload_type):
+			raise TypeError("'%s' payloads must be %s, not %s" % (self.name, self.payload_type.__name__, type(payload).__name__))
+		missing = [key for key in self.required_keys if key not in payload]
+		if missing:
+			raise ValueError("'%s' payload is missing %s" % (self.name, ", ".join(missing)))
+###
+
+# topic may be a topic name, a prefix ending in ".*" or "*" for everything
+class Event_Subscription(object):
+	def __init__(self, key, topic, callback, qt_thread = False):
+		self.key = key
+		self.topic = topic
+		self.callback = callback
+		self.qt_thread = qt_thread
+		self.active = True
+		self.pending = 0
+		self.dropped = 0
+	
+	def matches(self, topic):
+		if self.topic == "*":
+			return True
+		if self.topic.endswith(".*"):
+			return topic.startswith(self.topic[:-1])
+		return topic == self.topic
+###
+
+# Lives on the thread it was created on, which is the Qt thread, so its signal carries events over to it
+class Event_Bus_Qt_Relay(QObject):
+	sig_deliver = pyqtSignal(object, object)
+	
+	def __init__(self, deliver):
+		super(Event_Bus_Qt_Relay, self).__init__()
+		self.sig_deliver.connect(deliver)
+###
+
+# Topic based publish/subscribe between plugins
+# Subscribers are called on the plugin executor under their own key, in the order the events were published,
+# or on the Qt thread when they asked for it. A subscriber that falls behind loses its oldest events
+class Event_Bus(object):
+	__logger = logging.getLogger(__name__)
+	
+	def __init__(self, executor, pending_limit = EVENT_BUS_PENDING_LIMIT):
+		self.executor = executor
+		self.pending_limit = pending_limit
+		self._lock = threading.Lock()
+		self._topics = {}
+		self._subscriptions = []
+		self._qt_relay = None
+		self._metrics = {
+			"published":	0,
+			"delivered":	0,
+			"dropped":		0,
+			"failed":		0
+		}
+	
+	def register_topic(self, name, payload_type = dict, required_keys = None, description = None):
+		with self._lock:
+			topic = self._topics.get(name)
+			if topic is None:
+				topic = self._topics[name] = Event_Topic(name, payload_type, required_keys, description)
+			elif topic.payload_type is not payload_type:
+				raise TypeError("Topic '%s' is already registered with %s payloads" % (name, topic.payload_type.__name__))
+			return topic
+	
+	def get_topics(self):
+		with self._lock:
+			return dict(self._topics)
+	
+	# Creates the Qt relay. Must be called on the Qt thread. Until then Qt subscribers are called on the executor
+	def attach_qt(self):
+		with self._lock:
+			if self._qt_relay is None:
+				self._qt_relay = Event_Bus_Qt_Relay(self.__deliver)
+	
+	def subscribe(self, key, topic, callback, qt_thread = False):
+		subscription = Event_Subscription(key, topic, callback, qt_thread)
+		with self._lock:
+			self._subscriptions.append(subscription)
+		return subscription
+	
+	def unsubscribe(self, subscription):
+		with self._lock:
+			subscription.active = False
+			if subscription in self._subscriptions:
+				self._subscriptions.remove(subscription)
+	
+	def unsubscribe_all(self, key):
+		with self._lock:
+			for subscription in self._subscriptions:
+				if subscription.key == key:
+					subscription.active = False
+			self._subscriptions = [subscription for subscription in self._subscriptions if subscription.active]
+	
+	# Lets a publisher skip building payloads that nobody would receive
+	def has_subscribers(self, topic):
+		with self._lock:
+			return any(subscription.matches(topic) for subscription in self._subscriptions)
+	
+	# Returns the number of subscribers the event was handed to
+	def publish(self, topic, payload, source = None):
+		with self._lock:
+			topic_obj = self._topics.get(topic)
+			subscriptions = [subscription for subscription in self._subscriptions if subscription.matches(topic)]
+		if topic_obj is None:
+			raise KeyError("Topic '%s' is not registered" % topic)
+		topic_obj.check(payload)
+		event = Plugin_Event(topic, freeze_payload(payload), source, time.time())
+		delivered = 0
+		for subscription in subscriptions:
+			with self._lock:
+				if subscription.pending >= self.pending_limit:
+					subscription.dropped += 1
+					self._metrics["dropped"] += 1
+					continue
+				subscription.pending += 1
+			if subscription.qt_thread and self._qt_relay:
+				self._qt_relay.sig_deliver.emit(subscription, event)
+			elif is_coroutine_function(subscription.callback):
+				future = plugin_async_runtime.submit(subscription.key, subscription.callback, (event,))
+				future.add_done_callback(lambda future, subscription = subscription, event = event: self.__delivered(subscription, event, future.exception()))
+			else:
+				self.executor.submit(subscription.key, self.__deliver, (subscription, event))
+			delivered += 1
+		with self._lock:
+			self._metrics["published"] += 1
+		return delivered
+	
+	def __deliver(self, subscription, event):
+		if not subscription.active:
+			with self._lock:
+				subscription.pending -= 1
+			return None
+		try:
+			subscription.callback(event)
+		except Exception as e:
+			self.__delivered(subscription, event, e)
+			return None
+		self.__delivered(subscription, event)
+	
+	def __delivered(self, subscription, event, exception = None):
+		with self._lock:
+			subscription.pending -= 1
+			self._metrics["failed" if exception else "delivered"] += 1
+		if exception:
+			self.__logger.error("Subscriber '%s' of '%s' raised %r", subscription.key, event.topic, exception, exc_info = sys.exc_info()[0] != None)
+	
+	def get_metrics(self):
+		with self._lock:
+			metrics = dict(self._metrics)
+			metrics["topics"] = sorted(self._topics)
+			metrics["subscriptions"] = dict((subscription.key, 0) for subscription in self._subscriptions)
+			for subscription in self._subscriptions:
+				metrics["subscriptions"][subscription.key] += 1
+			return metrics
+###
+
+event_bus = Event_Bus(plugin_executor)
+
+
 # Basic interpreter
 # Might make more robust (and complex) if requirements begin to add up
 def interpret_requirements(first_line):
@@ -35,30 +765,79 @@ def interpret_requirements(first_line):
 		return platform.system() in m1.group(0)
 	return True
 
-def get_plugin_modules():
-	modules = []
-	for dir_name in os.listdir(PLUGIN_DIR_NAME):
-		dir = os.path.join(PLUGIN_DIR_NAME, dir_name)
-		if os.path.isdir(dir):
-			for file_name in os.listdir(dir):
-				file = os.path.join(dir, file_name)
-				file_root, file_ext = os.path.splitext(file_name)
-				# check if the file is {PLUGIN_ENTRY_FILE_PREFIX}{dir_name}.py for further analysis
-				if file_root.startswith(PLUGIN_ENTRY_FILE_PREFIX) and file_root[len(PLUGIN_ENTRY_FILE_PREFIX):] == dir_name and file_ext.lower() == ".py":
-					can_import = True
-					with open(file, "r") as f:
-						first_line = f.readline()
-						can_import = interpret_requirements(first_line)
-					if can_import:
-						modules.append(file)
-					break
-	return modules
-	
-def plugin_from_class(module_dir, plugin_class, main_config):
+# Returns the entry file of the plugin in dir_name if it exists and its requirements are met, otherwise None
+def get_plugin_module(dir_name):
+	dir = os.path.join(PLUGIN_DIR_NAME, dir_name)
+	if not os.path.isdir(dir):
+		return None
+	for file_name in os.listdir(dir):
+		file = os.path.join(dir, file_name)
+		file_root, file_ext = os.path.splitext(file_name)
+		# check if the file is {PLUGIN_ENTRY_FILE_PREFIX}{dir_name}.py for further analysis
+		if file_root.startswith(PLUGIN_ENTRY_FILE_PREFIX) and file_root[len(PLUGIN_ENTRY_FILE_PREFIX):] == dir_name and file_ext.lower() == ".py":
+			can_import = True
+			with open(file, "r") as f:
+				first_line = f.readline()
+				can_import = interpret_requirements(first_line)
+			return file if can_import else None
+	return None
+
+# Plugin directories are checked on the pool if one is given
+def get_plugin_modules(pool = None):
+	dir_names = os.listdir(PLUGIN_DIR_NAME)
+	modules = pool.map(get_plugin_module, dir_names) if pool else [get_plugin_module(dir_name) for dir_name in dir_names]
+	return [module for module in modules if module]
+	
+# Reads the name and literal class attributes (_alias_, _enabled, _auto_run...) of the plugin class in a module without importing it
+# Returns (None, {}) if the module has no plugin class
+def get_plugin_class_attributes(module):
+	with open(module, "r") as f:
+		tree = ast.parse(f.read(), module)
+	for node in tree.body:
+		if not isinstance(node, ast.ClassDef):
+			continue
+		attributes = {}
+		for stmt in node.body:
+			if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+				try:
+					attributes[stmt.targets[0].id] = ast.literal_eval(stmt.value)
+				except ValueError:
+					pass
+		if "_alias_" in attributes or any(isinstance(base, ast.Name) and base.id == "Plugin" for base in node.bases):
+			return node.name, attributes
+	return None, {}
+
+def plugin_config_from_module_dir(module_dir):
+	with plugin_profiler.phase(os.path.basename(module_dir), "configuration"):
+		return configuration_from_file(os.path.join(module_dir, PLUGIN_CONFIG_FILE_NAME), os.path.join(module_dir, PLUGIN_SCHEMA_FILE_NAME), True)
+
+# Imports the module and returns its plugin class. The module's directory must already be in sys.path
+def plugin_class_from_module(module):
+	module_name = os.path.splitext(os.path.basename(module))[0]
+	with plugin_profiler.phase(os.path.basename(os.path.dirname(module)), "import"):
+		# Each module gets its own loader to isolate themselves if an import fails
+		loader = pluginlib.PluginLoader(modules=[module_name])
+		plugin_list = getattr(loader.plugins, PLUGIN_ROOT)
+		return getattr(plugin_list, next(iter(plugin_list))) # better than loader.get_plugin(PLUGIN_ROOT, ...) ??
+
+def plugin_from_class(module_dir, plugin_class, main_config, plugin_config = None):
 	assert os.path.isdir(module_dir)
 	assert isinstance(plugin_class, Plugin.__class__)
 	assert isinstance(main_config, Root_Configuration)
-	return plugin_class(main_config, configuration_from_file(os.path.join(module_dir, PLUGIN_CONFIG_FILE_NAME), os.path.join(module_dir, PLUGIN_SCHEMA_FILE_NAME), True))
+	return plugin_class(main_config, plugin_config if plugin_config else plugin_config_from_module_dir(module_dir))
+
+# Gets a property from the plugin configuration, then from the attributes of its schema
+def get_plugin_property(plugin_config, property, type_name = None):
+	if not plugin_config or not plugin_config.struct:
+		return None
+	if property in plugin_config:						# try get from config first
+		return plugin_config[property]
+	if property in plugin_config.struct.attributes:	# then try get from config schema attributes
+		prop = plugin_config.struct.attributes[property]
+		if type_name:
+			prop = get_structural_type(type_name).func_cast(prop)
+		return prop
+	return None
 	
 
 # Abstract base class https://pluginlib.readthedocs.io/en/stable/api.html
@@ -77,21 +856,14 @@ class Plugin(object):
 		self.plugin_config = plugin_config
 		assert isinstance(plugin_config, Root_Configuration)
 		self.active = self.enabled	# the dynamic status of if the plugin is enabled
-		self._worker = None
+		self.load_time = None		# seconds spent importing and configuring the plugin, set by the loader
+		self._worker = None			# future of on_loaded, running on its own thread or on the asyncio loop
 		self._gui = None
 		self._gui_class = GUI_MainWindow
+		plugin_executor.set_limit(self.alias, self.get_property_from_configuration("max_concurrency", "int"))
 	
 	def get_property_from_configuration(self, property, type_name = None):
-		if not self.plugin_config or not self.plugin_config.struct:
-			return None
-		if property in self.plugin_config:						# try get from config first
-			return self.plugin_config[property]
-		if property in self.plugin_config.struct.attributes:	# then try get from config schema attributes
-			prop = self.plugin_config.struct.attributes[property]
-			if type_name:
-				prop = get_structural_type(type_name).func_cast(prop)
-			return prop
-		return None
+		return get_plugin_property(self.plugin_config, property, type_name)
 	
 	@property
 	def alias(self):
@@ -133,26 +905,79 @@ class Plugin(object):
 		self.active = False
 		if msg:
 			self.__logger.error("[DEACTIVATED " + ANSI_PLUGIN_DISABLED + self.full_name + ANSI_ENDC + "]: " + msg, *args, **kwargs)
-		if self._worker and self._worker.isRunning():
-			self._worker.quit()
+		if self._worker:
+			self._worker.cancel()		# only stops it if it hasn't started yet
+		event_bus.unsubscribe_all(self.alias)
+	
+	# callback is given a Plugin_Event, on the plugin executor or on the Qt thread if qt_thread is set
+	def subscribe(self, topic, callback, qt_thread = False):
+		return event_bus.subscribe(self.alias, topic, callback, qt_thread)
+	
+	def publish(self, topic, payload):
+		return event_bus.publish(topic, payload, self.alias)
 	
 	# Starts the plugin and shows the GUI
 	def start(self):
 		if not self.active:
 			self._log(logging.WARNING, "Plugin is deactivated and cannot start. Check the enabled property in the configuration.")
 			return None
-		self._worker = Plugin_Qt_Worker(None, lambda: self.invoke("on_loaded"))
 		if self.plugin_config and self._gui_class and (issubclass(self._gui_class, GUI_MainWindow) or issubclass(self._gui_class, GUI_DialogWindow)):
-			self._gui = self._gui_class(self.plugin_config)
-			self._gui.setWindowTitle(self.full_name)
-			self._gui.show()
+			with plugin_profiler.phase(self.alias, "gui"):
+				self._gui = self._gui_class(self.plugin_config)
+				self._gui.setWindowTitle(self.full_name)
+				self._gui.show()
 		else:
 			self._log(logging.WARNING, "Could not start gui. No configuration or the gui class cannot accept configuration")
-		self._worker.start()
-		
+		if is_coroutine_function(self.on_loaded):
+			start_time = time.time()
+			self._worker = self.invoke("on_loaded")
+			self._worker.add_done_callback(lambda future: plugin_profiler.record(self.alias, "on_loaded", start_time, time.time() - start_time))
+		else:
+			self._worker = plugin_executor.spawn(self.alias, self.__run_loaded)	# on_loaded may run as long as the plugin does
+		return self._worker
+	
+	def __run_loaded(self):
+		with plugin_profiler.phase(self.alias, "on_loaded"):
+			self.invoke_now("on_loaded")
+	
+	def get_invoke_timeout(self):
+		timeout = self.get_property_from_configuration("invoke_timeout", "float")
+		return timeout if timeout else PLUGIN_INVOKE_TIMEOUT
 	
-	# Invokes a plugin's method with error handling.
+	# Invokes a plugin's method on the plugin executor and returns a Plugin_Future of its result
+	# Coroutine methods run on the shared asyncio loop instead, and their future fails with whatever they raise
+	# The method runs on an executor thread, not the caller's, so it must be thread-safe and must not touch widgets
+	# directly. Work on widgets goes through post_to_qt, or call_in_qt from a coroutine
 	def invoke(self, method_name, *args, **kwargs):
+		method = getattr(self, method_name, None)
+		if is_coroutine_function(method):
+			if not self.active:
+				return completed_future(None)
+			future = plugin_async_runtime.submit(self.alias, method, args, kwargs, self.get_invoke_timeout())
+			future.add_done_callback(lambda future: self.__log_coroutine_exception(method_name, future))
+			return future
+		return plugin_executor.submit(self.alias, self.invoke_now, (method_name,) + args, kwargs, self.get_invoke_timeout())
+	
+	def __log_coroutine_exception(self, method_name, future):
+		exception = future.exception()
+		if exception and not isinstance(exception, Plugin_Cancelled_Error):
+			self._log(logging.ERROR, ANSI_PLUGIN_EXCEPTION + "Coroutine %s raised %r" + ANSI_ENDC, method_name, exception, exc_info = exception)
+	
+	# Awaitable from a coroutine method. Runs func on the Qt thread, where widgets may be touched
+	def call_in_qt(self, func, *args, **kwargs):
+		return plugin_async_runtime.call_in_qt(func, *args, **kwargs)
+	
+	# For invoked methods and on_loaded. Runs func on the Qt thread and returns a Plugin_Future of its result
+	def post_to_qt(self, func, *args, **kwargs):
+		return plugin_async_runtime.post_to_qt(func, *args, **kwargs)
+	
+	# Awaitable from a coroutine method. Runs blocking func on the plugin executor so the loop isn't held up
+	def run_blocking(self, func, *args, **kwargs):
+		return plugin_async_runtime.run_blocking(self.alias, func, *args, **kwargs)
+	
+	# Invokes a plugin's method on the calling thread with error handling.
+	# A coroutine method is waited for, so it can't be invoked this way on the loop. Coroutines await the method instead
+	def invoke_now(self, method_name, *args, **kwargs):
 		if not hasattr(self, method_name):
 			self._log(logging.WARNING, "Plugin does not implement method '%s'", method_name)
 			return None
@@ -160,6 +985,13 @@ class Plugin(object):
 			if PLUGIN_LOG_INACTIVE_PLUGINS:
 				self._log(logging.DEBUG, "NOT invoking %s because the plugin is not active", method_name)
 			return None
+		if is_coroutine_function(getattr(self, method_name)):
+			if plugin_async_runtime.is_loop_thread():
+				raise RuntimeError("Coroutine method '%s' can't be waited for on the asyncio loop. Await it, or use invoke()" % method_name)
+			try:
+				return self.invoke(method_name, *args, **kwargs).result()	# waits on this thread for the loop
+			except Exception:
+				return None		# already logged by invoke
 		try:
 			return getattr(self,  method_name)(*args, **kwargs)
 		except Exception:
@@ -167,7 +999,8 @@ class Plugin(object):
 		return None
 	
 	# Called unconditionally when starting the plugin, after get_gui
-	# This method is called inside a QThread and is asynchronous
+	# This method is called on a thread of its own and is asynchronous, so it may run for as long as the plugin does
+	# It may also be defined with async def, in which case it runs on the shared asyncio loop
 	@pluginlib.abstractmethod
 	def on_loaded(self):
 		pass
@@ -175,13 +1008,105 @@ class Plugin(object):
 #####
 
 
-class Plugin_Qt_Worker(QThread):
-	invoke_proxy = None
-
-	def __init__(self, parent = None, work = None):
-		super(Plugin_Qt_Worker, self).__init__(parent)
-		self.work = work
+# Stands in for a plugin whose module has not been imported yet
+# The alias and class defaults are read from the module source and the rest comes from the plugin configuration,
+# so the module is only imported the first time the plugin is started or invoked
+class Plugin_Proxy(object):
+	__logger = logging.getLogger(__name__)
+	
+	def __init__(self, module, main_config):
+		assert isinstance(main_config, Root_Configuration)
+		self.module = module
+		self._main_config = main_config
+		self._class_name, self._class_attributes = get_plugin_class_attributes(module)
+		self.plugin_config = plugin_config_from_module_dir(os.path.dirname(module))
+		self.plugin = None
+		self.active = self.enabled
+		self.load_time = None		# seconds spent importing and configuring the plugin, set by the loader
+		self._lock = threading.Lock()
+		plugin_executor.set_limit(self.alias, get_plugin_property(self.plugin_config, "max_concurrency", "int"))
+	
+	# pluginlib names a plugin without an _alias_ after its class, so the proxy does the same
+	@property
+	def alias(self):
+		alias = self._class_attributes.get("_alias_")
+		if isinstance(alias, str):
+			return alias
+		return self._class_name if self._class_name else os.path.splitext(os.path.basename(self.module))[0]
+	
+	@property
+	def full_name(self):
+		if self.plugin_config and self.plugin_config.struct and self.plugin_config.struct.label:
+			return self.plugin_config.struct.label
+		full_name = self._class_attributes.get("_full_name")
+		return full_name if isinstance(full_name, str) else self.alias
+	
+	@property
+	def description(self):
+		return self._class_attributes.get("_description") if not get_plugin_property(self.plugin_config, "description") else get_plugin_property(self.plugin_config, "description", "string")
+	
+	@property
+	def enabled(self):
+		return self._class_attributes.get("_enabled", Plugin._enabled) == True if not get_plugin_property(self.plugin_config, "enabled") else get_plugin_property(self.plugin_config, "enabled", "bool")
+	
+	@property
+	def auto_run(self):
+		return self._class_attributes.get("_auto_run", Plugin._auto_run) == True if not get_plugin_property(self.plugin_config, "auto_run") else get_plugin_property(self.plugin_config, "auto_run", "bool")
+	
+	def __getitem__(self, key):
+		if not self.plugin_config or not key in self.plugin_config:
+			return None
+		return self.plugin_config[key]
+	
+	# Imports the module and creates the real plugin if that has not happened yet. Returns None if that fails
+	def resolve(self):
+		with self._lock:
+			if self.plugin or not self.active:
+				return self.plugin
+			start_time = time.time()
+			try:
+				plugin_class = plugin_class_from_module(self.module)
+				self.plugin = plugin_from_class(os.path.dirname(self.module), plugin_class, self._main_config, self.plugin_config)
+			except Exception:
+				self.active = False
+				self.__logger.exception("Exception raised while importing plugin module: %s", self.module)
+				return None
+			self.plugin.load_time = (self.load_time or 0) + time.time() - start_time
+			self.__logger.debug("Imported plugin module %s in %.3fs", self.module, time.time() - start_time)
+			return self.plugin
+	
+	def start(self):
+		if not self.active:
+			self.__logger.warning("[%s]: Plugin is deactivated and cannot start. Check the enabled property in the configuration.", self.full_name)
+			return None
+		plugin = self.resolve()
+		return plugin.start() if plugin else None
+	
+	# The import happens on the plugin executor too, so the caller never waits for it. The call itself then goes through
+	# the plugin's invoke, so a coroutine method runs on the asyncio loop instead of holding an executor thread
+	def invoke(self, method_name, *args, **kwargs):
+		if not self.active:
+			return completed_future(None)
+		if self.plugin is not None:
+			return self.plugin.invoke(method_name, *args, **kwargs)
+		future = Plugin_Future()
+		def resolved(resolve_future):
+			plugin = None if resolve_future.exception() else resolve_future.result()
+			if plugin is None:
+				future._finish(None, resolve_future.exception())
+			else:
+				chain_future(plugin.invoke(method_name, *args, **kwargs), future)
+		plugin_executor.submit(self.alias, self.resolve).add_done_callback(resolved)
+		return future
+	
+	def invoke_now(self, method_name, *args, **kwargs):
+		plugin = self.resolve()
+		return plugin.invoke_now(method_name, *args, **kwargs) if plugin else None
 	
-	def run(self):
-		if self.work:
-			self.work()
\ No newline at end of file
+	# Everything else is only available once the plugin has been imported
+	def __getattr__(self, name):
+		plugin = self.__dict__.get("plugin")
+		if plugin is None:
+			raise AttributeError("'%s' has not been imported yet and has no attribute '%s'" % (self.__dict__.get("module"), name))
+		return getattr(plugin, name)
+###
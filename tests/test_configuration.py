@@ -0,0 +1,184 @@
+# Copyright 2020 Scott Maday
+
+import os, sys, json, pickle
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from configuration import *
+
+
+def int_property(name, default = "0"):
+	return Structure_Property(get_structural_type("int"), name, None, default)
+
+def test_structure_index_follows_tree_edits():
+	struct = Structure_Object("root")
+	a, b, c = int_property("a"), int_property("b"), int_property("c")
+	struct.append(a)
+	struct.append(b)
+	assert struct["a"] is a and struct["b"] is b
+	struct.tree[0] = c				# same length, different child
+	assert struct["a"] is None and struct["c"] is c
+	struct.tree = [a]
+	assert "b" not in struct and struct["a"] is a
+	struct.remove(a)
+	assert "a" not in struct
+
+def test_structure_index_follows_renames():
+	struct = Structure_Object("root")
+	a = int_property("a")
+	struct.append(a)
+	assert struct["a"] is a
+	a.name = "renamed"
+	assert struct["a"] is None and struct["renamed"] is a
+
+def test_structure_index_survives_pickle():
+	struct = Structure_Object("root")
+	struct.append(int_property("a"))
+	struct = pickle.loads(pickle.dumps(struct, pickle.HIGHEST_PROTOCOL))
+	assert struct["a"].name == "a"
+	struct["a"].name = "b"
+	assert struct["b"] is not None and "a" not in struct
+
+def test_copied_configuration_materializes_once():
+	struct = Structure_Object("things", None, {"copies": "1"})
+	struct.is_array = True
+	item = Structure_Object("thing")
+	item.append(int_property("value"))
+	struct.append(item)
+	original = Root_Configuration("original.json", struct)
+	copy = Root_Configuration("copy.json", original)
+	assert len(list(copy.materialize().items())) == 1
+	assert len(list(original.materialize().items())) == 1
+	assert len(list(copy.items())) == 1
+
+def test_validators_can_read_attributes_from_the_property():
+	legacy_type = Stuctural_Type("legacy", int, lambda x, attribs: "max" in attribs and int(x) <= int(attribs["max"]) and attribs.get("min") is None)
+	prop = Structure_Property(get_structural_type("int"), "value", None, "5", {"max": "10"})
+	assert legacy_type.func_validate("5", prop) and not legacy_type.func_validate("50", prop)
+
+SCHEMA_XML = """<object name="root">
+	<string name="title">Title</string>
+	<int name="hidden" presentation="implicit">7</int>
+	<object name="settings">
+		<int name="volume" min="0" max="100">50</int>
+		<string name="mode" options="fast,slow">fast</string>
+	</object>
+	<array name="things" copies="2">
+		<object name="thing">
+			<string name="name">Thing</string>
+			<float name="gain">1.5</float>
+		</object>
+	</array>
+</object>"""
+
+def build_configuration(file_name = "config.json"):
+	from xml.etree import ElementTree
+	return Root_Configuration(file_name, structure_from_xml(ElementTree.fromstring(SCHEMA_XML)))
+
+def test_to_json_is_invalidated_by_nested_edits():
+	config = build_configuration()
+	first = config.to_json()
+	config["settings"]["volume"] = 75
+	assert config.to_json() != first
+	assert json.loads(config.to_json())["settings"]["volume"] == 75
+	config["things"][0]["gain"] = 2.5
+	assert json.loads(config.to_json())["things"][0]["gain"] == 2.5
+
+def test_to_json_is_invalidated_by_append_and_remove():
+	config = build_configuration()
+	config.to_json()
+	things = config["things"]
+	thing = things[0]
+	things.remove(thing)
+	assert len(json.loads(config.to_json())["things"]) == 1
+	things.append(thing)
+	assert len(json.loads(config.to_json())["things"]) == 2
+	thing["name"] = "Moved"		# the appended configuration invalidates its new parent
+	assert json.loads(config.to_json())["things"][1]["name"] == "Moved"
+
+def test_copy_shares_edits_and_cache():
+	config = build_configuration()
+	copy = Root_Configuration("copy.json", config)
+	original_json = config.to_json()
+	copy["settings"]["volume"] = 10
+	assert json.loads(config.to_json())["settings"]["volume"] == 10
+	assert copy.to_json() == config.to_json() != original_json
+	config["title"] = "Changed"
+	assert json.loads(copy.to_json())["title"] == "Changed"
+
+def test_save_skips_unchanged_configurations(tmp_path):
+	file_name = str(tmp_path / "config.json")
+	config = build_configuration(file_name)
+	config.save()
+	with open(file_name) as file:
+		assert json.load(file) == config.as_obj()
+	os.utime(file_name, (0, 0))
+	config.save()
+	assert os.path.getmtime(file_name) == 0
+	config.save(force = True)
+	assert os.path.getmtime(file_name) != 0
+	config["title"] = "Changed"
+	config.save()
+	with open(file_name) as file:
+		assert json.load(file)["title"] == "Changed"
+	assert os.path.isfile(file_name + ".bak")
+	assert not os.path.exists(file_name + ".tmp")
+
+def test_write_file_atomic_leaves_the_old_file_on_failure(tmp_path):
+	file_name = str(tmp_path / "data.txt")
+	write_file_atomic(file_name, "old")
+	def failing_writer(file):
+		file.write("partial")
+		raise IOError("disk full")
+	try:
+		write_file_atomic(file_name, failing_writer)
+	except IOError:
+		pass
+	with open(file_name) as file:
+		assert file.read() == "old"
+	write_file_atomic(file_name, lambda file: file.write("new"))
+	with open(file_name) as file:
+		assert file.read() == "new"
+
+def test_to_json_and_dump_match_json_dumps():
+	import io
+	config = build_configuration()
+	config.set_data({"title": "Café \"quoted\"", "hidden": 8, "things": [{"_schema_name": "thing", "name": "A", "gain": 0.25}]})
+	expected = json.dumps(config.as_obj(), indent = CONFIGURATION_JSON_INDENT)
+	streamed = io.StringIO()
+	config.dump(streamed)
+	assert streamed.getvalue() == expected
+	assert config.to_json() == expected
+	streamed = io.StringIO()
+	config.dump(streamed)		# written from the cached subtrees this time
+	assert streamed.getvalue() == expected
+
+def test_implicit_defaults_are_left_out_of_the_json():
+	config = build_configuration()
+	assert "hidden" not in json.loads(config.to_json())
+	config["hidden"] = 8
+	assert json.loads(config.to_json())["hidden"] == 8
+
+def test_validate_reports_every_violation_in_tree_order():
+	config = build_configuration()
+	config["settings"]["volume"] = 500
+	config["settings"]["mode"] = "medium"
+	config["things"][1]["gain"] = "loud"
+	violations = config.validate()
+	assert [violation.get_path_string() for violation in violations] == ["settings.volume", "settings.mode", "things[1].gain"]
+	assert str(violations[0]) == "settings.volume: 500 is not a valid int (min 0, max 100)"
+	assert str(violations[1]) == "settings.mode: 'medium' is not a valid string (one of fast,slow)"
+	assert violations[2].value == "loud"
+	assert build_configuration().validate() == []
+
+def test_validate_checks_filesystem_types_on_the_pool(tmp_path):
+	from xml.etree import ElementTree
+	struct = structure_from_xml(ElementTree.fromstring('<object><file name="a"/><file name="b"/><directory name="c"/></object>'))
+	config = Configuration(struct)
+	existing = tmp_path / "exists.txt"
+	existing.write_text(u"x")
+	config["a"] = str(existing)
+	config["b"] = str(tmp_path / "missing.txt")
+	config["c"] = str(tmp_path)
+	for max_workers in [1, 4]:
+		assert [violation.get_path_string() for violation in config.validate(max_workers)] == ["b"]
@@ -0,0 +1,122 @@
+# Copyright 2020 Scott Maday
+
+import os, sys, time, threading, pickle
+
+import pytest
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("pluginlib")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from plugin import *
+
+TEST_TIMEOUT	= 5.0
+
+
+def wait_for(condition):
+	deadline = time.time() + TEST_TIMEOUT
+	while not condition():
+		assert time.time() < deadline, "timed out"
+		time.sleep(0.005)
+
+@pytest.fixture
+def bus():
+	executor = Plugin_Executor(max_workers = 4)
+	bus = Event_Bus(executor, pending_limit = 3)
+	bus.register_topic("test.freq", dict, ["freq"])
+	bus.register_topic("test.status", dict)
+	bus.register_topic("other.freq", dict, ["freq"])
+	yield bus
+	executor.shutdown()
+
+def test_subscribers_get_the_topics_they_match(bus):
+	received = {"exact": [], "prefix": [], "all": []}
+	bus.subscribe("exact", "test.freq", lambda event: received["exact"].append(event.topic))
+	bus.subscribe("prefix", "test.*", lambda event: received["prefix"].append(event.topic))
+	bus.subscribe("all", "*", lambda event: received["all"].append(event.topic))
+	assert bus.publish("test.freq", {"freq": 1}, source = "test") == 3
+	assert bus.publish("test.status", {}) == 2
+	assert bus.publish("other.freq", {"freq": 2}) == 1
+	wait_for(lambda: bus.get_metrics()["delivered"] == 6)
+	assert received == {"exact": ["test.freq"], "prefix": ["test.freq", "test.status"], "all": ["test.freq", "test.status", "other.freq"]}
+	assert bus.has_subscribers("other.freq")
+	bus.unsubscribe_all("all")
+	assert bus.has_subscribers("test.status") and not bus.has_subscribers("other.freq")
+
+def test_events_are_delivered_in_order(bus):
+	freqs = []
+	bus.subscribe("a", "test.freq", lambda event: freqs.append(event.payload["freq"]))
+	for freq in range(3):
+		bus.publish("test.freq", {"freq": freq})
+	wait_for(lambda: len(freqs) == 3)
+	assert freqs == [0, 1, 2]
+
+def test_payloads_are_checked(bus):
+	with pytest.raises(KeyError):
+		bus.publish("test.unknown", {})
+	with pytest.raises(ValueError):
+		bus.publish("test.freq", {"tgid": 1})
+	with pytest.raises(TypeError):
+		bus.publish("test.freq", [1])
+	with pytest.raises(TypeError):
+		bus.register_topic("test.freq", list)
+	assert bus.register_topic("test.freq") is bus.get_topics()["test.freq"]
+
+def test_payloads_are_frozen_and_shared(bus):
+	events = []
+	bus.subscribe("a", "test.freq", events.append)
+	bus.subscribe("b", "test.freq", events.append)
+	payload = {"freq": 1, "tgids": [1, 2], "nested": {"set": set([3])}}
+	bus.publish("test.freq", payload)
+	wait_for(lambda: len(events) == 2)
+	assert events[0].payload is events[1].payload
+	frozen = events[0].payload
+	assert frozen == {"freq": 1, "tgids": (1, 2), "nested": {"set": frozenset([3])}}
+	for change in [lambda: frozen.__setitem__("freq", 2), lambda: frozen.pop("freq"), lambda: frozen["nested"].update(a = 1)]:
+		with pytest.raises(TypeError):
+			change()
+	payload["freq"] = 2				# the publisher's dictionary isn't shared
+	assert frozen["freq"] == 1
+	thawed = frozen.thaw()
+	thawed["tgids"].append(3)
+	assert thawed == {"freq": 1, "tgids": [1, 2, 3], "nested": {"set": set([3])}}
+	assert pickle.loads(pickle.dumps(frozen)) == frozen and hash(freeze_payload({"freq": 1})) == hash(freeze_payload({"freq": 1}))
+
+def test_slow_subscribers_drop_events(bus):
+	release = threading.Event()
+	handled = []
+	def slow(event):
+		assert release.wait(TEST_TIMEOUT)
+		handled.append(event.payload["freq"])
+	subscription = bus.subscribe("slow", "test.freq", slow)
+	delivered = [bus.publish("test.freq", {"freq": freq}) for freq in range(5)]
+	assert delivered == [1, 1, 1, 0, 0]
+	assert subscription.dropped == 2 and bus.get_metrics()["dropped"] == 2
+	release.set()
+	wait_for(lambda: len(handled) == 3)
+	assert handled == [0, 1, 2]
+	wait_for(lambda: subscription.pending == 0)
+	assert bus.publish("test.freq", {"freq": 5}) == 1
+
+def test_failing_subscribers_are_counted(bus):
+	def fail(event):
+		raise ValueError("failed")
+	subscription = bus.subscribe("failing", "test.status", fail)
+	bus.publish("test.status", {})
+	wait_for(lambda: bus.get_metrics()["failed"] == 1)
+	wait_for(lambda: subscription.pending == 0)
+
+def test_unsubscribed_callbacks_are_not_called(bus):
+	called = []
+	release = threading.Event()
+	bus.subscribe("blocker", "test.status", lambda event: release.wait(TEST_TIMEOUT))
+	subscription = bus.subscribe("blocker", "test.status", called.append)	# queued behind the blocker, since they share a key
+	bus.subscribe("other", "test.status", called.append)
+	bus.publish("test.status", {})
+	bus.unsubscribe(subscription)
+	release.set()
+	wait_for(lambda: len(called) == 1 and subscription.pending == 0)
+	bus.unsubscribe_all("other")
+	assert bus.publish("test.status", {}) == 1
+	assert bus.get_metrics()["subscriptions"] == {"blocker": 1}
@@ -0,0 +1,116 @@
+# Copyright 2020 Scott Maday
+
+import os, sys, json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "op25"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from op25_codec import *
+
+
+# Stands in for a Channel_Configuration, whose trunk_rx.to_json() is what op25's trunking module reports
+class Fake_Channel(object):
+	def __init__(self, trunk_update):
+		self.trunk_rx = self
+		self._js = json.dumps(trunk_update)
+
+	def to_json(self):
+		return self._js
+###
+
+class Fake_Receiver(object):
+	def __init__(self, channels):
+		self.channels = channels
+###
+
+def trunk_update(nac, tsbks):
+	return {
+		"json_type":	"trunk_update",
+		"nacs":			[int(nac)],
+		nac:			{"system": "System %s" % nac, "tsbks": tsbks, "frequency_data": {"851012500": {"tgids": [1000], "counter": tsbks}}}
+	}
+
+def test_codecs_roundtrip():
+	obj = {"json_type": "trunk_update", "293": {"tsbks": 5, "frequency_data": {"851012500": {"tgids": [1000, None]}}}}
+	for codec in MESSAGE_CODECS:
+		assert codec.decode(codec.encode(obj)) == obj
+		assert get_codec_by_id(codec.codec_id) is codec and get_codec(codec.name) is codec
+	assert get_codec(None) is get_codec(CODEC_DEFAULT)
+	with pytest.raises(ValueError):
+		get_codec("pickle")
+
+def test_multi_receiver_update_survives_marshal():
+	op25_multi_receiver = pytest.importorskip("op25_multi_receiver")
+	pytest.importorskip("PyQt5")
+	from plugin_op25_gui import Trunk_Update_Coalescer
+	get_trunk_update = op25_multi_receiver.op25_multi_rx_block.__dict__["get_trunk_update"]
+	codec = get_codec("marshal")
+	receiver = Fake_Receiver([Fake_Channel(trunk_update("293", 1)), Fake_Channel(trunk_update("294", 1))])
+	first = codec.decode(codec.encode(get_trunk_update(receiver)))
+	assert sorted(first["nacs"]) == [293, 294]
+	receiver.channels[0] = Fake_Channel(trunk_update("293", 2))
+	second = codec.decode(codec.encode(get_trunk_update(receiver)))
+	assert sorted(key for key in second if is_nac_key(key)) == ["293", "294"]
+	coalescer = Trunk_Update_Coalescer()
+	coalescer.put(first)
+	coalescer.put(second)
+	pending, change_freq = coalescer.take()
+	assert pending["293"]["tsbks"] == 2 and change_freq is None
+	assert coalescer.get_metrics()["dropped"] == 2
+
+def test_is_nac_key_accepts_byte_and_text_keys():
+	for key in ["293", u"293", b"293"]:
+		assert is_nac_key(key)
+	for key in ["json_type", "nacs", u"nacs", "", 293, None]:
+		assert not is_nac_key(key)
+
+def test_marshal_keeps_nac_keys_usable():
+	codec = get_codec("marshal")
+	obj = codec.decode(codec.encode({"json_type": "trunk_update", "nacs": [293], "293": {"tsbks": 1}}))
+	assert [key for key in obj if is_nac_key(key)] == ["293"]
+
+def test_dict_delta_roundtrip():
+	old = {"a": 1, "b": {"c": 2, "d": 3}, "e": [1, 2], "gone": True}
+	new = {"a": 1, "b": {"c": 2, "d": 4, "f": 5}, "e": [1, 2, 3], "added": "x"}
+	delta = dict_delta(old, new)
+	assert delta["del"] == ["gone"]
+	assert delta["set"] == {"e": [1, 2, 3], "added": "x"}
+	assert delta["sub"] == {"b": {"set": {"d": 4, "f": 5}, "sub": {}, "del": []}}
+	assert dict_apply_delta(old, delta) == new
+	assert old["b"] == {"c": 2, "d": 3}		# the base is left alone
+	assert dict_delta(new, new) == {"set": {}, "sub": {}, "del": []}
+
+def test_delta_encoder_sends_keyframes_and_deltas():
+	encoder = Trunk_Update_Delta_Encoder(keyframe_interval = 2)
+	updates = [trunk_update("293", tsbks) for tsbks in range(5)]
+	msgs = [encoder.encode(update) for update in updates]
+	assert [msg["json_type"] for msg in msgs] == ["trunk_update", CODEC_DELTA_JSON_TYPE, CODEC_DELTA_JSON_TYPE, "trunk_update", CODEC_DELTA_JSON_TYPE]
+	assert [msg["seq"] for msg in msgs] == [1, 2, 3, 4, 5]
+	assert msgs[1]["base"] == 1 and msgs[4]["base"] == 4
+	assert "seq" not in updates[0]			# the snapshot passed in isn't modified
+	decoder = Trunk_Update_Delta_Decoder()
+	codec = get_codec("marshal")
+	for update, msg in zip(updates, msgs):
+		assert decoder.decode(codec.decode(codec.encode(msg))) == update
+	assert decoder.get_metrics() == {"keyframes": 2, "deltas": 3, "skipped": 0}
+
+def test_delta_decoder_skips_until_the_next_keyframe():
+	encoder = Trunk_Update_Delta_Encoder(keyframe_interval = 3)
+	updates = [trunk_update("293", tsbks) for tsbks in range(5)]
+	msgs = [encoder.encode(update) for update in updates]
+	decoder = Trunk_Update_Delta_Decoder()
+	assert decoder.decode(msgs[1]) is None			# nothing to apply it to yet
+	assert decoder.decode(msgs[0]) == updates[0]
+	assert decoder.decode(msgs[2]) is None			# msgs[1] was missed
+	assert decoder.decode(msgs[3]) is None
+	assert decoder.decode(msgs[4]) == updates[4]	# the keyframe resynchronizes
+	assert decoder.get_metrics() == {"keyframes": 2, "deltas": 0, "skipped": 3}
+
+def test_delta_decoder_returns_copies():
+	encoder = Trunk_Update_Delta_Encoder()
+	decoder = Trunk_Update_Delta_Decoder()
+	first = decoder.decode(encoder.encode(trunk_update("293", 1)))
+	first["293"] = None
+	assert decoder.decode(encoder.encode(trunk_update("293", 2)))["293"]["tsbks"] == 2
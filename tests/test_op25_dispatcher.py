@@ -0,0 +1,105 @@
+# Copyright 2020 Scott Maday
+
+import os, sys, time, threading
+
+import pytest
+
+pytest.importorskip("PyQt5")
+gr = pytest.importorskip("gnuradio.gr")
+pytest.importorskip("pluginlib")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "op25"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from plugin_op25 import *
+
+TEST_TIMEOUT	= 5.0
+TEST_DUID_TSBK	= 7			# a control channel data unit
+TEST_MSG_STATUS	= -2		# a status message, as op25 sends its json updates
+
+
+def message(text, msg_type):
+	return gr.message().make_from_string(text, msg_type, 0, 0)
+
+def wait_for(condition):
+	deadline = time.time() + TEST_TIMEOUT
+	while not condition():
+		assert time.time() < deadline, "timed out"
+		time.sleep(0.005)
+
+# Records what it's given, and holds the first message until it's released so the lanes can be filled up behind it
+class Blocking_Callback(object):
+	def __init__(self):
+		self.handled = []
+		self.started = threading.Event()
+		self.release = threading.Event()
+
+	def __call__(self, msg):
+		self.started.set()
+		assert self.release.wait(TEST_TIMEOUT)
+		self.handled.append(msg.to_string())
+###
+
+@pytest.fixture
+def dispatchers():
+	dispatchers = []
+	yield dispatchers
+	for dispatcher in dispatchers:
+		dispatcher.stop()
+
+def start_dispatcher(dispatchers, callback, lane_limit = DISPATCHER_LANE_LIMIT):
+	msgq = gr.msg_queue()
+	dispatcher = Message_Dispatcher(msgq, callback, lane_limit, name = "test_dispatcher")
+	dispatchers.append(dispatcher)
+	return msgq, dispatcher
+
+def test_control_lane_is_dispatched_first(dispatchers):
+	callback = Blocking_Callback()
+	msgq, dispatcher = start_dispatcher(dispatchers, callback)
+	msgq.insert_tail(message("status 0", TEST_MSG_STATUS))
+	assert callback.started.wait(TEST_TIMEOUT)
+	for i in range(1, 3):
+		msgq.insert_tail(message("status %d" % i, TEST_MSG_STATUS))
+		msgq.insert_tail(message("control %d" % i, TEST_DUID_TSBK))
+	wait_for(lambda: dispatcher.get_metrics()["received"] == 5)
+	assert dispatcher.get_metrics()["depth"] == [2, 2]
+	callback.release.set()
+	wait_for(lambda: dispatcher.get_metrics()["dispatched"] == 5)
+	assert callback.handled == ["status 0", "control 1", "control 2", "status 1", "status 2"]
+
+def test_full_lane_drops_its_oldest_messages(dispatchers):
+	callback = Blocking_Callback()
+	msgq, dispatcher = start_dispatcher(dispatchers, callback, lane_limit = 2)
+	msgq.insert_tail(message("control 0", TEST_DUID_TSBK))
+	assert callback.started.wait(TEST_TIMEOUT)
+	for i in range(1, 5):
+		msgq.insert_tail(message("control %d" % i, TEST_DUID_TSBK))
+	msgq.insert_tail(message("status 1", TEST_MSG_STATUS))
+	wait_for(lambda: dispatcher.get_metrics()["received"] == 6)
+	metrics = dispatcher.get_metrics()
+	assert metrics["dropped"] == [2, 0]			# the status lane has its own bound
+	assert metrics["depth"] == [2, 1] and metrics["max_depth"] == [2, 1]
+	callback.release.set()
+	wait_for(lambda: dispatcher.get_metrics()["dispatched"] == 4)
+	assert callback.handled == ["control 0", "control 3", "control 4", "status 1"]
+
+def test_callback_errors_are_counted(dispatchers):
+	handled = []
+	def callback(msg):
+		handled.append(msg.to_string())
+		if msg.to_string() == "bad":
+			raise ValueError("bad message")
+	msgq, dispatcher = start_dispatcher(dispatchers, callback)
+	msgq.insert_tail(message("bad", TEST_MSG_STATUS))
+	msgq.insert_tail(message("good", TEST_MSG_STATUS))
+	wait_for(lambda: dispatcher.get_metrics()["dispatched"] == 2)
+	metrics = dispatcher.get_metrics()
+	assert handled == ["bad", "good"]
+	assert metrics["errors"] == 1 and metrics["depth"] == [0, 0]
+	assert metrics["mean_latency_ms"] >= 0 and metrics["max_latency_ms"] >= 0
+
+def test_stop_ends_both_threads(dispatchers):
+	msgq, dispatcher = start_dispatcher(dispatchers, lambda msg: None)
+	dispatchers.remove(dispatcher)
+	dispatcher.stop()
+	assert not dispatcher._pump.is_alive() and not dispatcher._worker.is_alive()
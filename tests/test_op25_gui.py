@@ -0,0 +1,58 @@
+# Copyright 2020 Scott Maday
+
+import os, sys
+
+import pytest
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("gnuradio")
+pytest.importorskip("pluginlib")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "op25"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from plugin_op25_gui import Trunk_Update_Coalescer
+
+
+def trunk_update(nac, tsbks):
+	return {"json_type": "trunk_update", nac: {"tsbks": tsbks}}
+
+def change_freq(freq, tgid = None):
+	return {"json_type": "change_freq", "freq": freq, "tgid": tgid}
+
+def test_coalescer_merges_pending_trunk_updates():
+	coalescer = Trunk_Update_Coalescer()
+	coalescer.put(trunk_update("293", 1))
+	coalescer.put(trunk_update("294", 1))
+	coalescer.put(trunk_update("293", 2))
+	pending, freq = coalescer.take()
+	assert pending == {"json_type": "trunk_update", "293": {"tsbks": 2}, "294": {"tsbks": 1}}
+	assert freq is None
+	assert coalescer.get_metrics() == {"received": 3, "delivered": 1, "merged": 2, "dropped": 1}
+
+def test_coalescer_keeps_the_latest_change_freq():
+	coalescer = Trunk_Update_Coalescer()
+	coalescer.put(change_freq(851012500, 1000))
+	coalescer.put(change_freq(851025000, 1001))
+	coalescer.put(trunk_update("293", 1))
+	pending, freq = coalescer.take()
+	assert freq["freq"] == 851025000 and freq["tgid"] == 1001
+	assert pending["293"] == {"tsbks": 1}
+	metrics = coalescer.get_metrics()
+	assert metrics["merged"] == 1 and metrics["dropped"] == 0 and metrics["delivered"] == 2
+
+def test_coalescer_take_empties_it():
+	coalescer = Trunk_Update_Coalescer()
+	assert coalescer.take() == (None, None)
+	coalescer.put(trunk_update("293", 1))
+	coalescer.take()
+	assert coalescer.take() == (None, None)
+	coalescer.put(trunk_update("293", 2))		# nothing pending, so nothing is dropped
+	assert coalescer.get_metrics()["dropped"] == 0
+	assert coalescer.get_metrics()["delivered"] == 1
+
+def test_coalescer_ignores_other_messages():
+	coalescer = Trunk_Update_Coalescer()
+	coalescer.put({"json_type": "rx_update", "files": []})
+	assert coalescer.take() == (None, None)
+	assert coalescer.get_metrics()["received"] == 1
@@ -0,0 +1,81 @@
+# Copyright 2020 Scott Maday
+
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "plugins", "op25"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import op25_xor_cache
+from op25_xor_cache import *
+
+
+# Masks are made up from the system so the tests don't need apps/tdma
+@pytest.fixture
+def generated(monkeypatch):
+	generated = []
+	def generate_xor_mask(nac, sysid, wacn):
+		generated.append((nac, sysid, wacn))
+		return "mask-%x-%x-%x" % (nac, sysid, wacn)
+	monkeypatch.setattr(op25_xor_cache, "generate_xor_mask", generate_xor_mask)
+	return generated
+
+def test_get_generates_each_mask_once(tmp_path, generated):
+	cache = XOR_Mask_Cache(4, str(tmp_path / "masks.cache"))
+	assert cache.get(0x293, 0x1a2, 0xbee00) == (get_xor_mask_key(0x293, 0x1a2, 0xbee00), "mask-293-1a2-bee00")
+	assert cache.get(0x293, 0x1a2, 0xbee00)[1] == "mask-293-1a2-bee00"
+	assert generated == [(0x293, 0x1a2, 0xbee00)]
+	assert cache.get_metrics() == {"hits": 1, "misses": 1, "evictions": 0, "size": 1}
+
+def test_least_recently_used_mask_is_evicted(tmp_path, generated):
+	cache = XOR_Mask_Cache(2, str(tmp_path / "masks.cache"))
+	cache.get(1, 1, 1)
+	cache.get(2, 2, 2)
+	cache.get(1, 1, 1)				# 2 is now the least recently used
+	cache.get(3, 3, 3)
+	assert cache.get_metrics()["evictions"] == 1 and cache.get_metrics()["size"] == 2
+	del generated[:]
+	cache.get(1, 1, 1)
+	cache.get(3, 3, 3)
+	assert generated == []
+	cache.get(2, 2, 2)
+	assert generated == [(2, 2, 2)]
+
+def test_masks_persist_across_instances(tmp_path, generated):
+	file_name = str(tmp_path / "masks.cache")
+	XOR_Mask_Cache(4, file_name).get(0x293, 0x1a2, 0xbee00)
+	assert os.path.isfile(file_name)
+	del generated[:]
+	cache = XOR_Mask_Cache(4, file_name)
+	assert cache.get(0x293, 0x1a2, 0xbee00)[1] == "mask-293-1a2-bee00"
+	assert generated == []
+	assert cache.get_metrics()["hits"] == 1
+
+def test_load_keeps_only_the_most_recent_masks(tmp_path, generated):
+	file_name = str(tmp_path / "masks.cache")
+	cache = XOR_Mask_Cache(4, file_name)
+	for i in range(4):
+		cache.get(i, i, i)
+	cache = XOR_Mask_Cache(2, file_name)
+	cache.load()
+	assert cache.get_metrics()["size"] == 2
+	del generated[:]
+	cache.get(2, 2, 2)
+	cache.get(3, 3, 3)
+	assert generated == []
+
+def test_unreadable_cache_file_is_ignored(tmp_path, generated):
+	file_name = tmp_path / "masks.cache"
+	file_name.write_bytes(b"not a pickle")
+	cache = XOR_Mask_Cache(4, str(file_name))
+	assert cache.get(1, 2, 3)[1] == "mask-1-2-3"
+	assert generated == [(1, 2, 3)]
+	assert XOR_Mask_Cache(4, str(file_name)).get(1, 2, 3)[1] == "mask-1-2-3"	# rewritten with the new mask
+	assert len(generated) == 1
+
+def test_prewarm_generates_configured_systems(tmp_path, generated):
+	cache = XOR_Mask_Cache(4, str(tmp_path / "masks.cache"))
+	assert cache.prewarm([get_channel_system({"nac": "0x293"})]) is None		# doesn't name a whole system
+	cache.prewarm([None, get_channel_system({"nac": "0x293", "sysid": "0x1a2", "wacn": "0xbee00"}), (1, 2, 3)]).join()
+	assert sorted(generated) == [(1, 2, 3), (0x293, 0x1a2, 0xbee00)]
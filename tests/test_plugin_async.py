@@ -0,0 +1,75 @@
+# Copyright 2020 Scott Maday
+
+import os, sys, time, threading
+
+import pytest
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("pluginlib")
+asyncio = pytest.importorskip("asyncio")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import plugin as plugin_module
+from plugin import *
+
+TEST_TIMEOUT	= 5.0
+TEST_ALIAS		= "test_async"
+
+
+def wait_for(condition):
+	deadline = time.time() + TEST_TIMEOUT
+	while not condition():
+		assert time.time() < deadline, "timed out"
+		time.sleep(0.005)
+
+class Async_Test_Plugin(Plugin):
+	_alias_ = TEST_ALIAS
+	
+	def __init__(self, *args, **kwargs):
+		super(Async_Test_Plugin, self).__init__(*args, **kwargs)
+		self.waiting = threading.Event()
+	
+	async def on_loaded(self):
+		pass
+	
+	async def double(self, value):
+		await asyncio.sleep(0)
+		return value * 2
+	
+	async def slow_double(self, value):
+		self.waiting.set()
+		await asyncio.sleep(0.1)
+		return value * 2
+	
+	async def invoke_now_double(self, value):
+		return self.invoke_now("double", value)
+###
+
+def empty_configuration(file_name):
+	return Root_Configuration(file_name, Structure_Object("root"))
+
+@pytest.fixture
+def plugin(tmp_path):
+	return Async_Test_Plugin(empty_configuration(str(tmp_path / "main.json")), empty_configuration(str(tmp_path / "config.json")))
+
+def test_coroutine_methods_run_on_the_loop(plugin):
+	assert plugin.invoke("double", 2).result(TEST_TIMEOUT) == 4
+	assert plugin.invoke_now("double", 3) == 6		# waits for the loop from this thread
+
+def test_invoke_now_refuses_to_wait_on_the_loop(plugin):
+	future = plugin.invoke("invoke_now_double", 2)
+	assert isinstance(future.exception(TEST_TIMEOUT), RuntimeError)
+
+def test_proxy_returns_the_loops_future(tmp_path, monkeypatch, plugin):
+	module = tmp_path / "plugin_test_async.py"
+	module.write_text(u"class Async_Test_Plugin(Plugin):\n\t_alias_ = %r\n" % TEST_ALIAS)
+	monkeypatch.setattr(plugin_module, "plugin_config_from_module_dir", lambda module_dir: plugin.plugin_config)
+	monkeypatch.setattr(plugin_module, "plugin_class_from_module", lambda module: Async_Test_Plugin)
+	proxy = Plugin_Proxy(str(module), plugin._main_config)
+	assert proxy.alias == TEST_ALIAS and proxy.plugin is None
+	future = proxy.invoke("slow_double", 4)
+	wait_for(lambda: proxy.plugin is not None and proxy.plugin.waiting.is_set())
+	assert TEST_ALIAS not in plugin_executor.get_metrics()["running"]		# no executor thread waits on the coroutine
+	assert future.result(TEST_TIMEOUT) == 8
+	assert proxy.invoke("double", 5).result(TEST_TIMEOUT) == 10
@@ -0,0 +1,127 @@
+# Copyright 2020 Scott Maday
+
+import os, sys, time, threading
+
+import pytest
+
+pytest.importorskip("PyQt5")
+pytest.importorskip("pluginlib")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from plugin import *
+
+TEST_TIMEOUT	= 5.0
+
+
+def wait_for(condition):
+	deadline = time.time() + TEST_TIMEOUT
+	while not condition():
+		assert time.time() < deadline, "timed out"
+		time.sleep(0.005)
+
+# Calls that block until they're released, recording the order they started in
+class Gate(object):
+	def __init__(self):
+		self.started = []
+		self.release = threading.Event()
+		self._lock = threading.Lock()
+
+	def call(self, name):
+		with self._lock:
+			self.started.append(name)
+		assert self.release.wait(TEST_TIMEOUT)
+		return name
+###
+
+@pytest.fixture
+def gate():
+	gate = Gate()
+	yield gate
+	gate.release.set()
+
+@pytest.fixture
+def executor(gate):
+	executor = Plugin_Executor(max_workers = 4)
+	yield executor
+	gate.release.set()
+	executor.shutdown()
+
+def test_calls_of_one_key_wait_for_its_limit(executor, gate):
+	futures = [executor.submit("a", gate.call, ("a%d" % i,)) for i in range(3)]
+	other = executor.submit("b", gate.call, ("b0",))
+	wait_for(lambda: len(gate.started) == 2)
+	time.sleep(0.05)
+	assert sorted(gate.started) == ["a0", "b0"]		# the other key isn't held up by a's backlog
+	metrics = executor.get_metrics()
+	assert metrics["running"] == {"a": 1, "b": 1} and metrics["queued"] == 2
+	gate.release.set()
+	assert [future.result(TEST_TIMEOUT) for future in futures] == ["a0", "a1", "a2"]
+	assert other.result(TEST_TIMEOUT) == "b0"
+	assert [name for name in gate.started if name.startswith("a")] == ["a0", "a1", "a2"]
+	wait_for(lambda: executor.get_metrics()["running"] == {})
+	assert executor.get_metrics()["completed"] == 4
+
+def test_set_limit_lets_more_calls_of_a_key_run(executor, gate):
+	executor.set_limit("a", 2)
+	futures = [executor.submit("a", gate.call, ("a%d" % i,)) for i in range(3)]
+	wait_for(lambda: len(gate.started) == 2)
+	time.sleep(0.05)
+	assert len(gate.started) == 2 and executor.get_metrics()["queued"] == 1
+	gate.release.set()
+	assert sorted(future.result(TEST_TIMEOUT) for future in futures) == ["a0", "a1", "a2"]
+
+def test_timed_out_call_keeps_its_slot(executor, gate):
+	future = executor.submit("a", gate.call, ("a0",), timeout = 0.05)
+	queued = executor.submit("a", gate.call, ("a1",))
+	with pytest.raises(Plugin_Timeout_Error):
+		future.result(TEST_TIMEOUT)
+	wait_for(lambda: executor.get_metrics()["timed_out"] == 1)
+	assert gate.started == ["a0"] and not queued.done()		# the thread can't be interrupted, so a0 still runs
+	gate.release.set()
+	assert queued.result(TEST_TIMEOUT) == "a1"
+	assert future.done() and isinstance(future.exception(), Plugin_Timeout_Error)
+
+def test_failures_are_returned_and_counted(executor):
+	def fail():
+		raise ValueError("failed")
+	future = executor.submit("a", fail)
+	assert isinstance(future.exception(TEST_TIMEOUT), ValueError)
+	with pytest.raises(ValueError):
+		future.result()
+	wait_for(lambda: executor.get_metrics()["failed"] == 1)
+	assert executor.submit("a", lambda: "next").result(TEST_TIMEOUT) == "next"
+
+def test_queued_calls_can_be_cancelled(executor, gate):
+	running = executor.submit("a", gate.call, ("a0",))
+	queued = executor.submit("a", gate.call, ("a1",))
+	wait_for(lambda: gate.started == ["a0"])
+	assert not running.cancel()
+	assert queued.cancel()
+	with pytest.raises(Plugin_Cancelled_Error):
+		queued.result(TEST_TIMEOUT)
+	gate.release.set()
+	assert running.result(TEST_TIMEOUT) == "a0"
+	wait_for(lambda: executor.get_metrics()["running"] == {})
+	assert gate.started == ["a0"]
+
+def test_spawned_calls_hold_neither_a_slot_nor_a_pool_thread(executor, gate):
+	spawned = executor.spawn("a", gate.call, ("spawned",))
+	wait_for(lambda: gate.started == ["spawned"])
+	assert executor.submit("a", lambda: "pooled").result(TEST_TIMEOUT) == "pooled"
+	metrics = executor.get_metrics()
+	assert metrics["spawned"] == 1 and metrics["threads"] == 1
+	gate.release.set()
+	assert spawned.result(TEST_TIMEOUT) == "spawned"
+
+def test_shutdown_cancels_calls_that_have_not_started(gate):
+	executor = Plugin_Executor(max_workers = 1)
+	running = executor.submit("a", gate.call, ("a0",))
+	queued = executor.submit("b", gate.call, ("b0",))
+	wait_for(lambda: gate.started == ["a0"])
+	executor.shutdown(wait = False)
+	assert isinstance(queued.exception(TEST_TIMEOUT), Plugin_Cancelled_Error)
+	assert isinstance(executor.submit("a", gate.call, ("a1",)).exception(TEST_TIMEOUT), Plugin_Cancelled_Error)
+	gate.release.set()
+	assert running.result(TEST_TIMEOUT) == "a0"
+	executor.shutdown()